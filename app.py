@@ -1,11 +1,14 @@
 import streamlit as st
 import os
 import tempfile
+import itertools
 from pathlib import Path
 
 from data_processor import DataProcessor
 from vector_store_faiss import FAISSVectorStore
-from chatbot import RAGChatbot
+from chatbot import RAGChatbot, create_answer_cache
+from utils.pipeline import IngestionPipeline
+from utils import metrics
 import config
 
 # Page configuration
@@ -15,9 +18,28 @@ st.set_page_config(
     layout="wide"
 )
 
+@st.cache_resource
+def get_vector_store():
+    """One vector store shared by every session, so the index is held in memory once"""
+    return FAISSVectorStore()
+
+@st.cache_resource
+def get_answer_cache():
+    """One answer cache shared by every session"""
+    return create_answer_cache() if config.ANSWER_CACHE_ENABLED else None
+
+@st.cache_resource
+def start_metrics_server():
+    """Expose Prometheus metrics once per process, if a port is configured"""
+    if config.METRICS_PORT:
+        return metrics.start_http_server(config.METRICS_PORT)
+    return None
+
+start_metrics_server()
+
 # Initialize session state
 if 'chatbot' not in st.session_state:
-    st.session_state.chatbot = RAGChatbot()
+    st.session_state.chatbot = RAGChatbot(answer_cache=get_answer_cache(), vector_store=get_vector_store())
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
 if 'vector_store_ready' not in st.session_state:
@@ -30,50 +52,62 @@ def check_vector_store_status():
     return info
 
 def process_files(excel_file, zip_file):
-    """Process uploaded files and create vector store"""
+    """Process uploaded files and stream them into the vector store"""
     
     processor = DataProcessor()
-    vector_store = FAISSVectorStore()
+    vector_store = get_vector_store()
     
     with st.spinner("Processing files..."):
-        all_documents = []
+        sources = []
+        tmp_paths = []
         
         # Process Excel file (websites)
         if excel_file:
             with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_excel:
                 tmp_excel.write(excel_file.getbuffer())
-                tmp_excel_path = tmp_excel.name
+                tmp_paths.append(tmp_excel.name)
             
             st.info("Extracting URLs from Excel and scraping websites...")
-            web_docs = processor.process_excel_file(tmp_excel_path)
-            all_documents.extend(web_docs)
-            os.unlink(tmp_excel_path)
+            sources.append(processor.iter_excel_documents(tmp_excel.name, vector_store.is_unchanged))
         
         # Process ZIP file (PDFs)
         if zip_file:
             with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as tmp_zip:
                 tmp_zip.write(zip_file.getbuffer())
-                tmp_zip_path = tmp_zip.name
+                tmp_paths.append(tmp_zip.name)
             
             st.info("Extracting and processing PDFs...")
-            pdf_docs = processor.process_zip_file(tmp_zip_path)
-            all_documents.extend(pdf_docs)
-            os.unlink(tmp_zip_path)
-        
-        if all_documents:
-            # Chunk documents
-            st.info("Chunking documents...")
-            chunked_docs = processor.chunk_documents(all_documents)
-            
-            # Create vector store
-            st.info("Creating FAISS vector index...")
-            vector_store.add_documents(chunked_docs)
-            
-            st.success(f"Successfully processed {len(all_documents)} documents into {len(chunked_docs)} chunks using FAISS!")
+            sources.append(processor.process_zip_file_chunks(tmp_zip.name, vector_store.is_unchanged))
+        
+        # Extract -> chunk -> embed -> index, one bounded batch at a time
+        progress_text = st.empty()
+        
+        def show_progress(counts):
+            progress_text.info(
+                f"Extracted {counts['extract']} · chunked {counts['chunk']} · "
+                f"embedded {counts['embed']} · indexed {counts['index']}"
+            )
+        
+        pipeline = IngestionPipeline(
+            vector_store,
+            processor.iter_chunks,
+            embed_batch_size=config.PIPELINE_EMBED_BATCH_SIZE,
+            index_batch_size=config.PIPELINE_INDEX_BATCH_SIZE,
+            queue_size=config.PIPELINE_QUEUE_SIZE,
+            progress=show_progress
+        )
+        try:
+            counts = pipeline.run(itertools.chain.from_iterable(sources))
+        finally:
+            for path in tmp_paths:
+                os.unlink(path)
+        
+        if counts['index']:
+            st.success(f"Successfully processed {counts['sources']} documents into {counts['index']} new chunks using FAISS!")
             st.session_state.vector_store_ready = True
             
         else:
-            st.error("No documents were processed. Please check your files.")
+            st.warning("No new content was added. The files were empty or are already in the knowledge base.")
 
 def main():
     # Create two columns
@@ -103,6 +137,12 @@ def main():
         if st.session_state.vector_store_ready:
             st.success(f"✅ FAISS index ready with {info['count']} vectors")
             st.info(f"📊 Vector dimension: {info.get('dimension', 'N/A')}")
+            
+            answer_cache = st.session_state.chatbot.answer_cache
+            if answer_cache is not None:
+                cache_stats = answer_cache.stats()
+                st.caption(f"Answer cache: {cache_stats['entries']} answers · "
+                           f"{cache_stats['hit_rate']:.0%} hit rate")
         else:
             st.warning("⚠️ No data loaded")
         
@@ -132,9 +172,25 @@ def main():
                     st.success("FAISS data deleted successfully!")
                     st.session_state.vector_store_ready = False
                     st.session_state.chat_history = []
+                    st.session_state.chatbot.reset_conversation()
                     st.rerun()
                 else:
                     st.error("Error deleting data")
+        
+        # Per-stage latency of questions and ingestion in this process
+        with st.expander("🩺 Diagnostics"):
+            request_stages = metrics.stage_summary(metrics.REQUEST_STAGE_SECONDS)
+            ingest_stages = metrics.stage_summary(metrics.INGEST_STAGE_SECONDS)
+            if request_stages:
+                st.caption("Request stages (ms)")
+                st.dataframe(request_stages, hide_index=True)
+            if ingest_stages:
+                st.caption("Ingestion stages (ms per batch)")
+                st.dataframe(ingest_stages, hide_index=True)
+            if not (request_stages or ingest_stages):
+                st.caption("No requests timed yet")
+            if config.METRICS_PORT:
+                st.caption(f"Prometheus metrics on port {config.METRICS_PORT} at /metrics")
     
     # Main chat interface
     if st.session_state.vector_store_ready:
@@ -154,9 +210,26 @@ def main():
             
             # Generate response
             with st.chat_message("assistant"):
+                placeholder = st.empty()
                 with st.spinner("Thinking..."):
-                    response = st.session_state.chatbot.generate_response(prompt)
-                st.write(response)
+                    # Earlier messages, without the question just appended
+                    tokens = st.session_state.chatbot.generate_response_stream(
+                        prompt, st.session_state.chat_history[:-1])
+                    # Wait for the first token under the spinner, then stream the rest
+                    first = next(tokens, "")
+                response = first
+                placeholder.markdown(response + "▌")
+                for token in tokens:
+                    response += token
+                    placeholder.markdown(response + "▌")
+                placeholder.markdown(response)
+                
+                stats = st.session_state.chatbot.last_turn_stats
+                if stats and stats['cached']:
+                    st.caption(f"Answered from cache in {stats['total_time']:.2f}s")
+                elif stats and stats['time_to_first_token'] is not None:
+                    st.caption(f"First token in {stats['time_to_first_token']:.2f}s · "
+                               f"{stats['tokens_per_sec']:.1f} tokens/s")
             
             # Add assistant response to chat history
             st.session_state.chat_history.append({"role": "assistant", "content": response})
@@ -164,6 +237,7 @@ def main():
         # Clear chat button
         if st.button("🧹 Clear Chat History"):
             st.session_state.chat_history = []
+            st.session_state.chatbot.reset_conversation()
             st.rerun()
     
     else:
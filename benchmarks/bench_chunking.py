@@ -0,0 +1,85 @@
+"""Check the in-repo splitter against langchain's RecursiveCharacterTextSplitter and compare their speed.
+
+Every fixed input and synthetic document must come out as exactly the same
+chunks; the script exits non-zero on the first mismatch.
+
+Usage: python benchmarks/bench_chunking.py [--documents 200] [--paragraphs 50]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter  # noqa: E402
+
+from benchmarks.synthetic import synthetic_chunks  # noqa: E402
+from utils.text_splitter import RecursiveTextSplitter  # noqa: E402
+
+# (chunk_size, chunk_overlap) pairs exercised on every fixed input
+SETTINGS = ((1000, 200), (100, 20), (10, 0), (5, 4), (1, 0))
+
+FIXED_INPUTS = [
+    "",
+    "   ",
+    "\n\n\n\n",
+    "short text",
+    "one\n\ntwo\n\n\n\nthree\nfour five  six\n",
+    "  leading and trailing whitespace  \n\n  around paragraphs  ",
+    "x" * 2500,
+    ("word " * 400).strip(),
+    "line\n" * 300,
+    "\n".join("a" * n for n in range(1, 60)),
+    "para one " * 80 + "\n\n" + "para two " * 150 + "\n\n" + "y" * 1200 + "\n\nend",
+    "mixed\ttabs\r\nand non-breaking spaces " * 60,
+    "unicode éè 中文 \U0001f600 text " * 90,
+]
+
+
+def check(text: str, chunk_size: int, chunk_overlap: int):
+    reference = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                               length_function=len).split_text(text)
+    ours = RecursiveTextSplitter(chunk_size, chunk_overlap).split_text(text)
+    if ours != reference:
+        print(f"MISMATCH chunk_size={chunk_size} chunk_overlap={chunk_overlap} text={text[:60]!r}...")
+        print(f"  langchain: {len(reference)} chunks, ours: {len(ours)} chunks")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=200)
+    parser.add_argument('--paragraphs', type=int, default=50)
+    args = parser.parse_args()
+
+    for text in FIXED_INPUTS:
+        for chunk_size, chunk_overlap in SETTINGS:
+            check(text, chunk_size, chunk_overlap)
+
+    paragraphs = synthetic_chunks(args.documents * args.paragraphs, 160)
+    documents = ['\n\n'.join(paragraphs[start:start + args.paragraphs])
+                 for start in range(0, len(paragraphs), args.paragraphs)]
+    for document in documents[:20]:
+        check(document, 1000, 200)
+
+    langchain_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
+    splitter = RecursiveTextSplitter(1000, 200)
+
+    start = time.perf_counter()
+    n_chunks = sum(len(langchain_splitter.split_text(document)) for document in documents)
+    langchain_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    n_ours = sum(len(splitter.split_text(document)) for document in documents)
+    ours_secs = time.perf_counter() - start
+
+    print(f"fixed inputs: {len(FIXED_INPUTS) * len(SETTINGS)} cases match")
+    print(f"documents:    {len(documents)} ({n_chunks} chunks, {n_ours} ours)")
+    print(f"langchain:    {n_chunks / langchain_secs:,.0f} chunks/sec")
+    print(f"in-repo:      {n_ours / ours_secs:,.0f} chunks/sec")
+    print(f"speedup:      {langchain_secs / ours_secs:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""Compare per-text and batched SimpleEmbedding encoding throughput.
+
+Usage: python benchmarks/bench_embedding.py [--chunks 20000] [--words 160]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.synthetic import synthetic_chunks  # noqa: E402
+from vector_store_faiss import SimpleEmbedding  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunks', type=int, default=20000)
+    parser.add_argument('--words', type=int, default=160)
+    args = parser.parse_args()
+    
+    texts = synthetic_chunks(args.chunks, args.words)
+    model = SimpleEmbedding(384)
+    model._build_vocabulary(texts)
+    
+    start = time.perf_counter()
+    per_text = np.array([model._text_to_vector(text) for text in texts])
+    per_text_secs = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    batched = model.encode(texts)
+    batched_secs = time.perf_counter() - start
+    
+    print(f"chunks:      {len(texts)}")
+    print(f"per-text:    {len(texts) / per_text_secs:,.0f} chunks/sec")
+    print(f"batched:     {len(texts) / batched_secs:,.0f} chunks/sec")
+    print(f"speedup:     {per_text_secs / batched_secs:.1f}x")
+    print(f"max abs diff {np.abs(per_text - batched).max():.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Recall and latency of each FAISS index type against the exact Flat baseline.
+
+Vectors are synthetic clustered unit vectors of EMBEDDING_DIM dimensions.
+The second table compares the quantized storage types by index size per
+vector and recall, raw and re-ranked from a memory-mapped vectors.npy
+the way FAISSVectorStore does with RERANK_FACTOR.
+
+Usage: python benchmarks/bench_index_types.py [--vectors 200000] [--queries 1000] [--k 10] [--rerank 4]
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import config  # noqa: E402
+from utils.index_factory import build_index, configure_search, rerank  # noqa: E402
+
+
+def synthetic_vectors(n_vectors: int, n_clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Unit vectors scattered around random cluster centres"""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((n_clusters, config.EMBEDDING_DIM)).astype(np.float32)
+    vectors = centres[rng.integers(0, n_clusters, n_vectors)]
+    vectors += 0.6 * rng.standard_normal(vectors.shape).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def measure(index, queries: np.ndarray, k: int, truth: np.ndarray):
+    """Return (recall@k, mean ms per query) for single-query searches"""
+    start = time.perf_counter()
+    found = np.vstack([index.search(queries[i:i + 1], k)[1] for i in range(len(queries))])
+    latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    recall = np.mean([len(np.intersect1d(found[i], truth[i])) / k for i in range(len(queries))])
+    return recall, latency_ms
+
+
+def measure_reranked(index, vectors: np.ndarray, queries: np.ndarray, k: int, factor: int, truth: np.ndarray):
+    """Return (recall@k, mean ms per query) fetching k * factor candidates and re-scoring them from vectors"""
+    start = time.perf_counter()
+    found = np.vstack([rerank(vectors, queries[i:i + 1], index.search(queries[i:i + 1], k * factor)[1], k)[1]
+                       for i in range(len(queries))])
+    latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    recall = np.mean([len(np.intersect1d(found[i], truth[i])) / k for i in range(len(queries))])
+    return recall, latency_ms
+
+
+def quantized_storage(data: np.ndarray, queries: np.ndarray, k: int, factor: int, truth: np.ndarray):
+    """Print bytes per vector and raw and re-ranked recall of the quantized index types"""
+    print(f"\n{'index':<10} {'bytes/vec':>9} {'recall@' + str(k):>10} {'ms/query':>9} "
+          f"{'reranked':>9} {'ms/query':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "vectors.npy"
+        np.save(path, data)
+        vectors = np.load(path, mmap_mode='r')
+        for index_type in ('flat', 'fp16', 'sq8', 'pq', 'ivfpq'):
+            index = build_index([data], index_type)
+            bytes_per_vector = len(faiss.serialize_index(index)) / len(data)
+            recall, latency = measure(index, queries, k, truth)
+            reranked, reranked_latency = measure_reranked(index, vectors, queries, k, factor, truth)
+            print(f"{index_type:<10} {bytes_per_vector:>9.0f} {recall:>10.3f} {latency:>9.3f} "
+                  f"{reranked:>9.3f} {reranked_latency:>9.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vectors', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--rerank', type=int, default=config.RERANK_FACTOR)
+    args = parser.parse_args()
+
+    data = synthetic_vectors(args.vectors)
+    queries = synthetic_vectors(args.queries, seed=1)
+
+    print(f"{'index':<10} {'knob':<14} {'build s':>8} {'recall@' + str(args.k):>10} {'ms/query':>9}")
+
+    start = time.perf_counter()
+    flat = build_index([data], 'flat')
+    build_secs = time.perf_counter() - start
+    truth = flat.search(queries, args.k)[1]
+    recall, latency = measure(flat, queries, args.k, truth)
+    print(f"{'flat':<10} {'-':<14} {build_secs:>8.1f} {recall:>10.3f} {latency:>9.3f}")
+
+    sweeps = {
+        'ivfflat': ('nprobe', 'IVF_NPROBE', [1, 4, 16, 64]),
+        'ivfpq': ('nprobe', 'IVF_NPROBE', [1, 4, 16, 64]),
+        'hnsw': ('efSearch', 'HNSW_EF_SEARCH', [16, 32, 64, 128]),
+    }
+    for index_type, (label, knob, values) in sweeps.items():
+        start = time.perf_counter()
+        index = build_index([data], index_type)
+        build_secs = time.perf_counter() - start
+        for value in values:
+            setattr(config, knob, value)
+            configure_search(index)
+            recall, latency = measure(index, queries, args.k, truth)
+            print(f"{index_type:<10} {label + '=' + str(value):<14} "
+                  f"{build_secs:>8.1f} {recall:>10.3f} {latency:>9.3f}")
+
+    config.IVF_NPROBE = 16
+    quantized_storage(data, queries, args.k, args.rerank, truth)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Check the pooled LLM service against a local fake Ollama server and measure its throughput.
+
+Checks the in-flight limit, round-robin fairness across sessions, cancellation
+of abandoned streams, backpressure, keep-alive and connection reuse; the
+script exits non-zero on the first failure.
+
+Usage: python benchmarks/bench_llm_service.py [--sessions 8] [--requests 4] [--in-flight 4]
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.synthetic import FakeOllamaServer  # noqa: E402
+from utils.llm_service import LLMBusyError, LLMService  # noqa: E402
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        print(f"FAILED {message}")
+        sys.exit(1)
+    print(f"ok     {message}")
+
+
+def answer(service: LLMService, session: str, prompt: str) -> str:
+    return ''.join(part['response'] for part in service.client(session).generate('fake', prompt, stream=True))
+
+
+def run(server: FakeOllamaServer, in_flight: int, jobs, **kwargs):
+    """Answer (session, prompt) jobs from one thread each, returning the service and the results or errors"""
+    service = LLMService(server.url, max_in_flight=in_flight, **kwargs)
+
+    def attempt(job):
+        try:
+            return answer(service, *job)
+        except LLMBusyError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        futures = []
+        for job in jobs:
+            futures.append(pool.submit(attempt, job))
+            # Submit in order, so the queue sees them in that order
+            time.sleep(0.002)
+        results = [future.result() for future in futures]
+    return service, results
+
+
+def check_limit_and_reuse(in_flight: int):
+    with FakeOllamaServer(n_tokens=16, token_delay=0.005) as server:
+        jobs = [(f"s{i % 3}", f"p{i}") for i in range(24)]
+        service, results = run(server, in_flight, jobs, num_ctx=4096)
+        check(all(isinstance(result, str) and result.count('token') == 16 for result in results),
+              "every generation streams its full response")
+        check(server.max_in_flight <= in_flight, f"at most {in_flight} generations in flight "
+                                                 f"(saw {server.max_in_flight})")
+        check(server.connections <= in_flight, f"connections are pooled ({server.connections} for 24 requests)")
+        check(server.keep_alive == {"30m"}, "keep_alive is sent with every request")
+        check(server.num_ctx == {4096}, "num_ctx is sent with every request")
+        service.client("own").generate('fake', "own window", options={'num_ctx': 8192})
+        check(server.num_ctx == {4096, 8192}, "a request's own num_ctx wins")
+        service.close()
+
+
+def check_fairness():
+    with FakeOllamaServer(n_tokens=8, token_delay=0.01) as server:
+        jobs = [("heavy", f"heavy{i}") for i in range(12)] + [(f"light{i}", f"light{i}") for i in range(3)]
+        service, _ = run(server, 2, jobs)
+        positions = [server.completed.index(f"light{i}") for i in range(3)]
+        check(max(positions) < 8, f"single questions are not stuck behind a busy session (done at {positions})")
+        service.close()
+
+
+def check_cancellation():
+    with FakeOllamaServer(n_tokens=200, token_delay=0.01) as server:
+        service = LLMService(server.url, max_in_flight=1)
+        stream = service.client("leaver").generate('fake', "abandoned", stream=True)
+        next(stream)
+        stream.close()
+        start = time.perf_counter()
+        result = answer(service, "stayer", "next")
+        check(result.count('token') == 200 and time.perf_counter() - start < 3,
+              "closing a stream frees its slot at once")
+        deadline = time.time() + 2
+        while not server.abandoned and time.time() < deadline:
+            time.sleep(0.01)
+        check(server.abandoned == 1 and "abandoned" not in server.completed, "the abandoned request is cancelled")
+        service.close()
+
+
+def check_backpressure():
+    with FakeOllamaServer(n_tokens=20, token_delay=0.01) as server:
+        service, results = run(server, 1, [(f"s{i}", f"p{i}") for i in range(5)], max_queued=2)
+        busy = sum(isinstance(result, LLMBusyError) for result in results)
+        check(busy == 2, f"requests beyond the queue bound are turned away ({busy} of 5)")
+        service.close()
+
+        service, results = run(server, 1, [(f"s{i}", f"p{i}") for i in range(3)], queue_timeout=0.1)
+        busy = sum(isinstance(result, LLMBusyError) for result in results)
+        check(busy == 2, f"requests waiting past the queue timeout give up ({busy} of 3)")
+        service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=4)
+    parser.add_argument('--in-flight', type=int, default=4)
+    args = parser.parse_args()
+
+    check_limit_and_reuse(args.in_flight)
+    check_fairness()
+    check_cancellation()
+    check_backpressure()
+
+    with FakeOllamaServer(n_tokens=64, token_delay=0.002) as server:
+        jobs = [(f"s{i % args.sessions}", f"p{i}") for i in range(args.sessions * args.requests)]
+        start = time.perf_counter()
+        service, _ = run(server, args.in_flight, jobs)
+        seconds = time.perf_counter() - start
+        service.close()
+    print(f"generations:  {len(jobs)} from {args.sessions} sessions, {args.in_flight} in flight")
+    print(f"throughput:   {len(jobs) / seconds:.1f} generations/s")
+
+
+if __name__ == '__main__':
+    main()
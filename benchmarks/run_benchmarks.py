@@ -0,0 +1,337 @@
+"""Benchmark the ingest and query paths offline and write the results as JSON.
+
+Every case runs in its own subprocess against a temporary store, so peak RSS
+is measured per case. Corpora and PDFs are synthetic and Ollama is mocked.
+Pass --compare with an earlier results file to see the change per case.
+
+Cases:
+  embed    SimpleEmbedding.encode throughput, latency per EMBEDDING_BATCH_SIZE batch
+  chunk    DataProcessor.chunk_documents throughput, latency per document
+  pdf      PDFExtractor.iter_pdf_chunks over --pdfs synthetic PDFs
+  ingest   FAISSVectorStore.add_documents per PIPELINE_INDEX_BATCH_SIZE batch, then full compaction
+  search   FAISSVectorStore.search latency per query and search_batch throughput
+  chat     RAGChatbot.generate_response end to end with a mocked Ollama
+
+Usage: python benchmarks/run_benchmarks.py [--sizes 10000,100000,1000000] [--cases embed,chunk,...]
+           [--queries 1000] [--pdfs 32] [--output benchmark-results.json] [--compare old.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import config  # noqa: E402
+from benchmarks.synthetic import (MockOllamaClient, synthetic_chunks,  # noqa: E402
+                                  synthetic_documents, synthetic_pdfs)
+
+CASES = ('embed', 'chunk', 'pdf', 'ingest', 'search', 'chat')
+
+
+def latency_summary(seconds: List[float]) -> Dict:
+    """p50/p95/p99 and mean of a list of timings, in milliseconds"""
+    if not seconds:
+        return {}
+    ms = np.asarray(seconds) * 1000
+    return {
+        'p50': float(np.percentile(ms, 50)),
+        'p95': float(np.percentile(ms, 95)),
+        'p99': float(np.percentile(ms, 99)),
+        'mean': float(ms.mean())
+    }
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def directory_size(path: Path) -> int:
+    return sum(file.stat().st_size for file in Path(path).rglob('*') if file.is_file())
+
+
+def use_temporary_store(directory: Path):
+    """Point the vector store at an empty directory and keep compaction out of the timings"""
+    import vector_store_faiss
+
+    config.FAISS_DB_DIR = directory
+    config.FAISS_INDEX_FILE = directory / "faiss_index.bin"
+    config.METADATA_FILE = directory / "metadata.pkl"
+    config.EXTRACTED_DIR = directory / "extracted"
+    config.COMPACTION_MAX_SEGMENTS = sys.maxsize
+    config.ANSWER_CACHE_ENABLED = False
+    vector_store_faiss._resident = None
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def build_store(size: int):
+    """Ingest size synthetic chunks in pipeline-sized batches, timing each batch"""
+    from vector_store_faiss import FAISSVectorStore
+
+    store = FAISSVectorStore()
+    documents = synthetic_documents(size)
+    batch_size = config.PIPELINE_INDEX_BATCH_SIZE
+    batch_seconds = []
+    for start in range(0, len(documents), batch_size):
+        _, seconds = timed(store.add_documents, documents[start:start + batch_size])
+        batch_seconds.append(seconds)
+    return store, batch_seconds
+
+
+def bench_embed(size: int, args) -> Dict:
+    from vector_store_faiss import SimpleEmbedding
+
+    texts = synthetic_chunks(size, 160)
+    model = SimpleEmbedding(config.EMBEDDING_DIM)
+    _, vocab_seconds = timed(model._build_vocabulary, texts)
+
+    batch_size = config.EMBEDDING_BATCH_SIZE
+    batch_seconds = [timed(model.encode, texts[start:start + batch_size])[1]
+                     for start in range(0, len(texts), batch_size)]
+    return {
+        'throughput': size / sum(batch_seconds),
+        'unit': 'chunks/s',
+        'latency_ms': latency_summary(batch_seconds),
+        'vocabulary_seconds': vocab_seconds
+    }
+
+
+def bench_chunk(size: int, args) -> Dict:
+    from data_processor import DataProcessor
+
+    # Documents long enough to come out as about 50 chunks each
+    texts = synthetic_chunks(size, 160)
+    documents = [{'content': '\n\n'.join(texts[start:start + 50]), 'source': f"doc{start}", 'type': 'pdf'}
+                 for start in range(0, len(texts), 50)]
+    processor = DataProcessor()
+
+    n_chunks, doc_seconds = 0, []
+    for document in documents:
+        chunks, seconds = timed(processor.chunk_documents, [document])
+        n_chunks += len(chunks)
+        doc_seconds.append(seconds)
+    return {
+        'throughput': n_chunks / sum(doc_seconds),
+        'unit': 'chunks/s',
+        'latency_ms': latency_summary(doc_seconds),
+        'chunks': n_chunks,
+        'documents': len(documents)
+    }
+
+
+def bench_pdf(size: int, args) -> Dict:
+    from data_processor import DataProcessor
+
+    pdf_files = synthetic_pdfs(config.FAISS_DB_DIR / "pdfs", args.pdfs, args.pages)
+    processor = DataProcessor()
+
+    chunk_times = []
+    start = last = time.perf_counter()
+    for _ in processor.pdf_extractor.iter_pdf_chunks(pdf_files, processor.text_splitter):
+        now = time.perf_counter()
+        chunk_times.append(now - last)
+        last = now
+    seconds = time.perf_counter() - start
+    return {
+        'throughput': args.pdfs * args.pages / seconds,
+        'unit': 'pages/s',
+        'latency_ms': latency_summary(chunk_times),
+        'chunks': len(chunk_times),
+        'total_seconds': seconds,
+        'workers': processor.pdf_extractor.workers
+    }
+
+
+def bench_ingest(size: int, args) -> Dict:
+    start = time.perf_counter()
+    store, batch_seconds = build_store(size)
+    ingest_seconds = time.perf_counter() - start
+    _, compact_seconds = timed(store.compact, True)
+    return {
+        'throughput': size / ingest_seconds,
+        'unit': 'chunks/s',
+        'latency_ms': latency_summary(batch_seconds),
+        'compact_seconds': compact_seconds,
+        'index_bytes': directory_size(config.FAISS_DB_DIR),
+        'index_types': store.get_collection_info().get('index_types')
+    }
+
+
+def bench_search(size: int, args) -> Dict:
+    store, _ = build_store(size)
+    store.compact(full=True)
+    queries = synthetic_chunks(args.queries, 8, seed=1)
+
+    store.search(queries[0], args.k)  # Warm up the resident index
+    query_seconds = [timed(store.search, query, args.k)[1] for query in queries]
+    _, batch_seconds = timed(store.search_batch, queries, args.k)
+    return {
+        'throughput': len(queries) / sum(query_seconds),
+        'unit': 'queries/s',
+        'latency_ms': latency_summary(query_seconds),
+        'batch_throughput': len(queries) / batch_seconds,
+        'hybrid': config.HYBRID_SEARCH,
+        'index_bytes': directory_size(config.FAISS_DB_DIR),
+        'index_types': store.get_collection_info().get('index_types')
+    }
+
+
+def bench_chat(size: int, args) -> Dict:
+    from chatbot import RAGChatbot
+
+    store, _ = build_store(size)
+    store.compact(full=True)
+    chatbot = RAGChatbot(client=MockOllamaClient(n_tokens=64))
+    queries = synthetic_chunks(args.queries, 8, seed=2)
+
+    turn_seconds, first_token_seconds = [], []
+    for query in queries:
+        _, seconds = timed(chatbot.generate_response, query)
+        turn_seconds.append(seconds)
+        if chatbot.last_turn_stats and chatbot.last_turn_stats['time_to_first_token'] is not None:
+            first_token_seconds.append(chatbot.last_turn_stats['time_to_first_token'])
+    return {
+        'throughput': len(queries) / sum(turn_seconds),
+        'unit': 'turns/s',
+        'latency_ms': latency_summary(turn_seconds),
+        'time_to_first_token_ms': latency_summary(first_token_seconds)
+    }
+
+
+def run_case(case: str, size: int, args) -> Dict:
+    """Run one case in this process against a temporary store"""
+    with tempfile.TemporaryDirectory() as directory:
+        use_temporary_store(Path(directory))
+        result = globals()[f"bench_{case}"](size, args)
+    result.update({'case': case, 'size': size, 'peak_rss_mb': peak_rss_mb()})
+    return result
+
+
+def run_isolated(case: str, size: int, args) -> Dict:
+    """Run one case in a fresh interpreter so its peak RSS is its own"""
+    command = [sys.executable, __file__, '--run-case', case, '--size', str(size),
+               '--queries', str(args.queries), '--k', str(args.k),
+               '--pdfs', str(args.pdfs), '--pages', str(args.pages)]
+    completed = subprocess.run(command, capture_output=True, text=True, cwd=REPO_ROOT)
+    if completed.returncode != 0:
+        print(completed.stderr, file=sys.stderr)
+        return {'case': case, 'size': size, 'error': completed.stderr.strip().splitlines()[-1:]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=REPO_ROOT, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result: Dict):
+    if 'error' in result:
+        print(f"{result['case']:<8} {result['size']:>9}  error: {' '.join(result['error'])}")
+        return
+    latency = result.get('latency_ms', {})
+    rss = result['peak_rss_mb']
+    print(f"{result['case']:<8} {result['size']:>9} {result['throughput']:>12,.1f} {result['unit']:<10} "
+          f"{latency.get('p50', 0):>9.2f} {latency.get('p95', 0):>9.2f} {latency.get('p99', 0):>9.2f} "
+          f"{rss if rss is not None else float('nan'):>9.0f}")
+
+
+def compare(results: List[Dict], previous_path: str):
+    """Print throughput and p95 latency relative to an earlier run"""
+    with open(previous_path, 'r', encoding='utf-8') as f:
+        previous = json.load(f)
+    earlier = {(result['case'], result['size']): result for result in previous['results'] if 'error' not in result}
+
+    print(f"\nCompared with {previous.get('commit') or previous_path}:")
+    print(f"{'case':<8} {'size':>9} {'throughput':>11} {'p95':>8} {'peak RSS':>9}")
+    for result in results:
+        before = earlier.get((result['case'], result['size']))
+        if before is None or 'error' in result:
+            continue
+        ratio = result['throughput'] / before['throughput']
+        p95 = result['latency_ms'].get('p95', 0) / max(before['latency_ms'].get('p95', 0), 1e-9)
+        rss = (result['peak_rss_mb'] or 0) / max(before['peak_rss_mb'] or 0, 1e-9)
+        print(f"{result['case']:<8} {result['size']:>9} {ratio:>10.2f}x {p95:>7.2f}x {rss:>8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--sizes', default='10000,100000,1000000', help="Corpus sizes in chunks")
+    parser.add_argument('--cases', default=','.join(CASES))
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--pdfs', type=int, default=32)
+    parser.add_argument('--pages', type=int, default=20, help="Pages per synthetic PDF")
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.size, args)))
+        return
+
+    cases = [case.strip() for case in args.cases.split(',') if case.strip()]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    print(f"{'case':<8} {'size':>9} {'throughput':>12} {'':<10} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'RSS MB':>9}")
+    results = []
+    for case in cases:
+        # PDF extraction is sized by --pdfs rather than by corpus size
+        for size in ([args.pdfs] if case == 'pdf' else sizes):
+            result = run_isolated(case, size, args)
+            print_result(result)
+            results.append(result)
+
+    report = {
+        'commit': git_commit(),
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'arguments': {key: value for key, value in vars(args).items() if key not in ('run_case', 'size')},
+        'config': {name: getattr(config, name) for name in (
+            'FAISS_INDEX_TYPE', 'EMBEDDING_DIM', 'EMBEDDING_BATCH_SIZE', 'CHUNK_SIZE', 'CHUNK_OVERLAP',
+            'PIPELINE_INDEX_BATCH_SIZE', 'HYBRID_SEARCH', 'PDF_WORKERS')},
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
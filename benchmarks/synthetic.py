@@ -0,0 +1,177 @@
+"""Synthetic corpora, PDFs, a mocked Ollama client and a fake Ollama server for the benchmarks."""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+
+def synthetic_chunks(n_chunks: int, words_per_chunk: int, seed: int = 0) -> List[str]:
+    """Generate chunks with a Zipf-like word distribution"""
+    rng = random.Random(seed)
+    words = [f"term{i}" for i in range(20000)]
+    weights = [1.0 / (rank + 1) for rank in range(len(words))]
+    return [' '.join(rng.choices(words, weights=weights, k=words_per_chunk)) + '. Page, (end)!'
+            for _ in range(n_chunks)]
+
+
+def synthetic_documents(n_chunks: int, words_per_chunk: int = 160, chunks_per_source: int = 50,
+                        seed: int = 0) -> List[Dict]:
+    """Chunk dicts as produced by DataProcessor, grouped into sources of chunks_per_source"""
+    return [{
+        'content': text,
+        'source': f"doc{i // chunks_per_source}.pdf",
+        'type': 'pdf',
+        'chunk_id': i % chunks_per_source
+    } for i, text in enumerate(synthetic_chunks(n_chunks, words_per_chunk, seed))]
+
+
+def write_pdf(path: Path, pages: List[str]):
+    """Write a minimal text-only PDF, one string per page, without any PDF library"""
+    objects = [
+        '<< /Type /Catalog /Pages 2 0 R >>',
+        f"<< /Type /Pages /Kids [{' '.join(f'{4 + 2 * i} 0 R' for i in range(len(pages)))}] "
+        f"/Count {len(pages)} >>",
+        '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    for i, text in enumerate(pages):
+        lines = ' '.join(f"({line.replace('(', '').replace(')', '')}) Tj T*" for line in text.split('\n'))
+        stream = f"BT /F1 10 Tf 40 800 Td 12 TL {lines} ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    out, offsets = '%PDF-1.4\n', []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    out += ''.join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    Path(path).write_text(out, encoding='latin-1')
+
+
+def synthetic_pdfs(directory: Path, n_pdfs: int, pages_per_pdf: int = 20, seed: int = 0) -> List[str]:
+    """Write n_pdfs PDFs of synthetic text, about 60 lines of 10 words per page"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(n_pdfs):
+        lines = synthetic_chunks(pages_per_pdf * 60, 10, seed + i)
+        pages = ['\n'.join(lines[page * 60:(page + 1) * 60]) for page in range(pages_per_pdf)]
+        path = directory / f"synthetic{i}.pdf"
+        write_pdf(path, pages)
+        paths.append(str(path))
+    return paths
+
+
+class MockOllamaClient:
+    """Stands in for ollama.Client, streaming a fixed answer at a set pace"""
+    def __init__(self, n_tokens: int = 64, first_token_delay: float = 0.0, token_delay: float = 0.0):
+        self.n_tokens = n_tokens
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+
+    def generate(self, model: str, prompt: str, stream: bool = False, **kwargs):
+        if stream:
+            return self._stream()
+        parts = list(self._stream())
+        return dict(parts[-1], response=''.join(part['response'] for part in parts))
+
+    def _stream(self) -> Iterator[Dict]:
+        start = time.perf_counter()
+        time.sleep(self.first_token_delay)
+        for i in range(self.n_tokens):
+            if i:
+                time.sleep(self.token_delay)
+            yield {'response': f" token{i}", 'done': False}
+        yield {'response': '', 'done': True, 'eval_count': self.n_tokens,
+               'eval_duration': int((time.perf_counter() - start) * 1e9)}
+
+
+class FakeOllamaServer:
+    """Local HTTP server streaming /api/generate responses like Ollama, at a set pace.
+
+    Records the most generations it served at once, the prompts in the order
+    they completed, how many were abandoned by the client mid-stream, how
+    many connections were opened, and the keep_alive and num_ctx requested.
+    """
+    def __init__(self, n_tokens: int = 32, token_delay: float = 0.005):
+        self.n_tokens = n_tokens
+        self.token_delay = token_delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.completed: List[str] = []
+        self.abandoned = 0
+        self.connections = 0
+        self.keep_alive = set()
+        self.num_ctx = set()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def __enter__(self) -> 'FakeOllamaServer':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _write_chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with server._lock:
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                    server.keep_alive.add(request.get('keep_alive'))
+                    server.num_ctx.add((request.get('options') or {}).get('num_ctx'))
+                try:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/x-ndjson')
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    self.end_headers()
+                    start = time.perf_counter()
+                    for i in range(server.n_tokens):
+                        time.sleep(server.token_delay)
+                        self._write_chunk(json.dumps({'response': f" token{i}", 'done': False}).encode() + b"\n")
+                    self._write_chunk(json.dumps({
+                        'response': '', 'done': True, 'eval_count': server.n_tokens,
+                        'eval_duration': int((time.perf_counter() - start) * 1e9)}).encode() + b"\n")
+                    self._write_chunk(b"")
+                    with server._lock:
+                        server.completed.append(request['prompt'])
+                except (BrokenPipeError, ConnectionResetError):
+                    with server._lock:
+                        server.abandoned += 1
+                    self.close_connection = True
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+        return Handler
@@ -1,55 +1,192 @@
-import ollama
-from typing import List, Dict
+import time
+from collections import deque
+from typing import List, Dict, Iterator, Optional
 from vector_store_faiss import FAISSVectorStore
+from utils.answer_cache import AnswerCache
+from utils.context_builder import ContextBuilder, ConversationContext, Prompt
+from utils.conversation import Conversation
+from utils.llm_service import LLMBusyError, get_llm_service
+from utils.metrics import REQUESTS, REQUEST_STAGE_SECONDS, span
 import config
 
+def create_answer_cache() -> AnswerCache:
+    """Answer cache sized from config"""
+    return AnswerCache(
+        config.EMBEDDING_DIM,
+        max_entries=config.ANSWER_CACHE_MAX_ENTRIES,
+        max_bytes=config.ANSWER_CACHE_MAX_BYTES,
+        ttl=config.ANSWER_CACHE_TTL,
+        similarity_threshold=config.ANSWER_CACHE_SIMILARITY
+    )
+
 class RAGChatbot:
-    def __init__(self):
-        self.vector_store = FAISSVectorStore()
-        self.client = ollama.Client(host=config.OLLAMA_BASE_URL)
-    
-    def generate_response(self, query: str, chat_history: List = None) -> str:
-        """Generate response using RAG with FAISS"""
-        
-        # Search for relevant documents
-        relevant_docs = self.vector_store.search(query, n_results=5)
-        
+    def __init__(self, client=None, answer_cache: Optional[AnswerCache] = None,
+                 vector_store: Optional[FAISSVectorStore] = None, session_id: Optional[str] = None):
+        # Pass a shared store so every chatbot in the process searches the same index
+        self.vector_store = vector_store or FAISSVectorStore()
+        # Generations go through the process-wide service, queued fairly per chatbot (session)
+        self.client = client or get_llm_service().client(session_id)
+        if answer_cache is None and config.ANSWER_CACHE_ENABLED:
+            answer_cache = create_answer_cache()
+        self.answer_cache = answer_cache
+        self.context_builder = ContextBuilder(
+            token_budget=config.CONTEXT_TOKEN_BUDGET,
+            chars_per_token=config.CONTEXT_CHARS_PER_TOKEN,
+            max_overlap=config.CHUNK_OVERLAP,
+            context_window=config.CONTEXT_WINDOW,
+            answer_tokens=config.CONTEXT_ANSWER_TOKENS,
+            history_budget=config.CONVERSATION_TOKEN_BUDGET
+        )
+        # Retrieval state of this session's conversation, so follow-ups build on earlier turns
+        self.conversation = Conversation(
+            self.vector_store,
+            candidates=config.CONVERSATION_CANDIDATES,
+            reuse_similarity=config.CONVERSATION_REUSE_SIMILARITY,
+            follow_up_terms=config.CONVERSATION_FOLLOWUP_TERMS
+        )
+        # Ollama's context after the last answered turn, continued by the next prompt
+        self.conversation_context: Optional[ConversationContext] = None
+
+        # Latency of recent turns: time to first token, tokens and tokens/sec
+        self.turn_stats = deque(maxlen=100)
+        self.last_turn_stats: Optional[Dict] = None
+
+    def _build_prompt(self, query: str, chat_history: Optional[List[Dict]] = None) -> Optional[Prompt]:
+        """Retrieve context for the query and build the prompt, or None if nothing relevant was found"""
+
+        # Search for relevant documents, or re-rank those found for the previous turn
+        with span('retrieve'):
+            relevant_docs = self.conversation.retrieve(query, config.CONTEXT_CANDIDATES)
+
         if not relevant_docs:
-            return "I don't have any relevant information to answer your question. Please make sure you have uploaded and processed your documents."
-        
-        # Prepare context
-        context_parts = []
-        for doc in relevant_docs:
-            source = doc['metadata']['source']
-            content = doc['content']
-            similarity = doc.get('similarity', 0.0)
-            context_parts.append(f"Source: {source} (Relevance: {similarity:.2f})\nContent: {content}\n")
-        
-        context = "\n---\n".join(context_parts)
-        
-        # Create prompt
-        prompt = f"""Based on the following context, please answer the user's question. If the answer is not available in the context, please say so.
-
-Context:
-{context}
-
-Question: {query}
-
-Answer:"""
-        
+            return None
+
+        # Continue the conversation's context while it was built on the same index contents
+        previous = self.conversation_context
+        if not config.CONTEXT_REUSE or (previous is not None and previous.generation != self.vector_store.generation):
+            previous = None
+
+        with span('prompt'):
+            return self.context_builder.build(query, relevant_docs, previous,
+                                              self.conversation.history(chat_history))
+
+    def generate_response_stream(self, query: str, chat_history: List = None) -> Iterator[str]:
+        """Generate a response using RAG with FAISS, yielding tokens as the model produces them.
+
+        chat_history holds the earlier messages of the conversation as
+        {'role', 'content'} dicts; without it, the turns answered here are used.
+        """
+        start = time.perf_counter()
+
+        # Answers are cached per index generation, keyed on the query and its embedding, and shared
+        # by all sessions; a prompt carrying earlier turns depends on its conversation, so only the
+        # first turn of one is looked up or stored
+        embedding = None
+        if (self.answer_cache is not None and self.vector_store.has_vocabulary()
+                and self.conversation_context is None and not self.conversation.history(chat_history)
+                and not self.conversation.is_follow_up(query)):
+            with span('cache_lookup'):
+                embedding = self.vector_store.embed([query])[0]
+                generation = self.vector_store.generation
+                # Words the embedding ignores must match too, for a similar question to reuse an answer
+                vocab = self.vector_store.embedding_model.vocab
+                cached = self.answer_cache.get(query, embedding, generation, vocab)
+            if cached is not None:
+                REQUESTS.labels('cache_hit').inc()
+                self._record_turn(start, time.perf_counter(), 0, {}, cached=True)
+                self.conversation.add_turn(query, cached, retrieved=False)
+                yield cached
+                return
+
+        context_generation = self.vector_store.generation
+        prompt = self._build_prompt(query, chat_history)
+
+        if prompt is None:
+            REQUESTS.labels('no_context').inc()
+            yield "I don't have any relevant information to answer your question. Please make sure you have uploaded and processed your documents."
+            return
+
+        first_token_at = None
+        n_tokens = 0
+        final = {}
+        tokens = []
+        llm_start = time.perf_counter()
         try:
             # Generate response using Ollama
-            response = self.client.generate(
-                model=config.OLLAMA_MODEL,
-                prompt=prompt,
-                stream=False
-            )
-            
-            return response['response']
-            
+            # The prompt was packed for CONTEXT_WINDOW tokens; a smaller server default would cut its start off
+            params = {'options': {'num_ctx': config.CONTEXT_WINDOW}}
+            if prompt.context is not None:
+                params['context'] = prompt.context
+            for part in self.client.generate(model=config.OLLAMA_MODEL, prompt=prompt.text, stream=True, **params):
+                token = part.get('response', '')
+                if token:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    n_tokens += 1
+                    tokens.append(token)
+                    yield token
+                if part.get('done'):
+                    final = part
+
+        except LLMBusyError as e:
+            REQUESTS.labels('busy').inc()
+            yield f"The model is busy answering other questions ({e}). Please try again in a moment."
+            return
         except Exception as e:
-            return f"Error generating response: {str(e)}. Please make sure Ollama is running and the model '{config.OLLAMA_MODEL}' is available."
-    
+            REQUESTS.labels('error').inc()
+            yield f"Error generating response: {str(e)}. Please make sure Ollama is running and the model '{config.OLLAMA_MODEL}' is available."
+            return
+
+        end = time.perf_counter()
+        if first_token_at is not None:
+            REQUEST_STAGE_SECONDS.labels('llm_first_token').observe(first_token_at - llm_start)
+        REQUEST_STAGE_SECONDS.labels('llm_generate').observe(end - llm_start)
+        REQUEST_STAGE_SECONDS.labels('request').observe(end - start)
+        REQUESTS.labels('answered').inc()
+
+        self._record_turn(start, first_token_at, n_tokens, final)
+        if final.get('context'):
+            self.conversation_context = ConversationContext(final['context'], prompt.chunks, context_generation)
+        self.conversation.add_turn(query, "".join(tokens))
+        if embedding is not None and tokens and prompt.context is None:
+            self.answer_cache.put(query, embedding, generation, "".join(tokens), vocab)
+
+    def _record_turn(self, start: float, first_token_at: Optional[float], n_tokens: int, final: Dict,
+                     cached: bool = False):
+        """Record time-to-first-token and generation speed for one turn"""
+        end = time.perf_counter()
+
+        # Prefer Ollama's own token count and timing when the final message has them
+        tokens = final.get('eval_count') or n_tokens
+        if final.get('eval_duration'):
+            tokens_per_sec = tokens / (final['eval_duration'] / 1e9)
+        elif first_token_at is not None and end > first_token_at:
+            tokens_per_sec = tokens / (end - first_token_at)
+        else:
+            tokens_per_sec = 0.0
+
+        if final.get('prompt_eval_duration'):
+            REQUEST_STAGE_SECONDS.labels('llm_prompt_eval').observe(final['prompt_eval_duration'] / 1e9)
+
+        self.last_turn_stats = {
+            'time_to_first_token': (first_token_at - start) if first_token_at is not None else None,
+            'total_time': end - start,
+            'prompt_tokens': final.get('prompt_eval_count'),
+            'tokens': tokens,
+            'tokens_per_sec': tokens_per_sec,
+            'cached': cached
+        }
+        self.turn_stats.append(self.last_turn_stats)
+
+    def reset_conversation(self):
+        """Forget the conversation: the next question is retrieved and prompted afresh"""
+        self.conversation_context = None
+        self.conversation.reset()
+
+    def generate_response(self, query: str, chat_history: List = None) -> str:
+        """Generate response using RAG with FAISS"""
+        return "".join(self.generate_response_stream(query, chat_history))
+
     def get_vector_store_info(self) -> Dict:
         """Get vector store information"""
         return self.vector_store.get_collection_info()
@@ -0,0 +1,280 @@
+"""Ingest, query and maintain the knowledge base from the command line, for batch jobs run outside Streamlit.
+
+Usage:
+  python cli.py ingest PATH... [--checkpoint FILE] [--workers N] [--scrapers N] [--batch-size N]
+  python cli.py query "question" [-k 5] [--source NAME] [--type pdf|website] [--answer] [--json]
+  python cli.py stats
+  python cli.py compact [--full]
+
+PATH is a PDF, a ZIP of PDFs, an Excel file of website links or a directory,
+searched recursively for all three.
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from data_processor import DataProcessor
+from vector_store_faiss import FAISSVectorStore, wait_for_maintenance
+from chatbot import RAGChatbot
+from utils.pipeline import STAGES, IngestionPipeline
+import config
+
+PDF_SUFFIXES = ('.pdf',)
+ZIP_SUFFIXES = ('.zip',)
+EXCEL_SUFFIXES = ('.xlsx', '.xls')
+INPUT_SUFFIXES = PDF_SUFFIXES + ZIP_SUFFIXES + EXCEL_SUFFIXES
+
+
+class Checkpoint:
+    """Inputs already ingested, kept in a JSON file so an interrupted run can resume where it stopped.
+
+    Inputs are keyed on their resolved path and recorded with their size and
+    modification time, so one changed since is ingested again. The batch
+    being ingested is recorded as well: a run stopped part way through it may
+    have indexed some chunks of a source but not the rest, so on resume that
+    batch is ingested without skipping the sources the store already has.
+    Without a file, nothing is recorded.
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path) if path else None
+        self.completed: Dict[str, str] = {}
+        self.in_progress: Dict[str, str] = {}
+        if self.path is not None and self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as file:
+                state = json.load(file)
+            self.completed = state.get('completed', {})
+            self.in_progress = state.get('in_progress', {})
+
+    @staticmethod
+    def fingerprint(path: Path) -> str:
+        stat = path.stat()
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def is_done(self, path: Path) -> bool:
+        return self.completed.get(str(path)) == self.fingerprint(path)
+
+    def was_interrupted(self, paths: Iterable[Path]) -> bool:
+        """Whether a previous run stopped while ingesting any of paths"""
+        return any(str(path) in self.in_progress for path in paths)
+
+    def start(self, paths: List[Path]):
+        self.in_progress = {str(path): self.fingerprint(path) for path in paths}
+        self._save()
+
+    def finish(self):
+        self.completed.update(self.in_progress)
+        self.in_progress = {}
+        self._save()
+
+    def _save(self):
+        if self.path is None:
+            return
+        # Write then rename, so a run killed mid-write leaves the previous checkpoint intact
+        tmp_file = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as file:
+            json.dump({'completed': self.completed, 'in_progress': self.in_progress}, file, indent=1)
+        os.replace(tmp_file, self.path)
+
+
+def collect_inputs(paths: List[str]) -> List[Path]:
+    """Input files named by paths, directories searched recursively, in a stable order without repeats"""
+    inputs = []
+    for name in paths:
+        path = Path(name).resolve()
+        if path.is_dir():
+            inputs.extend(sorted(file for file in path.rglob('*')
+                                 if file.is_file() and file.suffix.lower() in INPUT_SUFFIXES))
+        elif not path.is_file():
+            raise FileNotFoundError(f"No such file or directory: {name}")
+        elif path.suffix.lower() not in INPUT_SUFFIXES:
+            raise ValueError(f"Not a PDF, ZIP or Excel file: {name}")
+        else:
+            inputs.append(path)
+    return list(dict.fromkeys(inputs))
+
+
+def batches(inputs: List[Path], batch_size: int) -> Iterator[List[Path]]:
+    """Loose PDFs in groups of batch_size, extracted in parallel; each ZIP and Excel file on its own"""
+    pdfs = []
+    for path in inputs:
+        if path.suffix.lower() not in PDF_SUFFIXES:
+            yield [path]
+            continue
+        pdfs.append(path)
+        if len(pdfs) >= batch_size:
+            yield pdfs
+            pdfs = []
+    if pdfs:
+        yield pdfs
+
+
+def batch_documents(processor: DataProcessor, batch: List[Path], is_unchanged) -> Iterator[Dict]:
+    """Documents and chunks of a batch's inputs, skipping the sources is_unchanged accepts"""
+    pdfs = [str(path) for path in batch if path.suffix.lower() in PDF_SUFFIXES]
+    if pdfs:
+        yield from processor.process_pdf_files_chunks(pdfs, is_unchanged)
+    for path in batch:
+        if path.suffix.lower() in ZIP_SUFFIXES:
+            yield from processor.process_zip_file_chunks(str(path), is_unchanged)
+        elif path.suffix.lower() in EXCEL_SUFFIXES:
+            yield from processor.iter_excel_documents(str(path), is_unchanged)
+
+
+def log(message: str):
+    print(message, file=sys.stderr, flush=True)
+
+
+def ingest(args) -> int:
+    # Worker counts are read from config when the processor is created
+    if args.workers:
+        config.PDF_WORKERS = config.CHUNK_WORKERS = args.workers
+    if args.scrapers:
+        config.SCRAPER_WORKERS = args.scrapers
+
+    inputs = args.inputs
+    checkpoint = Checkpoint(args.checkpoint)
+    pending = [path for path in inputs if not checkpoint.is_done(path)]
+    if len(pending) < len(inputs):
+        log(f"Skipping {len(inputs) - len(pending)} of {len(inputs)} inputs already ingested")
+
+    processor = DataProcessor()
+    vector_store = FAISSVectorStore()
+
+    def show_progress(counts):
+        log(f"  extracted {counts['extract']} · chunked {counts['chunk']} · "
+            f"embedded {counts['embed']} · indexed {counts['index']}")
+
+    totals = dict.fromkeys(STAGES + ('sources',), 0)
+    for number, batch in enumerate(batches(pending, args.batch_size), 1):
+        # A batch cut short may hold a partly indexed source, which must not be skipped as unchanged
+        is_unchanged = None if checkpoint.was_interrupted(batch) else vector_store.is_unchanged
+        label = batch[0].name if len(batch) == 1 else f"{len(batch)} PDFs from {batch[0].parent}"
+        log(f"[{number}] {label}{' (resuming)' if is_unchanged is None else ''}")
+
+        checkpoint.start(batch)
+        pipeline = IngestionPipeline(
+            vector_store,
+            processor.iter_chunks,
+            embed_batch_size=config.PIPELINE_EMBED_BATCH_SIZE,
+            index_batch_size=config.PIPELINE_INDEX_BATCH_SIZE,
+            queue_size=config.PIPELINE_QUEUE_SIZE,
+            progress=show_progress,
+            progress_interval=args.progress_interval
+        )
+        counts = pipeline.run(batch_documents(processor, batch, is_unchanged))
+        checkpoint.finish()
+        for key, count in counts.items():
+            totals[key] += count
+
+    print(f"Ingested {len(pending)} inputs: {totals['sources']} documents into {totals['index']} new chunks")
+    if args.wait and not wait_for_maintenance():
+        return 1
+    return 0
+
+
+def query(args) -> int:
+    vector_store = FAISSVectorStore()
+    if args.answer:
+        chatbot = RAGChatbot(vector_store=vector_store, session_id='cli')
+        for token in chatbot.generate_response_stream(args.text):
+            print(token, end='', flush=True)
+        print()
+        return 0
+
+    filter = {column: value for column, value in (('source', args.source), ('type', args.type)) if value}
+    hits = vector_store.search(args.text, n_results=args.k, filter=filter or None)
+    if args.json:
+        print(json.dumps(hits, indent=2, ensure_ascii=False))
+        return 0
+    for rank, hit in enumerate(hits, 1):
+        metadata = hit['metadata']
+        print(f"{rank}. {metadata['source']} (chunk {metadata['chunk_id']}, similarity: {hit['similarity']:.3f})")
+        print(f"   {' '.join(hit['content'].split())[:args.width]}")
+    if not hits:
+        print("No matching chunks.")
+    return 0
+
+
+def stats(args) -> int:
+    print(json.dumps(FAISSVectorStore().get_collection_info(), indent=2))
+    return 0
+
+
+def compact(args) -> int:
+    vector_store = FAISSVectorStore()
+    # Background maintenance left running by a recent ingest would be compacting the same segments
+    wait_for_maintenance()
+    # A partial compaction merges only the smallest segments, so repeat until the store is tidy
+    changed = vector_store.compact(full=True) if args.full else False
+    while not args.full and vector_store.compact():
+        changed = True
+    info = vector_store.get_collection_info()
+    print(f"{'Compacted' if changed else 'Nothing to compact'}: {info['count']} chunks "
+          f"in {info.get('segments', 0)} segments")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_ingest = commands.add_parser('ingest', help="Ingest PDFs, ZIPs of PDFs and Excel files of links")
+    parser_ingest.add_argument('paths', nargs='+', metavar='PATH')
+    parser_ingest.add_argument('--checkpoint', metavar='FILE',
+                               help="JSON file of inputs already ingested, read to resume and updated per batch")
+    parser_ingest.add_argument('--workers', type=int, default=0,
+                               help="Processes extracting and splitting documents (default: config)")
+    parser_ingest.add_argument('--scrapers', type=int, default=0,
+                               help="Concurrent page fetches (default: config)")
+    parser_ingest.add_argument('--batch-size', type=int, default=64,
+                               help="Loose PDFs ingested and checkpointed together")
+    parser_ingest.add_argument('--progress-interval', type=float, default=10.0,
+                               help="Seconds between progress lines")
+    parser_ingest.add_argument('--no-wait', dest='wait', action='store_false',
+                               help="Exit without waiting for background compaction")
+    parser_ingest.set_defaults(handler=ingest)
+
+    parser_query = commands.add_parser('query', help="Search the knowledge base, or answer from it")
+    parser_query.add_argument('text')
+    parser_query.add_argument('-k', type=int, default=config.CONTEXT_CANDIDATES)
+    parser_query.add_argument('--source', help="Only search chunks of this source")
+    parser_query.add_argument('--type', choices=('pdf', 'website'), help="Only search chunks of this type")
+    parser_query.add_argument('--answer', action='store_true', help="Answer with the local model instead")
+    parser_query.add_argument('--json', action='store_true', help="Print the hits as JSON")
+    parser_query.add_argument('--width', type=int, default=200, help="Characters of each hit to print")
+    parser_query.set_defaults(handler=query)
+
+    parser_stats = commands.add_parser('stats', help="Print the vector store's size and layout as JSON")
+    parser_stats.set_defaults(handler=stats)
+
+    parser_compact = commands.add_parser('compact', help="Merge segments and reclaim deleted chunks")
+    parser_compact.add_argument('--full', action='store_true', help="Merge every segment into one")
+    parser_compact.set_defaults(handler=compact)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'ingest':
+        if args.batch_size < 1:
+            parser.error("--batch-size must be at least 1")
+        try:
+            args.inputs = collect_inputs(args.paths)
+        except (FileNotFoundError, ValueError) as e:
+            parser.error(str(e))
+    if args.command == 'query' and args.answer and (args.source or args.type or args.json):
+        parser.error("--answer cannot be combined with --source, --type or --json")
+    try:
+        return args.handler(args)
+    except KeyboardInterrupt:
+        log("Interrupted" + ("; run again with the same --checkpoint to resume"
+                             if getattr(args, 'checkpoint', None) else ""))
+        return 130
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,13 +15,90 @@ for dir_path in [DATA_DIR, UPLOADS_DIR, EXTRACTED_DIR, FAISS_DB_DIR]:
 # Ollama settings
 OLLAMA_MODEL = "llama3.2"  # Change to your preferred model
 OLLAMA_BASE_URL = "http://localhost:11434"
+OLLAMA_KEEP_ALIVE = "30m"  # How long Ollama keeps the model loaded after a request
+LLM_MAX_IN_FLIGHT = 4  # Generations sent to Ollama at once; match its OLLAMA_NUM_PARALLEL
+LLM_MAX_QUEUED = 64  # Generations waiting for a slot before new ones are turned away
+LLM_QUEUE_TIMEOUT = 60  # Seconds a generation may wait for a slot
+LLM_CONNECT_TIMEOUT = 5
+LLM_READ_TIMEOUT = 120  # Seconds allowed between streamed parts, including loading the model
 
 # FAISS settings
+# Single-file layout of earlier versions; migrated into the first segment on load
 FAISS_INDEX_FILE = FAISS_DB_DIR / "faiss_index.bin"
 METADATA_FILE = FAISS_DB_DIR / "metadata.pkl"
+# Index type per segment: "auto", "flat", "ivfflat", "ivfpq", "hnsw", or quantized storage:
+# "sq8" (int8, 4x smaller), "fp16" (2x smaller) or "pq" (PQ_M bytes per vector).
+# "auto" uses exact search for small segments and IVF once compaction makes them large.
+FAISS_INDEX_TYPE = "auto"
+AUTO_IVF_MIN_VECTORS = 50_000      # auto: IVFFlat from this many vectors
+AUTO_IVFPQ_MIN_VECTORS = 1_000_000  # auto: IVFPQ from this many vectors
+INDEX_TRAIN_SAMPLE = 100_000  # Vectors sampled to train IVF/PQ
+IVF_NLIST = 0  # 0 = about 4 * sqrt(vectors)
+IVF_NPROBE = 16
+PQ_M = 48  # Sub-quantizers; must divide EMBEDDING_DIM
+PQ_NBITS = 8
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+RERANK_FACTOR = 4  # Quantized indexes fetch this many candidates per hit, re-scored with the stored vectors; 1 = off
+COMPACTION_MAX_SEGMENTS = 8  # Compact in the background once there are more segments
+COMPACTION_MERGE_FACTOR = 4  # Number of smallest segments merged per compaction
+COMPACTION_DELETED_RATIO = 0.2  # Rewrite a segment once this share of its chunks is deleted
+HYBRID_SEARCH = True  # Fuse BM25 keyword hits with vector hits
+HYBRID_CANDIDATES = 4  # Hits taken from each retriever per requested result
+RRF_K = 60  # Reciprocal rank fusion constant
+BM25_K1 = 1.2
+BM25_B = 0.75
+SEARCH_FILTER_EXACT_ROWS = 20000  # Filters matching at most this many rows of a segment are searched exactly
 EMBEDDING_DIM = 384
+EMBEDDING_BATCH_SIZE = 2048  # Texts embedded per vectorized pass
+VOCAB_SIZE = 5000
+VOCAB_REBUILD_DRIFT = 0.05  # Rebuild once this share of top-term occurrences is missing from the vocabulary
+VOCAB_REBUILD_GROWTH = 2.0  # With IDF, also rebuild once the corpus has grown this many times over
+EMBEDDING_IDF = False  # Weight embedding terms by inverse document frequency
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
+CHUNK_WORKERS = 0  # Processes splitting long documents in parallel; 0 = one per CPU
+
+# Extraction settings
+PDF_WORKERS = 0  # Processes extracting PDFs in parallel; 0 = one per CPU
+PDF_TIMEOUT = 120  # Seconds allowed per PDF, across all its batches
+PDF_PAGE_BATCH = 16  # Pages extracted per worker task; bounds the text held per PDF in flight
+SCRAPER_WORKERS = 16  # Concurrent page fetches
+SCRAPER_HOST_INTERVAL = 1.0  # Minimum seconds between requests to the same host
+SCRAPER_MAX_RETRIES = 3
+SCRAPER_BACKOFF = 0.5  # Base seconds for exponential retry backoff
+SCRAPER_TIMEOUT = 10
+SCRAPER_MAX_RETRY_AFTER = 30  # Longest Retry-After honoured, in seconds; longer ones get the usual backoff
+
+# Ingestion pipeline settings
+PIPELINE_EMBED_BATCH_SIZE = 512  # Chunks embedded per batch
+PIPELINE_INDEX_BATCH_SIZE = 5000  # Chunks written per segment
+PIPELINE_QUEUE_SIZE = 64  # Documents buffered between stages
+
+# Prompt settings
+CONTEXT_CANDIDATES = 8  # Chunks retrieved per question before merging and packing
+CONTEXT_TOKEN_BUDGET = 1500  # Tokens of retrieved text packed into a prompt
+CONTEXT_CHARS_PER_TOKEN = 4.0  # Rough estimate used for packing
+CONTEXT_REUSE = True  # Continue from Ollama's returned context instead of re-sending the preamble and known passages
+CONTEXT_WINDOW = 4096  # Model context length (num_ctx); a fresh prompt is started beyond it
+CONTEXT_ANSWER_TOKENS = 512  # Room left for the answer within CONTEXT_WINDOW
+
+# Conversation settings
+CONVERSATION_CANDIDATES = 24  # Chunks kept per search for re-ranking follow-up questions
+CONVERSATION_REUSE_SIMILARITY = 0.8  # Follow-ups this similar to the last search, all of whose keywords its chunks hold, re-rank them
+CONVERSATION_FOLLOWUP_TERMS = 4  # Questions of at most this many words are searched with the previous one
+CONVERSATION_TOKEN_BUDGET = 500  # Tokens of recent turns written into a fresh prompt
+
+# Answer cache settings
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_MAX_ENTRIES = 1000
+ANSWER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+ANSWER_CACHE_TTL = 3600  # Seconds before a cached answer expires
+ANSWER_CACHE_SIMILARITY = 0.95  # Cosine similarity at which a similar question reuses an answer
+
+# Metrics settings
+METRICS_PORT = 0  # Serve Prometheus metrics at http://<host>:<port>/metrics; 0 = disabled
 
 # Streamlit settings
 PAGE_TITLE = "RAG Chatbot"
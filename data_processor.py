@@ -1,18 +1,22 @@
-from typing import List, Dict
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import os
+from typing import List, Dict, Iterable, Iterator, Callable, Optional
 from utils.pdf_extractor import PDFExtractor
+from utils.text_splitter import RecursiveTextSplitter
 from utils.web_scraper import WebScraper
 import config
 
 class DataProcessor:
     def __init__(self):
-        self.pdf_extractor = PDFExtractor(config.EXTRACTED_DIR)
-        self.web_scraper = WebScraper()
-        self.text_splitter = RecursiveCharacterTextSplitter(
+        self.pdf_extractor = PDFExtractor(config.EXTRACTED_DIR, config.PDF_WORKERS, config.PDF_TIMEOUT,
+                                          config.PDF_PAGE_BATCH)
+        self.web_scraper = WebScraper(config.SCRAPER_WORKERS, config.SCRAPER_HOST_INTERVAL,
+                                      config.SCRAPER_MAX_RETRIES, config.SCRAPER_BACKOFF,
+                                      config.SCRAPER_TIMEOUT, config.SCRAPER_MAX_RETRY_AFTER)
+        self.text_splitter = RecursiveTextSplitter(
             chunk_size=config.CHUNK_SIZE,
-            chunk_overlap=config.CHUNK_OVERLAP,
-            length_function=len,
+            chunk_overlap=config.CHUNK_OVERLAP
         )
+        self.chunk_workers = config.CHUNK_WORKERS or os.cpu_count() or 1
     
     def process_zip_file(self, zip_path: str) -> List[Dict]:
         """Process ZIP file containing PDFs"""
@@ -24,6 +28,20 @@ class DataProcessor:
         
         return documents
     
+    def process_zip_file_chunks(self, zip_path: str,
+                                is_unchanged: Optional[Callable[[str, str], bool]] = None) -> Iterator[Dict]:
+        """Process ZIP file containing PDFs straight into chunks, skipping unchanged PDFs"""
+        # Extract PDFs from ZIP
+        pdf_files = self.pdf_extractor.extract_zip(zip_path)
+        
+        # Extract and chunk PDFs page by page across worker processes
+        return self.pdf_extractor.iter_pdf_chunks(pdf_files, self.text_splitter, is_unchanged)
+    
+    def process_pdf_files_chunks(self, pdf_files: List[str],
+                                 is_unchanged: Optional[Callable[[str, str], bool]] = None) -> Iterator[Dict]:
+        """Process PDF files straight into chunks, skipping unchanged PDFs"""
+        return self.pdf_extractor.iter_pdf_chunks(pdf_files, self.text_splitter, is_unchanged)
+    
     def process_excel_file(self, excel_path: str) -> List[Dict]:
         """Process Excel file containing URLs"""
         # Extract URLs from Excel
@@ -34,19 +52,37 @@ class DataProcessor:
         
         return documents
     
-    def chunk_documents(self, documents: List[Dict]) -> List[Dict]:
-        """Split documents into smaller chunks"""
-        chunked_docs = []
+    def iter_excel_documents(self, excel_path: str,
+                             is_unchanged: Optional[Callable[[str, str], bool]] = None) -> Iterator[Dict]:
+        """Process Excel file containing URLs, yielding documents as pages are scraped"""
+        # Extract URLs from Excel
+        urls = self.web_scraper.extract_urls_from_excel(excel_path)
         
-        for doc in documents:
-            chunks = self.text_splitter.split_text(doc['content'])
+        # Scrape websites concurrently
+        return self.web_scraper.iter_documents(urls, is_unchanged)
+    
+    def iter_chunks(self, documents: Iterable[Dict]) -> Iterator[Dict]:
+        """Split documents into smaller chunks lazily; documents that are already chunks pass through"""
+        # Long documents are split in parallel across worker processes
+        split = self.text_splitter.map_offsets(
+            documents, lambda doc: None if 'chunk_id' in doc else doc['content'], self.chunk_workers)
+        for doc, offsets in split:
+            if offsets is None:
+                yield doc
+                continue
             
-            for i, chunk in enumerate(chunks):
-                chunked_docs.append({
-                    'content': chunk,
+            text = doc['content']
+            for i, (start, end) in enumerate(offsets):
+                chunk_doc = {
+                    'content': text[start:end],
                     'source': doc['source'],
                     'type': doc['type'],
                     'chunk_id': i
-                })
-        
-        return chunked_docs
+                }
+                if 'doc_hash' in doc:
+                    chunk_doc['doc_hash'] = doc['doc_hash']
+                yield chunk_doc
+    
+    def chunk_documents(self, documents: List[Dict]) -> List[Dict]:
+        """Split documents into smaller chunks"""
+        return list(self.iter_chunks(documents))
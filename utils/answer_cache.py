@@ -0,0 +1,177 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Container, Dict, FrozenSet, Optional
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase a query and drop punctuation and extra spacing"""
+    return ' '.join(re.sub(r'[^\w\s]', '', query.lower()).split())
+
+
+def unembedded_terms(query: str, vocab: Container[str]) -> FrozenSet[str]:
+    """Words of a normalized query that its embedding ignores: those outside the vocabulary, numbers and short words"""
+    return frozenset(term for term in normalize_query(query).split() if term not in vocab)
+
+
+class _Entry:
+    __slots__ = ('answer', 'slot', 'created', 'size', 'unembedded')
+
+    def __init__(self, answer: str, slot: int, created: float, size: int, unembedded: Optional[FrozenSet[str]]):
+        self.answer = answer
+        self.slot = slot
+        self.created = created
+        self.size = size
+        self.unembedded = unembedded
+
+
+class AnswerCache:
+    """Two-level cache of generated answers for one index generation.
+
+    Exact hits are looked up by normalized query text. On a miss, the cached
+    query whose embedding has the highest cosine similarity is reused if it
+    reaches similarity_threshold and both queries have the same words that
+    the embedding ignores, so "experiment 3" never answers "experiment 7".
+    Without the vocabulary to tell those words apart, only exact hits are
+    served. Entries expire after ttl seconds and the
+    least recently used are evicted beyond max_entries or max_bytes. Every
+    entry is dropped when the index generation changes, since the answers were
+    built from the old contents.
+    """
+    def __init__(self, dimensions: int, max_entries: int = 1000, max_bytes: int = 64 << 20,
+                 ttl: float = 3600.0, similarity_threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._keys = [None] * max_entries  # Key stored in each embedding slot
+        self._vectors = np.zeros((max_entries, dimensions), dtype=np.float32)
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._bytes = 0
+        self._generation = None
+        self._lock = threading.Lock()
+
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_generation(self, generation: int):
+        if generation != self._generation:
+            if self._entries:
+                self.invalidations += 1
+            self._clear()
+            self._generation = generation
+
+    def _clear(self):
+        self._entries.clear()
+        self._keys = [None] * self.max_entries
+        self._free = list(range(self.max_entries - 1, -1, -1))
+        self._bytes = 0
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._keys[entry.slot] = None
+        self._free.append(entry.slot)
+        self._bytes -= entry.size
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return bool(self.ttl) and now - entry.created > self.ttl
+
+    def _similar(self, embedding: np.ndarray, unembedded: FrozenSet[str], now: float) -> Optional[str]:
+        """Key of the most similar live entry with the same unembedded words, if it clears the threshold"""
+        if not self._entries:
+            return None
+        # Vectors are normalized, so the dot product is the cosine similarity
+        scores = self._vectors @ embedding
+        for slot in np.argsort(-scores):
+            if scores[slot] < self.similarity_threshold:
+                return None
+            key = self._keys[slot]
+            if key is None:
+                continue
+            entry = self._entries[key]
+            if self._expired(entry, now):
+                self._remove(key)
+                continue
+            if entry.unembedded == unembedded:
+                return key
+        return None
+
+    def get(self, query: str, embedding: np.ndarray, generation: int,
+            vocab: Optional[Container[str]] = None) -> Optional[str]:
+        """Cached answer for the query, or None on a miss; vocab is the one the embedding was made with"""
+        key = normalize_query(query)
+        unembedded = unembedded_terms(query, vocab) if vocab is not None else None
+        now = time.monotonic()
+        with self._lock:
+            self._check_generation(generation)
+
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self.exact_hits += 1
+            else:
+                similar = self._similar(embedding, unembedded, now) if unembedded is not None else None
+                if similar is None:
+                    self.misses += 1
+                    return None
+                key, entry = similar, self._entries[similar]
+                self.similar_hits += 1
+
+            self._entries.move_to_end(key)
+            return entry.answer
+
+    def put(self, query: str, embedding: np.ndarray, generation: int, answer: str,
+            vocab: Optional[Container[str]] = None):
+        """Cache an answer generated against the given index generation"""
+        key = normalize_query(query)
+        unembedded = unembedded_terms(query, vocab) if vocab is not None else None
+        size = len(key) + len(answer.encode('utf-8', errors='surrogatepass')) + embedding.nbytes
+        if size > self.max_bytes or not self.max_entries:
+            return
+
+        with self._lock:
+            self._check_generation(generation)
+            if key in self._entries:
+                self._remove(key)
+
+            # Evict least recently used entries until the new one fits
+            while self._entries and (not self._free or self._bytes + size > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+            slot = self._free.pop()
+            self._vectors[slot] = embedding
+            self._keys[slot] = key
+            self._entries[key] = _Entry(answer, slot, time.monotonic(), size, unembedded)
+            self._bytes += size
+
+    def clear(self):
+        """Drop every cached answer"""
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> Dict:
+        """Hit counts, hit rate and current size"""
+        with self._lock:
+            hits = self.exact_hits + self.similar_hits
+            lookups = hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'exact_hits': self.exact_hits,
+                'similar_hits': self.similar_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,175 @@
+import hashlib
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+TERMS_FILE = "bm25_terms.npy"
+TERM_OFFSETS_FILE = "bm25_offsets.npy"
+POSTING_ROWS_FILE = "bm25_rows.npy"
+POSTING_TFS_FILE = "bm25_tfs.npy"
+LENGTHS_FILE = "bm25_lengths.npy"
+
+_TOKEN = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens, keeping digits so part numbers and codes match exactly"""
+    return [token for token in _TOKEN.findall(text.lower()) if len(token) > 1]
+
+
+def term_hashes(terms: Iterable[str]) -> np.ndarray:
+    """Stable 64-bit hash of each term"""
+    return np.fromiter((int.from_bytes(hashlib.blake2b(term.encode('utf-8', errors='surrogatepass'),
+                                                       digest_size=8).digest(), 'little')
+                        for term in terms), dtype=np.uint64)
+
+
+class BM25Index:
+    """Inverted index over one segment's chunks, stored as flat arrays.
+
+    Terms are kept as sorted 64-bit hashes; the postings of the term at
+    position i are rows[offsets[i]:offsets[i + 1]] with term frequencies in
+    tfs, sorted by row. Document lengths are kept per row for BM25 length
+    normalization. Like the rest of a segment, an index is written once and
+    read through mmap.
+    """
+    def __init__(self, terms: np.ndarray, offsets: np.ndarray, rows: np.ndarray,
+                 tfs: np.ndarray, lengths: np.ndarray):
+        self.terms = terms
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.lengths = lengths
+        self.total_length = int(np.sum(lengths, dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    @classmethod
+    def open(cls, directory: str) -> Optional['BM25Index']:
+        """Open the index stored in a segment directory, or None if it has none"""
+        directory = Path(directory)
+        if not (directory / TERMS_FILE).exists():
+            return None
+        return cls(*(np.load(directory / name, mmap_mode='r')
+                     for name in (TERMS_FILE, TERM_OFFSETS_FILE, POSTING_ROWS_FILE,
+                                  POSTING_TFS_FILE, LENGTHS_FILE)))
+
+    def save(self, directory: str):
+        directory = Path(directory)
+        np.save(directory / TERMS_FILE, self.terms)
+        np.save(directory / TERM_OFFSETS_FILE, self.offsets)
+        np.save(directory / POSTING_ROWS_FILE, self.rows)
+        np.save(directory / POSTING_TFS_FILE, self.tfs)
+        np.save(directory / LENGTHS_FILE, self.lengths)
+
+    @classmethod
+    def _from_postings(cls, hashes: np.ndarray, rows: np.ndarray, tfs: np.ndarray,
+                       lengths: np.ndarray) -> 'BM25Index':
+        """Build an index from unordered (term hash, row, tf) postings, summing repeated pairs"""
+        order = np.lexsort((rows, hashes))
+        hashes, rows, tfs = hashes[order], rows[order], tfs[order]
+
+        if len(hashes):
+            starts = np.flatnonzero(np.r_[True, (hashes[1:] != hashes[:-1]) | (rows[1:] != rows[:-1])])
+            tfs = np.add.reduceat(tfs, starts)
+            hashes, rows = hashes[starts], rows[starts]
+
+        terms, first = np.unique(hashes, return_index=True)
+        offsets = np.append(first, len(hashes)).astype(np.int64)
+        return cls(terms.astype(np.uint64), offsets, rows.astype(np.int32),
+                   tfs.astype(np.int32), np.asarray(lengths, dtype=np.int32))
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str]) -> 'BM25Index':
+        """Tokenize chunk texts and build their index"""
+        vocab: Dict[str, int] = {}
+        term_ids, lengths = [], []
+        for text in texts:
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            term_ids.extend(vocab.setdefault(token, len(vocab)) for token in tokens)
+
+        # Each distinct term is hashed once
+        hashes = term_hashes(vocab)[np.array(term_ids, dtype=np.int64)]
+        rows = np.repeat(np.arange(len(lengths), dtype=np.int32), lengths)
+        return cls._from_postings(hashes, rows, np.ones(len(rows), dtype=np.int32), lengths)
+
+    @staticmethod
+    def write(directory: str, texts: Iterable[str]):
+        """Build the index of chunk texts into a segment directory"""
+        BM25Index.from_texts(texts).save(directory)
+
+    @staticmethod
+    def write_merged(directory: str, indexes: List['BM25Index'],
+                     keep: Optional[List[Optional[np.ndarray]]] = None):
+        """Concatenate indexes without re-tokenizing, optionally keeping only the rows selected by boolean masks"""
+        all_hashes, all_rows, all_tfs, all_lengths = [], [], [], []
+        base = 0
+
+        for index, mask in zip(indexes, keep or [None] * len(indexes)):
+            hashes = np.repeat(np.asarray(index.terms), np.diff(index.offsets))
+            rows = np.asarray(index.rows, dtype=np.int64)
+            tfs = np.asarray(index.tfs)
+            lengths = np.asarray(index.lengths)
+            if mask is not None:
+                # Renumber the surviving rows
+                new_rows = np.cumsum(mask) - 1
+                kept = mask[rows]
+                hashes, rows, tfs = hashes[kept], new_rows[rows[kept]], tfs[kept]
+                lengths = lengths[mask]
+
+            all_hashes.append(hashes)
+            all_rows.append(rows + base)
+            all_tfs.append(tfs)
+            all_lengths.append(lengths)
+            base += len(lengths)
+
+        BM25Index._from_postings(np.concatenate(all_hashes), np.concatenate(all_rows),
+                                 np.concatenate(all_tfs), np.concatenate(all_lengths)).save(directory)
+
+    def _positions(self, hashes: np.ndarray) -> np.ndarray:
+        """Position of each term hash in terms, or -1 if the term does not occur"""
+        if not len(self.terms):
+            return np.full(len(hashes), -1)
+        positions = np.minimum(np.searchsorted(self.terms, hashes), len(self.terms) - 1)
+        return np.where(self.terms[positions] == hashes, positions, -1)
+
+    def document_frequencies(self, hashes: np.ndarray) -> np.ndarray:
+        """Number of rows containing each term"""
+        positions = self._positions(hashes)
+        found = positions >= 0
+        df = np.zeros(len(hashes), dtype=np.int64)
+        df[found] = self.offsets[positions[found] + 1] - self.offsets[positions[found]]
+        return df
+
+    def score(self, hashes: np.ndarray, idf: np.ndarray, avgdl: float,
+              k1: float = 1.2, b: float = 0.75) -> Tuple[np.ndarray, np.ndarray]:
+        """BM25 scores of every row matching at least one term, as (rows, scores)"""
+        all_rows, all_weights = [], []
+        for position, term_idf in zip(self._positions(hashes), idf):
+            if position < 0:
+                continue
+            start, stop = self.offsets[position], self.offsets[position + 1]
+            rows = np.asarray(self.rows[start:stop])
+            tfs = np.asarray(self.tfs[start:stop], dtype=np.float32)
+            norm = k1 * (1 - b + b * np.asarray(self.lengths[rows]) / avgdl)
+            all_rows.append(rows)
+            all_weights.append(term_idf * tfs * (k1 + 1) / (tfs + norm))
+
+        if not all_rows:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+
+        rows, inverse = np.unique(np.concatenate(all_rows), return_inverse=True)
+        return rows, np.bincount(inverse, weights=np.concatenate(all_weights)).astype(np.float32)
+
+
+def corpus_idf(indexes: List[BM25Index], hashes: np.ndarray) -> Tuple[np.ndarray, float]:
+    """BM25 idf of each term and the average document length over all segments' indexes"""
+    n_docs = sum(len(index) for index in indexes)
+    total_length = sum(index.total_length for index in indexes)
+    df = sum((index.document_frequencies(hashes) for index in indexes), np.zeros(len(hashes), dtype=np.int64))
+    idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+    return idf, max(total_length / n_docs, 1.0) if n_docs else 1.0
@@ -0,0 +1,260 @@
+import hashlib
+import json
+import mmap
+import re
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+TEXT_FILE = "text.bin"
+OFFSETS_FILE = "offsets.npy"
+SOURCES_FILE = "sources.npy"
+TYPES_FILE = "types.npy"
+CHUNK_IDS_FILE = "chunk_ids.npy"
+HASHES_FILE = "hashes.npy"
+IDS_FILE = "ids.npy"
+TABLES_FILE = "tables.json"
+# Rows grouped by source/type code, and where each code's group starts
+GROUP_FILES = {'source': ("source_rows.npy", "source_starts.npy"),
+               'type': ("type_rows.npy", "type_starts.npy")}
+
+
+def group_rows(codes: np.ndarray, n_codes: int):
+    """Rows sorted by code, and the start of each code's run of rows (n_codes + 1 entries)"""
+    rows = np.argsort(codes, kind='stable').astype(np.int64)
+    starts = np.zeros(n_codes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=n_codes), out=starts[1:])
+    return rows, starts
+
+
+def _legacy_ids(directory: Path, n_rows: int) -> np.ndarray:
+    """Stable ids for a segment written before ids were stored: a tag from its name, then the row.
+
+    Allocated ids stay below 2**32, so these never collide with them.
+    """
+    tag = int(hashlib.blake2b(directory.name.encode('utf-8'), digest_size=4).hexdigest(), 16) % (2**31 - 1) + 1
+    return (tag << 32) + np.arange(n_rows, dtype=np.int64)
+
+
+def chunk_hash(text: str) -> int:
+    """64-bit hash of a chunk's text that ignores case, punctuation and spacing"""
+    normalized = ' '.join(re.sub(r'[^\w\s]', '', text.lower()).split())
+    digest = hashlib.blake2b(normalized.encode('utf-8', errors='surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def chunk_hashes(texts: List[str]) -> np.ndarray:
+    """chunk_hash of every text as a uint64 array"""
+    return np.fromiter((chunk_hash(text) for text in texts), dtype=np.uint64, count=len(texts))
+
+
+class _Interner:
+    """Assigns small integer codes to repeated strings such as sources and types"""
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.values: List[str] = []
+        self.hashes: List[Optional[str]] = []
+
+    def code(self, value: str, doc_hash: Optional[str] = None) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+            self.hashes.append(doc_hash)
+        elif doc_hash and not self.hashes[code]:
+            self.hashes[code] = doc_hash
+        return code
+
+
+class ChunkStore:
+    """Columnar chunk metadata for one segment, read through mmap.
+
+    Chunk text lives in a single UTF-8 blob addressed by an offsets array, and
+    sources and types are stored as codes into small interned tables. Opening
+    a store costs the same regardless of how many chunks it holds; rows are
+    decoded only when they are accessed. Each source also records the content
+    hash of the document it came from, and each chunk a hash of its text, for
+    deduplication.
+
+    The rows of every source and type are also stored grouped by code, so
+    a metadata filter can be turned into a row set without a scan. Every
+    chunk has a stable id that survives compaction, for deletes.
+    """
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+
+        with open(self.directory / TABLES_FILE, 'r', encoding='utf-8') as f:
+            tables = json.load(f)
+        self.source_table: List[str] = tables['sources']
+        self.source_hashes: List[Optional[str]] = tables['source_hashes']
+        self.type_table: List[str] = tables['types']
+
+        self.offsets = np.load(self.directory / OFFSETS_FILE, mmap_mode='r')
+        self.source_codes = np.load(self.directory / SOURCES_FILE, mmap_mode='r')
+        self.type_codes = np.load(self.directory / TYPES_FILE, mmap_mode='r')
+        self.chunk_ids = np.load(self.directory / CHUNK_IDS_FILE, mmap_mode='r')
+        self.hashes = np.load(self.directory / HASHES_FILE, mmap_mode='r')
+        if (self.directory / IDS_FILE).exists():
+            self.ids = np.load(self.directory / IDS_FILE, mmap_mode='r')
+        else:
+            self.ids = _legacy_ids(self.directory, len(self.offsets) - 1)
+        self._groups = {}
+
+        with open(self.directory / TEXT_FILE, 'rb') as f:
+            if self.offsets[-1] > 0:
+                self._text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # mmap cannot map an empty file
+                self._text = b''
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> Dict:
+        return {
+            'content': self.content(row),
+            'source': self.source(row),
+            'type': self.type(row),
+            'chunk_id': int(self.chunk_ids[row])
+        }
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def content(self, row: int) -> str:
+        """Decode the text of one chunk"""
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return self._text[start:end].decode('utf-8', errors='surrogatepass')
+
+    def source(self, row: int) -> str:
+        return self.source_table[self.source_codes[row]]
+
+    def type(self, row: int) -> str:
+        return self.type_table[self.type_codes[row]]
+
+    def rows_with(self, column: str, values) -> np.ndarray:
+        """Sorted rows whose 'source' or 'type' is one of values"""
+        table = self.source_table if column == 'source' else self.type_table
+        codes = [code for code, value in enumerate(table) if value in values]
+        if not codes:
+            return np.zeros(0, dtype=np.int64)
+
+        rows, starts = self._group(column)
+        if len(codes) == 1:
+            return np.asarray(rows[starts[codes[0]]:starts[codes[0] + 1]])
+        return np.sort(np.concatenate([rows[starts[code]:starts[code + 1]] for code in codes]))
+
+    def group_sizes(self, column: str) -> np.ndarray:
+        """Number of rows of each 'source' or 'type' code"""
+        return np.diff(self._group(column)[1])
+
+    def _group(self, column: str):
+        """Grouped rows of a column, computed for segments written before they were stored"""
+        group = self._groups.get(column)
+        if group is None:
+            rows_file, starts_file = GROUP_FILES[column]
+            if (self.directory / rows_file).exists():
+                group = (np.load(self.directory / rows_file, mmap_mode='r'),
+                         np.load(self.directory / starts_file, mmap_mode='r'))
+            else:
+                codes = self.source_codes if column == 'source' else self.type_codes
+                table = self.source_table if column == 'source' else self.type_table
+                group = group_rows(np.asarray(codes), len(table))
+            self._groups[column] = group
+        return group
+
+    def close(self):
+        """Release the memory map"""
+        if isinstance(self._text, mmap.mmap):
+            self._text.close()
+        self._text = b''
+
+    @staticmethod
+    def _write_columns(directory: Path, offsets: np.ndarray, source_codes: np.ndarray,
+                       type_codes: np.ndarray, chunk_ids: np.ndarray, hashes: np.ndarray,
+                       ids: np.ndarray, sources: _Interner, types: _Interner):
+        """Write every file except the text blob"""
+        np.save(directory / OFFSETS_FILE, offsets.astype(np.int64))
+        np.save(directory / IDS_FILE, ids.astype(np.int64))
+        np.save(directory / SOURCES_FILE, source_codes.astype(np.int32))
+        np.save(directory / TYPES_FILE, type_codes.astype(np.int32))
+        np.save(directory / CHUNK_IDS_FILE, chunk_ids.astype(np.int32))
+        np.save(directory / HASHES_FILE, hashes.astype(np.uint64))
+        for column, codes, interner in (('source', source_codes, sources), ('type', type_codes, types)):
+            rows, starts = group_rows(codes.astype(np.int64), len(interner.values))
+            np.save(directory / GROUP_FILES[column][0], rows)
+            np.save(directory / GROUP_FILES[column][1], starts)
+        with open(directory / TABLES_FILE, 'w', encoding='utf-8') as f:
+            json.dump({'sources': sources.values, 'source_hashes': sources.hashes,
+                       'types': types.values}, f)
+
+    @staticmethod
+    def write(directory: str, documents: List[Dict], ids: np.ndarray, hashes: Optional[np.ndarray] = None):
+        """Write chunk dicts ('content', 'source', 'type', 'chunk_id', optional 'doc_hash') with their stable ids"""
+        directory = Path(directory)
+        sources, types = _Interner(), _Interner()
+        lengths, source_codes, type_codes, chunk_ids = [], [], [], []
+        if hashes is None:
+            hashes = chunk_hashes([doc['content'] for doc in documents])
+
+        with open(directory / TEXT_FILE, 'wb') as f:
+            for doc in documents:
+                data = doc['content'].encode('utf-8', errors='surrogatepass')
+                f.write(data)
+                lengths.append(len(data))
+                source_codes.append(sources.code(doc['source'], doc.get('doc_hash')))
+                type_codes.append(types.code(doc['type']))
+                chunk_ids.append(doc.get('chunk_id', 0))
+
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        ChunkStore._write_columns(directory, offsets, np.array(source_codes), np.array(type_codes),
+                                  np.array(chunk_ids), hashes, np.asarray(ids), sources, types)
+
+    @staticmethod
+    def write_merged(directory: str, stores: List['ChunkStore'],
+                     keep: Optional[List[Optional[np.ndarray]]] = None):
+        """Concatenate stores into directory, optionally keeping only the rows selected by boolean masks"""
+        directory = Path(directory)
+        sources, types = _Interner(), _Interner()
+        offsets, source_codes, type_codes, chunk_ids, hashes, ids = [np.zeros(1, dtype=np.int64)], [], [], [], [], []
+        base = 0
+
+        with open(directory / TEXT_FILE, 'wb') as f:
+            for store, mask in zip(stores, keep or [None] * len(stores)):
+                if mask is None:
+                    # Whole store: copy the blob without decoding any chunk text
+                    rows = slice(None)
+                    with open(store.directory / TEXT_FILE, 'rb') as src:
+                        shutil.copyfileobj(src, f)
+                    ends = np.asarray(store.offsets[1:])
+                    size = int(store.offsets[-1])
+                else:
+                    rows = np.flatnonzero(mask)
+                    starts, stops = store.offsets[rows], store.offsets[rows + 1]
+                    for start, stop in zip(starts, stops):
+                        f.write(store._text[start:stop])
+                    ends = np.cumsum(stops - starts)
+                    size = int(ends[-1]) if len(ends) else 0
+
+                # Only sources that still have rows are carried over, with their document hashes
+                kept_sources = np.asarray(store.source_codes[rows])
+                source_map = np.full(len(store.source_table), -1, dtype=np.int32)
+                for code in np.unique(kept_sources):
+                    source_map[code] = sources.code(store.source_table[code], store.source_hashes[code])
+                type_map = np.array([types.code(value) for value in store.type_table], dtype=np.int32)
+
+                offsets.append(ends + base)
+                source_codes.append(source_map[kept_sources])
+                type_codes.append(type_map[np.asarray(store.type_codes[rows])])
+                chunk_ids.append(np.asarray(store.chunk_ids[rows]))
+                hashes.append(np.asarray(store.hashes[rows]))
+                ids.append(np.asarray(store.ids[rows]))
+                base += size
+
+        ChunkStore._write_columns(directory, np.concatenate(offsets), np.concatenate(source_codes),
+                                  np.concatenate(type_codes), np.concatenate(chunk_ids),
+                                  np.concatenate(hashes), np.concatenate(ids), sources, types)
@@ -0,0 +1,179 @@
+import math
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from utils.chunk_store import chunk_hash
+
+# Stable start of every fresh prompt, so Ollama can reuse its cached evaluation across turns
+PREAMBLE = ("Answer the user's questions using the context passages below. "
+            "If the answer is not available in the context, please say so.\n\n")
+
+ChunkKey = Tuple[str, int]
+
+# Ends a passage cut short to fit the budget
+_TRUNCATED = " ..."
+
+
+class Passage:
+    """Text of one or more consecutive chunks of a source, with their best similarity"""
+    __slots__ = ('source', 'first', 'last', 'text', 'similarity')
+
+    def __init__(self, source: str, first: int, last: int, text: str, similarity: float):
+        self.source = source
+        self.first = first
+        self.last = last
+        self.text = text
+        self.similarity = similarity
+
+    @property
+    def keys(self) -> FrozenSet[ChunkKey]:
+        return frozenset((self.source, chunk_id) for chunk_id in range(self.first, self.last + 1))
+
+    def sent_keys(self) -> FrozenSet[ChunkKey]:
+        """Chunks whose whole text this passage puts in the prompt"""
+        return frozenset() if self.text.endswith(_TRUNCATED) else self.keys
+
+    def format(self) -> str:
+        chunks = f"chunk {self.first}" if self.first == self.last else f"chunks {self.first}-{self.last}"
+        return f"Source: {self.source} ({chunks}, relevance: {self.similarity:.2f})\nContent: {self.text}\n"
+
+
+class ConversationContext:
+    """Ollama's context tokens after a turn, and the chunks whose text they already contain"""
+    __slots__ = ('tokens', 'chunks', 'generation')
+
+    def __init__(self, tokens: List[int], chunks: FrozenSet[ChunkKey], generation: int):
+        self.tokens = tokens
+        self.chunks = chunks
+        self.generation = generation
+
+
+class Prompt:
+    """A prompt to send, the context tokens to continue from (None for a fresh one) and the chunks it covers"""
+    __slots__ = ('text', 'context', 'chunks')
+
+    def __init__(self, text: str, context: Optional[List[int]], chunks: FrozenSet[ChunkKey]):
+        self.text = text
+        self.context = context
+        self.chunks = chunks
+
+
+def join_overlapping(first: str, second: str, max_overlap: int) -> str:
+    """Join consecutive chunks, dropping the start of second that repeats the end of first.
+
+    Chunks start at a word, so an overlap must begin after whitespace in first;
+    the longest one wins. Chunks that do not overlap are joined by a newline.
+    """
+    if not first or not second:
+        return first or second
+    start = first.find(second[0], max(0, len(first) - max_overlap))
+    while start >= 0:
+        if (start == 0 or first[start - 1].isspace()) and second.startswith(first[start:]):
+            return first[:start] + second
+        start = first.find(second[0], start + 1)
+    return first + "\n" + second
+
+
+class ContextBuilder:
+    """Turns search hits into a prompt packed to a token budget.
+
+    Hits on consecutive chunks of a source are merged into one passage with
+    their overlap removed, and chunks with the same normalized text are
+    kept once. Passages are packed best first until the budget is spent and
+    then laid out in source order, so the same retrieval gives the same
+    prompt. Given the context of the previous turn, passages it already
+    contains are left out and the prompt continues from it, as long as the
+    whole still fits the model's context window. Otherwise the most recent
+    turns of the conversation that fit history_budget are written out.
+    """
+    def __init__(self, token_budget: int = 1500, chars_per_token: float = 4.0, max_overlap: int = 200,
+                 context_window: int = 4096, answer_tokens: int = 512, history_budget: int = 500):
+        self.token_budget = token_budget
+        self.history_budget = history_budget
+        self.chars_per_token = chars_per_token
+        self.max_overlap = max_overlap
+        self.context_window = context_window
+        self.answer_tokens = answer_tokens
+
+    def estimate_tokens(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def passages(self, hits: List[Dict]) -> List[Passage]:
+        """Merge hits on consecutive chunks and drop repeated text, best passage first"""
+        seen_hashes, by_chunk = set(), {}
+        for hit in sorted(hits, key=lambda hit: -hit.get('similarity', 0.0)):
+            metadata = hit['metadata']
+            key = (metadata['source'], metadata.get('chunk_id', -1))
+            text_hash = chunk_hash(hit['content'])
+            if key in by_chunk or text_hash in seen_hashes:
+                continue
+            seen_hashes.add(text_hash)
+            by_chunk[key] = hit
+
+        passages = []
+        for source, chunk_id in sorted(by_chunk):
+            hit = by_chunk[(source, chunk_id)]
+            similarity = hit.get('similarity', 0.0)
+            previous = passages[-1] if passages else None
+            if previous is not None and previous.source == source and chunk_id >= 0 and previous.last == chunk_id - 1:
+                previous.text = join_overlapping(previous.text, hit['content'], self.max_overlap)
+                previous.last = chunk_id
+                previous.similarity = max(previous.similarity, similarity)
+            else:
+                passages.append(Passage(source, chunk_id, chunk_id, hit['content'], similarity))
+        passages.sort(key=lambda passage: -passage.similarity)
+        return passages
+
+    def pack(self, passages: List[Passage], known: FrozenSet[ChunkKey] = frozenset()) -> List[Passage]:
+        """Passages to send, best first, within the token budget; those whose chunks are all known cost nothing"""
+        packed, used = [], 0
+        for passage in passages:
+            if passage.keys <= known:
+                continue
+            cost = self.estimate_tokens(passage.format())
+            if used + cost <= self.token_budget:
+                packed.append(passage)
+                used += cost
+        if not packed and passages and not passages[0].keys <= known:
+            # Nothing fits whole: send as much of the best passage as the budget allows
+            best = passages[0]
+            limit = max(int(self.token_budget * self.chars_per_token) - (len(best.format()) - len(best.text)), 0)
+            cut = best.text.rfind(' ', 0, limit)
+            packed.append(Passage(best.source, best.first, best.last,
+                                  best.text[:cut if cut > 0 else limit] + _TRUNCATED, best.similarity))
+        return packed
+
+    def recent_turns(self, history: List[Tuple[str, str]]) -> str:
+        """The latest (question, answer) turns that fit the history budget, oldest first"""
+        turns, used = [], 0
+        for question, answer in reversed(history):
+            turn = f"User: {question}\nAssistant: {answer}\n"
+            used += self.estimate_tokens(turn)
+            if used > self.history_budget:
+                break
+            turns.append(turn)
+        return "".join(reversed(turns))
+
+    def build(self, query: str, hits: List[Dict], previous: Optional[ConversationContext] = None,
+              history: Optional[List[Tuple[str, str]]] = None) -> Prompt:
+        """Prompt answering query from hits, continuing from the previous turn's context if it has room"""
+        passages = self.passages(hits)
+        if previous is not None:
+            packed = self.pack(passages, previous.chunks)
+            text = self._format(packed, query, "Additional context:\n" if packed else "")
+            needed = len(previous.tokens) + self.estimate_tokens(text) + self.answer_tokens
+            if needed <= self.context_window:
+                return Prompt(text, previous.tokens, previous.chunks.union(*(p.sent_keys() for p in packed)))
+
+        packed = self.pack(passages)
+        # Turns go after the passages, so the prompt's start stays the same as the conversation goes on
+        text = PREAMBLE + self._format(packed, query, "Context:\n", self.recent_turns(history or []))
+        return Prompt(text, None, frozenset().union(*(p.sent_keys() for p in packed)))
+
+    @staticmethod
+    def _format(packed: List[Passage], query: str, heading: str, turns: str = "") -> str:
+        context = "\n---\n".join(passage.format() for passage in sorted(packed, key=lambda p: (p.source, p.first)))
+        parts = [f"{heading}{context}\n"] if context else []
+        if turns:
+            parts.append(f"Conversation so far:\n{turns}")
+        parts.append(f"Question: {query}\n\nAnswer:")
+        return "\n".join(parts)
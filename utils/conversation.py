@@ -0,0 +1,134 @@
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from utils.bm25_index import tokenize
+from utils.metrics import span
+
+
+class _Retrieval:
+    """The last search of a conversation: its text, query vector, candidate chunks, their vectors and terms"""
+    __slots__ = ('text', 'vector', 'hits', 'vectors', 'generation', 'terms')
+
+    def __init__(self, text: str, vector: np.ndarray, hits: List[Dict], vectors: np.ndarray, generation: int,
+                 terms: Optional[Set[str]] = None):
+        self.text = text
+        self.vector = vector
+        self.hits = hits
+        self.vectors = vectors
+        self.generation = generation
+        self.terms = terms if terms is not None else {term for hit in hits for term in tokenize(hit['content'])}
+
+
+class Conversation:
+    """Retrieval state of one chat session, so follow-up questions build on the previous turn.
+
+    Each search keeps a pool of candidates larger than a prompt needs,
+    along with their stored vectors. A follow-up close enough to the last
+    search (cosine similarity of at least reuse_similarity) is answered by
+    re-ranking that pool against both questions, without touching the index,
+    as long as the pool contains every keyword of the follow-up that the
+    index does; the embedding misses words outside its vocabulary, which a
+    real search would still match. Other short follow-ups, which rarely
+    stand on their own ("and its cost?"), are searched together with the
+    question the pool started from. The pool is dropped when the index
+    generation changes.
+    """
+    def __init__(self, vector_store, candidates: int = 24, reuse_similarity: float = 0.8,
+                 follow_up_terms: int = 4, max_turns: int = 20):
+        self.vector_store = vector_store
+        self.candidates = candidates
+        self.reuse_similarity = reuse_similarity
+        self.follow_up_terms = follow_up_terms
+        self.turns = deque(maxlen=max_turns)
+        self._last: Optional[_Retrieval] = None
+        self._embedded: Optional[Tuple[str, np.ndarray]] = None
+
+    def reset(self):
+        self.turns.clear()
+        self._last = None
+
+    def _embed(self, query: str) -> np.ndarray:
+        """The query's vector, kept while the same query is asked about twice in a turn"""
+        if self._embedded is None or self._embedded[0] != query:
+            self._embedded = (query, self.vector_store.embed([query])[0])
+        return self._embedded[1]
+
+    def _previous(self) -> Optional[_Retrieval]:
+        last = self._last
+        return last if last is not None and last.generation == self.vector_store.generation else None
+
+    def _is_short(self, query: str) -> bool:
+        return len(self.vector_store.embedding_model.document_terms([query])[0]) <= self.follow_up_terms
+
+    def is_follow_up(self, query: str) -> bool:
+        """Whether retrieval for query would depend on the previous turn"""
+        previous = self._previous()
+        if previous is None or not self.vector_store.has_vocabulary():
+            return False
+        return self._is_short(query) or float(self._embed(query) @ previous.vector) >= self.reuse_similarity
+
+    def retrieve(self, query: str, n_results: int) -> List[Dict]:
+        """The n_results best chunks for query in the context of the conversation"""
+        store = self.vector_store
+        previous = self._previous()
+        question = text = query
+        if previous is not None and store.has_vocabulary():
+            vector = self._embed(query)
+            if (float(vector @ previous.vector) >= self.reuse_similarity and len(previous.hits)
+                    and self._pool_covers(query, previous)):
+                with span('rerank'):
+                    return self._rerank(previous, vector, n_results)
+            if self._is_short(query):
+                # Searched with the question the pool started from, which stays its text, so a chain
+                # of short follow-ups does not pile up in the search
+                question = previous.text
+                text = f"{question} {query}"
+
+        generation = store.generation
+        results = store.search_batch([text], max(n_results, self.candidates))
+        hits = results[0]
+        if hits and store.has_vocabulary():
+            # The candidates' vectors are read from the index rather than embedded again
+            vector = self._embed(text)
+            self._last = _Retrieval(question, vector, hits, results.vectors(0), generation)
+        else:
+            self._last = None
+        return hits[:n_results]
+
+    def _pool_covers(self, query: str, previous: _Retrieval) -> bool:
+        """Whether every keyword of query found anywhere in the index is also found in the pooled chunks"""
+        missing = sorted(set(tokenize(query)) - previous.terms)
+        return not self.vector_store.indexed_terms(missing)
+
+    def _rerank(self, previous: _Retrieval, vector: np.ndarray, n_results: int) -> List[Dict]:
+        """The previous candidates best matching both the follow-up and the question it follows"""
+        combined = vector + previous.vector
+        combined /= max(float(np.linalg.norm(combined)), 1e-12)
+        scores = previous.vectors @ combined
+        order = np.argsort(-scores, kind='stable')[:n_results]
+        # The pool now serves the follow-up; its vector drifts towards the conversation's latest questions
+        self._last = _Retrieval(previous.text, combined, previous.hits, previous.vectors, previous.generation,
+                                previous.terms)
+        return [dict(previous.hits[i], similarity=float(scores[i]), distance=1.0 - float(scores[i]))
+                for i in order]
+
+    def add_turn(self, query: str, answer: str, retrieved: bool = True):
+        """Record a finished turn; one answered without retrieve() leaves no candidates to follow up on"""
+        self.turns.append((query, answer))
+        if not retrieved:
+            self._last = None
+
+    def history(self, chat_history: Optional[List[Dict]] = None) -> List[Tuple[str, str]]:
+        """(question, answer) pairs of the finished turns, oldest first, from chat_history messages if given"""
+        if chat_history is None:
+            return list(self.turns)
+        pairs, question = [], None
+        for message in chat_history:
+            if message.get('role') == 'user':
+                question = message['content']
+            elif message.get('role') == 'assistant' and question is not None:
+                pairs.append((question, message['content']))
+                question = None
+        return pairs
@@ -0,0 +1,158 @@
+import math
+from typing import List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+import config
+
+INDEX_TYPES = ('flat', 'ivfflat', 'ivfpq', 'hnsw', 'sq8', 'fp16', 'pq')
+
+# FAISS wants roughly this many training points per centroid
+_MIN_POINTS_PER_CENTROID = 39
+_ADD_BATCH_SIZE = 65536
+
+
+def choose_index_type(n_vectors: int) -> str:
+    """Pick an index type for a segment of n_vectors"""
+    index_type = config.FAISS_INDEX_TYPE.lower()
+    if index_type not in ('auto',) + INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS_INDEX_TYPE: {config.FAISS_INDEX_TYPE}")
+
+    if index_type == 'auto':
+        if n_vectors < config.AUTO_IVF_MIN_VECTORS:
+            index_type = 'flat'
+        elif n_vectors < config.AUTO_IVFPQ_MIN_VECTORS:
+            index_type = 'ivfflat'
+        else:
+            index_type = 'ivfpq'
+
+    # Too few vectors to train the coarse quantizer or the PQ codebooks well
+    if index_type in ('ivfflat', 'ivfpq') and n_vectors < _nlist(n_vectors) * _MIN_POINTS_PER_CENTROID:
+        index_type = 'flat'
+    if index_type == 'ivfpq' and n_vectors < (1 << config.PQ_NBITS) * _MIN_POINTS_PER_CENTROID:
+        index_type = 'flat'
+    if index_type == 'pq' and n_vectors < (1 << config.PQ_NBITS) * _MIN_POINTS_PER_CENTROID:
+        # Scalar quantization needs no codebooks and still stores a quarter of the bytes
+        index_type = 'sq8'
+
+    return index_type
+
+
+def _nlist(n_vectors: int) -> int:
+    """Number of IVF lists, from config or about 4 * sqrt(n)"""
+    if config.IVF_NLIST:
+        return config.IVF_NLIST
+    return max(1, min(65536, int(4 * math.sqrt(n_vectors))))
+
+
+def _create_index(index_type: str, n_vectors: int):
+    """Create an empty inner-product index of the given type"""
+    dim = config.EMBEDDING_DIM
+    if index_type == 'flat':
+        return faiss.IndexFlatIP(dim)
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, config.HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = config.HNSW_EF_CONSTRUCTION
+        return index
+    if index_type == 'sq8':
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    if index_type == 'fp16':
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    if index_type == 'pq':
+        return faiss.IndexPQ(dim, config.PQ_M, config.PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+
+    quantizer = faiss.IndexFlatIP(dim)
+    if index_type == 'ivfflat':
+        index = faiss.IndexIVFFlat(quantizer, dim, _nlist(n_vectors), faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexIVFPQ(quantizer, dim, _nlist(n_vectors), config.PQ_M, config.PQ_NBITS,
+                                 faiss.METRIC_INNER_PRODUCT)
+    return index
+
+
+def _training_sample(blocks: List[np.ndarray], n_vectors: int) -> np.ndarray:
+    """Draw a uniform sample across blocks, reading only the sampled rows"""
+    size = min(n_vectors, config.INDEX_TRAIN_SAMPLE)
+    rng = np.random.default_rng(0)
+    picks = np.sort(rng.choice(n_vectors, size=size, replace=False))
+
+    sample, offset = [], 0
+    for block in blocks:
+        in_block = picks[(picks >= offset) & (picks < offset + len(block))] - offset
+        if len(in_block):
+            sample.append(np.asarray(block[in_block], dtype=np.float32))
+        offset += len(block)
+    return np.ascontiguousarray(np.vstack(sample))
+
+
+def configure_search(index):
+    """Apply the nprobe/efSearch knobs to an index built or read from disk"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(config.IVF_NPROBE, ivf.nlist)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = config.HNSW_EF_SEARCH
+    return index
+
+
+def is_quantized(index) -> bool:
+    """Whether the index scores compressed codes rather than the vectors themselves"""
+    return isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexPQ,
+                              faiss.IndexIVFScalarQuantizer, faiss.IndexIVFPQ))
+
+
+def rerank(vectors: np.ndarray, queries: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Re-score candidate rows (-1 for none) of each query exactly and keep the top k (scores, rows).
+
+    vectors are the segment's stored float32 vectors, usually memory-mapped;
+    only the candidates' rows are read, in one sorted pass.
+    """
+    valid = rows >= 0
+    candidates = np.unique(rows[valid])
+    exact = np.asarray(vectors[candidates], dtype=np.float32)
+    positions = np.searchsorted(candidates, np.where(valid, rows, 0))
+    scores = np.full(rows.shape, -np.inf, dtype=np.float32)
+    if len(candidates):
+        for query, query_positions in enumerate(positions):
+            scores[query] = exact[np.minimum(query_positions, len(candidates) - 1)] @ queries[query]
+        scores[~valid] = -np.inf
+
+    k = min(k, rows.shape[1])
+    top = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+    scores = np.take_along_axis(scores, top, axis=1)
+    rows = np.take_along_axis(rows, top, axis=1)
+    rows[np.isneginf(scores)] = -1
+    return scores, rows
+
+
+def supports_selection(index) -> bool:
+    """Whether searches of the index can be restricted by an IDSelector (IndexPQ rejects search parameters)"""
+    return not isinstance(index, faiss.IndexPQ)
+
+
+def search_parameters(index, selector):
+    """Search parameters restricting a search to the ids accepted by selector, with the index's own knobs"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def build_index(blocks: List[np.ndarray], index_type: Optional[str] = None):
+    """Build an index over normalized vectors given as one or more (possibly memory-mapped) blocks"""
+    n_vectors = sum(len(block) for block in blocks)
+    index_type = index_type or choose_index_type(n_vectors)
+    index = _create_index(index_type, n_vectors)
+
+    if not index.is_trained:
+        index.train(_training_sample(blocks, n_vectors))
+
+    # Add in slices so memory-mapped blocks are never copied whole
+    for block in blocks:
+        for start in range(0, len(block), _ADD_BATCH_SIZE):
+            index.add(np.ascontiguousarray(block[start:start + _ADD_BATCH_SIZE], dtype=np.float32))
+
+    return configure_search(index)
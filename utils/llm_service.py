@@ -0,0 +1,216 @@
+import asyncio
+import json
+import queue
+import threading
+import uuid
+from collections import OrderedDict, deque
+from typing import Dict, Iterator, Optional, Union
+
+import httpx
+
+import config
+from utils.metrics import REQUEST_STAGE_SECONDS
+
+
+class LLMServiceError(Exception):
+    """Ollama failed or returned an error for a generation"""
+
+
+class LLMBusyError(LLMServiceError):
+    """The generation could not get a slot: the queue is full or the wait timed out"""
+
+
+# Marks the end of a generation's stream of parts
+_END = object()
+
+
+class _FairQueue:
+    """Grants a bounded number of slots, round-robin across sessions.
+
+    Waiters queue per session and the sessions take turns, so one session
+    asking many questions cannot starve the others. Used on the event loop only.
+    """
+    def __init__(self, slots: int, max_waiting: int):
+        self.free = slots
+        self.max_waiting = max_waiting
+        self.n_waiting = 0
+        self._waiting: 'OrderedDict[str, deque]' = OrderedDict()
+
+    async def acquire(self, session: str, timeout: Optional[float] = None):
+        """Wait for a slot, raising LLMBusyError if too many are waiting or none frees up within timeout"""
+        if self.free > 0 and not self._waiting:
+            self.free -= 1
+            return
+        if self.n_waiting >= self.max_waiting:
+            raise LLMBusyError(f"{self.n_waiting} generations are already waiting")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(session, deque()).append(future)
+        self.n_waiting += 1
+        try:
+            # Unlike wait_for, wait leaves the future alone, so a slot granted on timeout is not lost
+            await asyncio.wait([future], timeout=timeout)
+        except asyncio.CancelledError:
+            if future.done():
+                # Granted just as it was cancelled; pass the slot on
+                self.release()
+            else:
+                self._forget(session, future)
+            raise
+        if not future.done():
+            self._forget(session, future)
+            raise LLMBusyError(f"No free slot within {timeout}s")
+
+    def release(self):
+        """Hand the slot to the next session in turn, or free it"""
+        while self._waiting:
+            session, waiters = next(iter(self._waiting.items()))
+            future = waiters.popleft()
+            self.n_waiting -= 1
+            if waiters:
+                self._waiting.move_to_end(session)
+            else:
+                del self._waiting[session]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.free += 1
+
+    def _forget(self, session: str, future: asyncio.Future):
+        waiters = self._waiting.get(session)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            self.n_waiting -= 1
+            if not waiters:
+                del self._waiting[session]
+
+
+class LLMService:
+    """Asynchronous Ollama generation client shared by every session in the process.
+
+    Requests run on one event loop in a background thread over a pooled
+    HTTP/1.1 connection per slot. At most max_in_flight generations are sent
+    to Ollama at once, which batches them on its side (OLLAMA_NUM_PARALLEL);
+    the rest wait in a fair queue, bounded in length and in waiting time.
+    Streams are consumed as plain iterators from any thread, and closing one
+    early (a user navigating away) cancels the request, which stops Ollama
+    generating for it. Every request asks for a num_ctx token context window
+    unless its options say otherwise, so prompts sized for that window are
+    not cut short by a smaller server default.
+    """
+    def __init__(self, base_url: str = config.OLLAMA_BASE_URL, max_in_flight: int = 4,
+                 max_queued: int = 64, queue_timeout: float = 60, connect_timeout: float = 5,
+                 read_timeout: float = 120, keep_alive: Optional[Union[str, float]] = "30m",
+                 num_ctx: Optional[int] = None):
+        self.queue_timeout = queue_timeout
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        self._slots = _FairQueue(max_in_flight, max_queued)
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+        )
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-service", daemon=True)
+        self._thread.start()
+
+    def client(self, session: Optional[str] = None) -> '_SessionClient':
+        """A client with ollama.Client's generate(), queued fairly as session (a new one if None)"""
+        return _SessionClient(self, session or uuid.uuid4().hex)
+
+    def stream(self, model: str, prompt: str, session: str = 'default', **params) -> Iterator[Dict]:
+        """Yield the streamed response parts of one generation, as ollama.Client.generate(stream=True) does"""
+        parts = queue.Queue()
+        payload = dict(params, model=model, prompt=prompt, stream=True)
+        payload.setdefault('keep_alive', self.keep_alive)
+        if self.num_ctx:
+            payload['options'] = dict({'num_ctx': self.num_ctx}, **(payload.get('options') or {}))
+        future = asyncio.run_coroutine_threadsafe(self._generate(session, payload, parts.put), self._loop)
+        try:
+            while True:
+                part = parts.get()
+                if part is _END:
+                    break
+                if isinstance(part, Exception):
+                    raise part
+                yield part
+        finally:
+            # A no-op once finished; otherwise drops the request from the queue or Ollama
+            future.cancel()
+
+    def generate(self, model: str, prompt: str, session: str = 'default', **params) -> Dict:
+        """Run one generation to completion, returning its final part with the whole response"""
+        parts = list(self.stream(model, prompt, session, **params))
+        return dict(parts[-1], response=''.join(part.get('response', '') for part in parts))
+
+    @property
+    def waiting(self) -> int:
+        """Generations waiting for a slot"""
+        return self._slots.n_waiting
+
+    async def _generate(self, session: str, payload: Dict, put):
+        try:
+            with REQUEST_STAGE_SECONDS.labels('llm_queue').time():
+                await self._slots.acquire(session, self.queue_timeout)
+            try:
+                async with self._http.stream('POST', '/api/generate', json=payload) as response:
+                    if response.status_code != 200:
+                        await response.aread()
+                        raise LLMServiceError(f"Ollama returned HTTP {response.status_code}: {response.text}")
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        part = json.loads(line)
+                        if 'error' in part:
+                            raise LLMServiceError(part['error'])
+                        put(part)
+            except httpx.HTTPError as e:
+                raise LLMServiceError(f"{type(e).__name__}: {e}") from e
+            finally:
+                self._slots.release()
+        except Exception as e:
+            put(e)
+        finally:
+            put(_END)
+
+    def close(self):
+        """Close the connection pool and stop the event loop"""
+        asyncio.run_coroutine_threadsafe(self._http.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+class _SessionClient:
+    """Stands in for ollama.Client, sending every generation through the service as one session"""
+    def __init__(self, service: LLMService, session: str):
+        self.service = service
+        self.session = session
+
+    def generate(self, model: str = '', prompt: str = '', stream: bool = False, **params):
+        if stream:
+            return self.service.stream(model, prompt, self.session, **params)
+        return self.service.generate(model, prompt, self.session, **params)
+
+
+_service: Optional[LLMService] = None
+_service_lock = threading.Lock()
+
+
+def get_llm_service() -> LLMService:
+    """The process-wide generation service, configured from config on first use"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = LLMService(
+                config.OLLAMA_BASE_URL,
+                max_in_flight=config.LLM_MAX_IN_FLIGHT,
+                max_queued=config.LLM_MAX_QUEUED,
+                queue_timeout=config.LLM_QUEUE_TIMEOUT,
+                connect_timeout=config.LLM_CONNECT_TIMEOUT,
+                read_timeout=config.LLM_READ_TIMEOUT,
+                keep_alive=config.OLLAMA_KEEP_ALIVE,
+                num_ctx=config.CONTEXT_WINDOW
+            )
+        return _service
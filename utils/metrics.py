@@ -0,0 +1,231 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond index work up to long generations
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Timer:
+    """Context manager observing the elapsed time into a histogram"""
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram: '_HistogramChild'):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _HistogramChild:
+    """Bucket counts for one label combination"""
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile by interpolating within its bucket"""
+        counts, _, count = self.snapshot()
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[index] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """The series for one combination of label values"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def series(self) -> List[Tuple[Tuple[str, ...], object]]:
+        with self._lock:
+            return sorted(self._children.items())
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def render(self) -> List[str]:
+        lines = []
+        for values, child in self.series():
+            counts, total, count = child.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, values)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, values)} {count}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"
+                for values, child in self.series()]
+
+
+class Registry:
+    """Process-wide set of metrics, rendered in the Prometheus text format"""
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_STAGE_SECONDS = REGISTRY.histogram(
+    'rag_request_stage_seconds', 'Time spent in each stage of answering a question', ['stage'])
+INGEST_STAGE_SECONDS = REGISTRY.histogram(
+    'rag_ingest_stage_seconds', 'Time spent per batch in each ingestion stage', ['stage'])
+INGEST_ITEMS = REGISTRY.counter(
+    'rag_ingest_items_total', 'Items that passed each ingestion stage', ['stage'])
+REQUESTS = REGISTRY.counter(
+    'rag_requests_total', 'Questions answered, by outcome', ['outcome'])
+
+
+def span(stage: str) -> _Timer:
+    """Time a stage of the request path: with span('search'): ..."""
+    return REQUEST_STAGE_SECONDS.labels(stage).time()
+
+
+def stage_summary(histogram: Histogram = REQUEST_STAGE_SECONDS) -> List[Dict]:
+    """Count, mean and estimated p50/p95/p99 in milliseconds for every stage of a histogram"""
+    rows = []
+    for (stage,), child in histogram.series():
+        _, total, count = child.snapshot()
+        if not count:
+            continue
+        rows.append({
+            'stage': stage,
+            'count': count,
+            'mean_ms': 1000 * total / count,
+            'p50_ms': 1000 * child.quantile(0.5),
+            'p95_ms': 1000 * child.quantile(0.95),
+            'p99_ms': 1000 * child.quantile(0.99)
+        })
+    return rows
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+    """Serve /metrics from a daemon thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -1,55 +1,299 @@
 import zipfile
 import os
+import hashlib
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
 import PyPDF2
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Callable, Optional, Tuple
+
+
+class _ExtractionTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise _ExtractionTimeout()
+
+
+def chunk_page_stream(pages: Iterable[str], text_splitter) -> Iterator[str]:
+    """Split a stream of pages into chunks while holding only a few chunks of text at a time"""
+    window = 4 * text_splitter.chunk_size
+    buffer = ""
+
+    for page in pages:
+        buffer = f"{buffer}{page}\n"
+        if len(buffer) < window:
+            continue
+
+        offsets = list(text_splitter.split_offsets(buffer))
+        for start, end in offsets[:-1]:
+            yield buffer[start:end]
+
+        # Restart from the last chunk so it can still grow into the next page
+        buffer = buffer[offsets[-1][0]:] if offsets else ""
+
+    if buffer.strip():
+        yield from text_splitter.split_text(buffer)
+
+
+def _extract_pages(pdf_path: str, start: int, stop: int, timeout: float,
+                   deadline: Optional[float] = None) -> Tuple[int, List[str], bool, Optional[float]]:
+    """Extract pages start..stop-1 of a PDF in a worker process.
+
+    All batches of a PDF share one deadline, a time.time() set by its first
+    batch timeout seconds after it starts. Returns the PDF's page count, the
+    text of the pages extracted, whether all of them were and the deadline;
+    on a timeout or error, the pages before it are kept.
+    """
+    if deadline is None and timeout:
+        deadline = time.time() + timeout
+    remaining = deadline - time.time() if deadline is not None else None
+    if remaining is not None and remaining <= 0:
+        # An earlier batch of the PDF already reported the timeout
+        return 0, [], False, deadline
+
+    # SIGALRM can interrupt a stuck parser, but only from a process's main thread
+    use_alarm = (remaining is not None and hasattr(signal, 'setitimer')
+                 and threading.current_thread() is threading.main_thread())
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, remaining)
+
+    n_pages, texts = 0, []
+    try:
+        with open(pdf_path, 'rb') as file:
+            pages = PyPDF2.PdfReader(file).pages
+            n_pages = len(pages)
+            for i in range(start, min(stop, n_pages)):
+                texts.append(pages[i].extract_text())
+        return n_pages, texts, True, deadline
+    except _ExtractionTimeout:
+        print(f"Timed out extracting text from {pdf_path} after {timeout}s")
+    except Exception as e:
+        print(f"Error extracting text from {pdf_path}: {str(e)}")
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return n_pages, texts, False, deadline
+
+
+class _PendingPDF:
+    """A PDF being extracted: its batches in flight in page order, its page count once known and its deadline"""
+    __slots__ = ('pdf_file', 'futures', 'n_pages', 'next_start', 'deadline')
+
+    def __init__(self, pdf_file: str):
+        self.pdf_file = pdf_file
+        self.futures = deque()
+        self.n_pages: Optional[int] = None
+        self.next_start = 0
+        self.deadline: Optional[float] = None
+
+    def has_unqueued(self) -> bool:
+        return self.n_pages is not None and self.next_start < self.n_pages
+
+    def end(self):
+        """Stop extracting the PDF after a batch timed out or failed"""
+        for future in self.futures:
+            future.cancel()
+        self.futures.clear()
+        self.n_pages = 0
+
 
 class PDFExtractor:
-    def __init__(self, extract_dir: str):
+    def __init__(self, extract_dir: str, workers: int = 0, timeout: float = 120.0, page_batch: int = 16):
         self.extract_dir = Path(extract_dir)
         self.extract_dir.mkdir(exist_ok=True)
-    
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.page_batch = page_batch
+
     def extract_zip(self, zip_path: str) -> List[str]:
         """Extract PDF files from zip archive"""
         pdf_files = []
-        
+
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
             for file_info in zip_ref.infolist():
                 if file_info.filename.lower().endswith('.pdf'):
                     # Extract PDF file
                     zip_ref.extract(file_info, self.extract_dir)
                     pdf_files.append(str(self.extract_dir / file_info.filename))
-        
+
         return pdf_files
+
+    @staticmethod
+    def file_hash(pdf_path: str) -> str:
+        """SHA-256 of a PDF file's bytes"""
+        digest = hashlib.sha256()
+        with open(pdf_path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
     
-    def extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Extract text content from PDF file"""
-        text = ""
-        
+    @staticmethod
+    def iter_pages(pdf_path: str) -> Iterator[str]:
+        """Yield the text of each page of a PDF file"""
         try:
             with open(pdf_path, 'rb') as file:
                 pdf_reader = PyPDF2.PdfReader(file)
-                
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text += page.extract_text() + "\n"
-                    
+
+                for page in pdf_reader.pages:
+                    yield page.extract_text()
+
+        except _ExtractionTimeout:
+            raise
         except Exception as e:
             print(f"Error extracting text from {pdf_path}: {str(e)}")
-            
-        return text
-    
+
+    def extract_text_from_pdf(self, pdf_path: str) -> str:
+        """Extract text content from PDF file"""
+        return "".join(f"{page}\n" for page in self.iter_pages(pdf_path))
+
+    def _run(self, pdf_files: List[str]) -> Iterator[Tuple[str, List[str]]]:
+        """Yield (pdf_file, page texts) a batch of pages at a time in input order.
+
+        Every batch is extracted in the worker pool, where PDF_TIMEOUT can be
+        enforced per file, with at most a few batches of text in flight. The
+        first batches of several files run at once; a file's remaining batches
+        are queued as soon as its first tells how many pages it has. A batch
+        that times out or fails ends its file.
+        """
+        max_pending = 2 * self.workers
+        files = iter(pdf_files)
+        active = deque()
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            def submit(pdf: _PendingPDF):
+                pdf.futures.append(executor.submit(_extract_pages, pdf.pdf_file, pdf.next_start,
+                                                   pdf.next_start + self.page_batch, self.timeout, pdf.deadline))
+                pdf.next_start += self.page_batch
+
+            def fill():
+                # Batches of files already started come first, in output order, then new files
+                pending = sum(len(pdf.futures) for pdf in active)
+                for pdf in active:
+                    # The file being yielded always has a batch in flight, however full the queue
+                    while pdf.has_unqueued() and (pending < max_pending or (pdf is active[0] and not pdf.futures)):
+                        submit(pdf)
+                        pending += 1
+                while pending < max_pending:
+                    pdf_file = next(files, None)
+                    if pdf_file is None:
+                        break
+                    active.append(_PendingPDF(pdf_file))
+                    submit(active[-1])
+                    pending += 1
+
+            fill()
+            waiting, running_since = None, None
+            while active:
+                head = active[0]
+                if not head.futures:
+                    active.popleft()
+                    fill()
+                    continue
+
+                future = head.futures[0]
+                if future is not waiting:
+                    waiting, running_since = future, None
+                if running_since is None and future.running():
+                    running_since = time.time()
+                give_up = self._give_up_time(head, running_since)
+                first_batches = [pdf.futures[0] for pdf in active if pdf.n_pages is None]
+                wait([future] + first_batches, return_when=FIRST_COMPLETED,
+                     timeout=1.0 if running_since is None else
+                     None if give_up is None else max(give_up - time.time(), 0))
+
+                for pdf in active:
+                    if pdf.n_pages is None and pdf.futures[0].done():
+                        self._read_page_count(pdf)
+                if future.done():
+                    yield from self._result(head)
+                elif give_up is not None and time.time() >= give_up:
+                    # The in-worker alarm failed to stop the parser, so stop waiting for it
+                    print(f"Timed out extracting text from {head.pdf_file} after {self.timeout}s")
+                    head.end()
+                fill()
+
+    def _give_up_time(self, pdf: _PendingPDF, running_since: Optional[float]) -> Optional[float]:
+        """When to stop waiting for a file's next batch, allowing a grace period beyond its deadline"""
+        if not self.timeout:
+            return None
+        if pdf.deadline is not None:
+            return pdf.deadline + 30
+        return running_since + self.timeout + 30 if running_since is not None else None
+
+    @staticmethod
+    def _read_page_count(pdf: _PendingPDF):
+        """Learn a file's page count and deadline from its finished first batch, so the rest can be queued"""
+        try:
+            n_pages, _, complete, deadline = pdf.futures[0].result()
+        except Exception:
+            n_pages, complete, deadline = 0, False, None
+        pdf.n_pages = n_pages if complete else 0
+        pdf.deadline = deadline
+
+    @staticmethod
+    def _result(pdf: _PendingPDF) -> Iterator[Tuple[str, List[str]]]:
+        """Yield the pages of a file's next finished batch, ending the file if the batch fell short"""
+        try:
+            _, texts, complete, _ = pdf.futures.popleft().result()
+        except Exception as e:
+            print(f"Error extracting text from {pdf.pdf_file}: {str(e)}")
+            texts, complete = [], False
+        if not complete:
+            pdf.end()
+        if texts:
+            yield pdf.pdf_file, texts
+
     def process_pdfs(self, pdf_files: List[str]) -> List[Dict]:
         """Process multiple PDF files and return documents"""
         documents = []
-        
-        for pdf_file in pdf_files:
-            text = self.extract_text_from_pdf(pdf_file)
+
+        for pdf_file, batches in groupby(self._run(pdf_files), key=itemgetter(0)):
+            text = "".join(f"{page}\n" for _, pages in batches for page in pages)
             if text.strip():
                 documents.append({
                     'content': text,
                     'source': os.path.basename(pdf_file),
                     'type': 'pdf'
                 })
-        
+
         return documents
+
+    def iter_pdf_chunks(self, pdf_files: List[str], text_splitter,
+                        is_unchanged: Optional[Callable[[str, str], bool]] = None) -> Iterator[Dict]:
+        """Extract and chunk PDF files in parallel, yielding chunks without building whole documents.
+
+        Files for which is_unchanged(source, file_hash) is true are skipped before extraction.
+        """
+        hashes = {}
+        for pdf_file in pdf_files:
+            try:
+                hashes[pdf_file] = self.file_hash(pdf_file)
+            except OSError as e:
+                print(f"Error reading {pdf_file}: {str(e)}")
+        
+        to_extract = []
+        for pdf_file, file_hash in hashes.items():
+            if is_unchanged is not None and is_unchanged(os.path.basename(pdf_file), file_hash):
+                print(f"Skipping unchanged PDF: {pdf_file}")
+            else:
+                to_extract.append(pdf_file)
+        
+        # Pages arrive a batch at a time and are chunked here, so no document is ever held whole
+        for pdf_file, batches in groupby(self._run(to_extract), key=itemgetter(0)):
+            pages = (page for _, texts in batches for page in texts)
+            for i, chunk in enumerate(chunk_page_stream(pages, text_splitter)):
+                yield {
+                    'content': chunk,
+                    'source': os.path.basename(pdf_file),
+                    'type': 'pdf',
+                    'chunk_id': i,
+                    'doc_hash': hashes[pdf_file]
+                }
@@ -0,0 +1,188 @@
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from utils.metrics import INGEST_ITEMS, INGEST_STAGE_SECONDS
+
+# Marks the end of a stage's output
+_DONE = object()
+
+STAGES = ('extract', 'chunk', 'embed', 'index')
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class IngestionPipeline:
+    """Streams documents through extract -> chunk -> embed -> index.
+
+    Each stage runs in its own thread and hands work to the next through a
+    bounded queue, so a slow stage holds back the ones before it and memory
+    stays flat however large the input is. Indexing runs on the calling
+    thread, which is also where progress callbacks are made.
+    """
+    def __init__(self, vector_store, chunker: Callable[[Iterable[Dict]], Iterator[Dict]],
+                 embed_batch_size: int = 512, index_batch_size: int = 5000, queue_size: int = 64,
+                 progress: Optional[Callable[[Dict[str, int]], None]] = None,
+                 progress_interval: float = 0.5):
+        self.vector_store = vector_store
+        self.chunker = chunker
+        self.embed_batch_size = embed_batch_size
+        self.index_batch_size = index_batch_size
+        self.queue_size = queue_size
+        self.progress = progress
+        self.progress_interval = progress_interval
+
+        self.counts = {stage: 0 for stage in STAGES}
+        self.sources = set()
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def _put(self, q: queue.Queue, item):
+        """Put with backpressure, giving up if the pipeline is being torn down"""
+        while True:
+            if self._stop.is_set():
+                raise _Cancelled()
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _drain(self, q: queue.Queue) -> Iterator:
+        """Yield items from a queue until the upstream stage finishes"""
+        while True:
+            if self._stop.is_set():
+                raise _Cancelled()
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def _stage(self, name: str, work: Callable[[], None], out: queue.Queue) -> threading.Thread:
+        """Run one stage in a thread, always signalling completion downstream"""
+        def run():
+            try:
+                work()
+            except _Cancelled:
+                pass
+            except BaseException as e:
+                self._error = self._error or e
+                self._stop.set()
+            finally:
+                try:
+                    self._put(out, _DONE)
+                except _Cancelled:
+                    pass
+
+        thread = threading.Thread(target=run, name=f"ingest-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    def _extract(self, documents: Iterable[Dict], out: queue.Queue):
+        extracted = INGEST_ITEMS.labels('extract')
+        for doc in documents:
+            self.counts['extract'] += 1
+            extracted.inc()
+            self._put(out, doc)
+
+    def _chunk(self, docs: queue.Queue, out: queue.Queue):
+        chunked = INGEST_ITEMS.labels('chunk')
+        for chunk in self.chunker(self._drain(docs)):
+            self.counts['chunk'] += 1
+            chunked.inc()
+            self.sources.add(chunk['source'])
+            self._put(out, chunk)
+
+    def _embed(self, chunks: queue.Queue, out: queue.Queue):
+        # An empty store builds its vocabulary from the first batch, so make that one large
+        batch_size = self.embed_batch_size if self.vector_store.has_vocabulary() else self.index_batch_size
+        batch: List[Dict] = []
+
+        for chunk in self._drain(chunks):
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                self._put(out, (batch, *self._embed_batch(batch)))
+                batch, batch_size = [], self.embed_batch_size
+
+        if batch:
+            self._put(out, (batch, *self._embed_batch(batch)))
+
+    def _embed_batch(self, batch: List[Dict]) -> Tuple[np.ndarray, Optional[str]]:
+        with INGEST_STAGE_SECONDS.labels('embed').time():
+            embeddings, vocab_name = self.vector_store.embed_with_vocabulary([doc['content'] for doc in batch])
+        self.counts['embed'] += len(batch)
+        INGEST_ITEMS.labels('embed').inc(len(batch))
+        return embeddings, vocab_name
+
+    def _report(self, force: bool = False):
+        if self.progress is None:
+            return
+        now = time.monotonic()
+        if force or now - self._last_report >= self.progress_interval:
+            self._last_report = now
+            self.progress(dict(self.counts, sources=len(self.sources)))
+
+    def _flush(self, documents: List[Dict], embeddings: List[np.ndarray], vocab_names: List[Optional[str]]):
+        # Batches embedded on either side of a vocabulary change go in as stale, to be re-embedded
+        vocab_name = vocab_names[0] if len(set(vocab_names)) == 1 else ''
+        with INGEST_STAGE_SECONDS.labels('index').time():
+            added = self.vector_store.add_documents(documents, np.vstack(embeddings), vocab_name)
+        self.counts['index'] += added
+        INGEST_ITEMS.labels('index').inc(added)
+
+    def run(self, documents: Iterable[Dict]) -> Dict[str, int]:
+        """Ingest documents and return the number of items that passed each stage (new chunks for 'index')"""
+        doc_queue = queue.Queue(self.queue_size)
+        chunk_queue = queue.Queue(self.queue_size * 4)
+        batch_queue = queue.Queue(max(2, self.queue_size // 16))
+        self._last_report = 0.0
+
+        threads = [
+            self._stage('extract', lambda: self._extract(documents, doc_queue), doc_queue),
+            self._stage('chunk', lambda: self._chunk(doc_queue, chunk_queue), chunk_queue),
+            self._stage('embed', lambda: self._embed(chunk_queue, batch_queue), batch_queue),
+        ]
+
+        pending, pending_embeddings, pending_vocabs = [], [], []
+        try:
+            while True:
+                try:
+                    item = batch_queue.get(timeout=self.progress_interval)
+                except queue.Empty:
+                    if self._stop.is_set():
+                        # An upstream stage failed
+                        break
+                    self._report()
+                    continue
+                if item is _DONE:
+                    break
+
+                batch, embeddings, vocab_name = item
+                pending.extend(batch)
+                pending_embeddings.append(embeddings)
+                pending_vocabs.append(vocab_name)
+                if len(pending) >= self.index_batch_size:
+                    self._flush(pending, pending_embeddings, pending_vocabs)
+                    pending, pending_embeddings, pending_vocabs = [], [], []
+                self._report()
+
+            if pending and self._error is None:
+                self._flush(pending, pending_embeddings, pending_vocabs)
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+        self._report(force=True)
+        return dict(self.counts, sources=len(self.sources))
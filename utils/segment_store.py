@@ -0,0 +1,275 @@
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+import config
+from utils.chunk_store import ChunkStore
+from utils.index_factory import configure_search
+from utils.term_stats import TermStats
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+MANIFEST_FORMAT = 1
+
+# Versioned files next to the manifest, each live while the manifest names it
+_TOP_LEVEL_FILES = ("vocab-*", "termstats-*", "tombstones-*")
+
+
+def _fsync_file(path: Path):
+    """Flush a written file to disk"""
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+def _fsync_dir(path: Path):
+    """Flush a directory entry after a rename (not supported on Windows)"""
+    if fcntl is None:
+        return
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _WriterLock:
+    """Re-entrant lock held by one writer across threads and processes"""
+    def __init__(self, lock_file: Path):
+        self.lock_file = lock_file
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._handle = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                self.lock_file.parent.mkdir(parents=True, exist_ok=True)
+                self._handle = open(self.lock_file, 'a+b')
+                if fcntl is not None:
+                    fcntl.flock(self._handle.fileno(), fcntl.LOCK_EX)
+                else:
+                    while True:
+                        try:
+                            msvcrt.locking(self._handle.fileno(), msvcrt.LK_NBLCK, 1)
+                            break
+                        except OSError:
+                            time.sleep(0.05)
+            except BaseException:
+                if self._handle is not None:
+                    self._handle.close()
+                    self._handle = None
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(self._handle.fileno(), msvcrt.LK_UNLCK, 1)
+            self._handle.close()
+            self._handle = None
+        self._lock.release()
+
+
+_writer_locks: Dict[str, _WriterLock] = {}
+_writer_locks_guard = threading.Lock()
+
+
+class SegmentStore:
+    """On-disk layout of the vector store: immutable segments listed by a manifest.
+
+    Every batch of documents is written to its own segment directory, and the
+    manifest is replaced atomically to commit it, so a crash mid-write leaves
+    the previous generation intact and ingest cost does not depend on how much
+    is already stored.
+    """
+    def __init__(self, db_dir: str):
+        self.db_dir = Path(db_dir)
+        self.segments_dir = self.db_dir / "segments"
+        self.manifest_file = self.db_dir / "manifest.json"
+
+    def writer_lock(self) -> _WriterLock:
+        """Lock serializing manifest updates for this store"""
+        key = str(self.db_dir.resolve())
+        with _writer_locks_guard:
+            if key not in _writer_locks:
+                _writer_locks[key] = _WriterLock(self.db_dir / ".writer.lock")
+            return _writer_locks[key]
+
+    def signature(self) -> Optional[Tuple]:
+        """Return an identifier that changes whenever the manifest is replaced"""
+        try:
+            stat = os.stat(self.manifest_file)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def new_manifest(self) -> Dict:
+        """Return an empty manifest"""
+        return {'format': MANIFEST_FORMAT, 'generation': 0, 'vocab': None, 'segments': []}
+
+    def read_manifest(self) -> Optional[Dict]:
+        """Read the manifest, or None if the store has never been written"""
+        try:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def write_manifest(self, manifest: Dict):
+        """Atomically replace the manifest"""
+        self.db_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.manifest_file.with_suffix('.json.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.manifest_file)
+        _fsync_dir(self.db_dir)
+
+    def write_segment(self, index, vectors: List[np.ndarray], write_chunks: Callable[[Path], None]) -> str:
+        """Write a new segment; write_chunks fills in its chunk store and keyword index.
+
+        The normalized vectors are kept next to the index so compaction can
+        rebuild it as a different index type. Returns the segment name; the
+        segment is live once listed in the manifest.
+        """
+        name = f"seg-{uuid.uuid4().hex[:16]}"
+        tmp_dir = self.segments_dir / f"{name}.tmp"
+        tmp_dir.mkdir(parents=True)
+
+        faiss.write_index(index, str(tmp_dir / "index.faiss"))
+        with open(tmp_dir / "vectors.npy", 'wb') as f:
+            n_vectors = sum(len(block) for block in vectors)
+            np.lib.format.write_array_header_1_0(f, {'descr': '<f4', 'fortran_order': False,
+                                                     'shape': (n_vectors, config.EMBEDDING_DIM)})
+            for block in vectors:
+                f.write(np.ascontiguousarray(block, dtype='<f4').tobytes())
+        write_chunks(tmp_dir)
+
+        for path in tmp_dir.iterdir():
+            _fsync_file(path)
+        os.rename(tmp_dir, self.segments_dir / name)
+        _fsync_dir(self.segments_dir)
+        return name
+
+    def read_segment(self, name: str) -> Tuple[object, ChunkStore]:
+        """Read a segment's index and map its chunk metadata"""
+        index = configure_search(faiss.read_index(str(self.segments_dir / name / "index.faiss")))
+        return index, self.open_chunks(name)
+
+    def open_vectors(self, name: str) -> np.ndarray:
+        """Map a segment's normalized float32 vectors"""
+        return np.load(self.segments_dir / name / "vectors.npy", mmap_mode='r')
+
+    def open_chunks(self, name: str) -> ChunkStore:
+        """Map a segment's chunk metadata"""
+        return ChunkStore(self.segments_dir / name)
+
+    def _write_file(self, name: str, write: Callable[[object], None]) -> str:
+        """Write a new top-level file durably under name and return the name"""
+        self.db_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.db_dir / f"{name}.tmp"
+        with open(tmp_file, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.db_dir / name)
+        return name
+
+    def write_vocab(self, vocab: Dict[str, int], idf: Optional[np.ndarray] = None) -> str:
+        """Write a vocabulary version, with optional IDF weights per id, and return its name"""
+        return self._write_file(f"vocab-{uuid.uuid4().hex[:16]}.pkl",
+                                lambda f: pickle.dump({'vocab': vocab, 'idf': idf}, f))
+
+    def read_vocab(self, name: Optional[str]) -> Tuple[Dict[str, int], Optional[np.ndarray]]:
+        """Read a vocabulary and its IDF weights (None if unweighted) written by write_vocab"""
+        if not name:
+            return {}, None
+        with open(self.db_dir / name, 'rb') as f:
+            data = pickle.load(f)
+        if 'vocab' not in data or not isinstance(data['vocab'], dict):
+            # Earlier versions stored the bare word -> id mapping
+            return data, None
+        return data['vocab'], data['idf']
+
+    def write_term_stats(self, stats: TermStats) -> str:
+        """Write corpus term statistics and return the file name"""
+        return self._write_file(f"termstats-{uuid.uuid4().hex[:16]}.npz", stats.save)
+
+    def read_term_stats(self, name: str) -> TermStats:
+        return TermStats.load(self.db_dir / name)
+
+    def write_tombstones(self, ids: np.ndarray) -> str:
+        """Write the sorted stable ids of deleted chunks and return the file name"""
+        return self._write_file(f"tombstones-{uuid.uuid4().hex[:16]}.npy",
+                                lambda f: np.save(f, np.asarray(ids, dtype=np.int64)))
+
+    def read_tombstones(self, name: Optional[str]) -> np.ndarray:
+        if not name:
+            return np.zeros(0, dtype=np.int64)
+        return np.load(self.db_dir / name)
+
+    def remove_files(self, names: List[Optional[str]]):
+        """Delete top-level vocabulary, statistics or tombstone files that were superseded"""
+        for name in names:
+            if name:
+                try:
+                    (self.db_dir / name).unlink()
+                except OSError:
+                    pass
+
+    def remove_segments(self, names: List[str]):
+        """Delete segment directories that are no longer listed in the manifest"""
+        for name in names:
+            shutil.rmtree(self.segments_dir / name, ignore_errors=True)
+
+    def remove_orphans(self, manifest: Dict, min_age: float = 3600.0):
+        """Delete leftovers of crashed or abandoned writes older than min_age seconds"""
+        live = {entry['name'] for entry in manifest['segments']}
+        live.update(filter(None, (manifest.get('vocab'), manifest.get('term_stats'), manifest.get('tombstones'))))
+        cutoff = time.time() - min_age
+
+        candidates = [path for pattern in _TOP_LEVEL_FILES for path in self.db_dir.glob(pattern)]
+        if self.segments_dir.exists():
+            candidates.extend(self.segments_dir.iterdir())
+
+        for path in candidates:
+            try:
+                if path.name in live or path.stat().st_mtime > cutoff:
+                    continue
+                if path.is_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    path.unlink()
+            except OSError:
+                pass
+
+    def clear(self, manifest: Dict) -> Dict:
+        """Commit an empty generation, then delete every segment and every vocabulary, statistics and tombstone file"""
+        empty = self.new_manifest()
+        empty['generation'] = manifest['generation'] + 1
+        self.write_manifest(empty)
+
+        shutil.rmtree(self.segments_dir, ignore_errors=True)
+        for path in [path for pattern in _TOP_LEVEL_FILES for path in self.db_dir.glob(pattern)]:
+            path.unlink()
+        return empty
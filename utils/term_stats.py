@@ -0,0 +1,119 @@
+import math
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+
+class TermStats:
+    """Corpus-wide document and collection frequencies of every embedding term.
+
+    Counts are updated in place as chunks are added or removed, so a new
+    vocabulary (and its IDF weights) can be cut from them at any time
+    without re-reading the corpus. Persisted as one .npz file: the terms as a
+    newline-joined UTF-8 blob plus parallel count arrays.
+    """
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.terms: List[str] = []
+        self.df = np.zeros(0, dtype=np.int64)
+        self.cf = np.zeros(0, dtype=np.int64)
+        self.n_docs = 0
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def _ids(self, terms: Iterable[str]) -> np.ndarray:
+        """Ids of terms, registering the ones not seen before"""
+        index = self.index
+        ids = []
+        for term in terms:
+            term_id = index.get(term)
+            if term_id is None:
+                term_id = index[term] = len(self.terms)
+                self.terms.append(term)
+            ids.append(term_id)
+
+        if len(self.terms) > len(self.df):
+            grow = len(self.terms) - len(self.df)
+            self.df = np.concatenate([self.df, np.zeros(grow, dtype=np.int64)])
+            self.cf = np.concatenate([self.cf, np.zeros(grow, dtype=np.int64)])
+        return np.array(ids, dtype=np.int64)
+
+    def update(self, documents: Iterable[List[str]], sign: int = 1):
+        """Add (sign=1) or remove (sign=-1) the counts of documents given as term lists"""
+        collection, document = Counter(), Counter()
+        n_docs = 0
+        for terms in documents:
+            collection.update(terms)
+            document.update(set(terms))
+            n_docs += 1
+
+        if collection:
+            ids = self._ids(collection)
+            np.add.at(self.cf, ids, sign * np.fromiter(collection.values(), dtype=np.int64, count=len(ids)))
+            ids = self._ids(document)
+            np.add.at(self.df, ids, sign * np.fromiter(document.values(), dtype=np.int64, count=len(ids)))
+        self.n_docs += sign * n_docs
+
+    def top_terms(self, size: int) -> List[str]:
+        """The size most frequent terms, most frequent first"""
+        size = min(size, int(np.count_nonzero(self.cf > 0)))
+        if not size:
+            return []
+        top = np.argpartition(-self.cf, size - 1)[:size]
+        # Ties go to the term seen first, as with Counter.most_common
+        top = top[np.lexsort((top, -self.cf[top]))]
+        return [self.terms[term_id] for term_id in top]
+
+    def drift(self, vocab: Dict[str, int], size: int) -> float:
+        """Share of the occurrences of the current top terms that fall on terms missing from vocab"""
+        top = self.top_terms(size)
+        if not top:
+            return 0.0
+        counts = self.cf[[self.index[term] for term in top]]
+        missing = np.fromiter((term not in vocab for term in top), dtype=bool, count=len(top))
+        return float(counts[missing].sum() / counts.sum())
+
+    def vocabulary(self, size: int, previous: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        """Vocabulary of the top terms, keeping each surviving term's id from previous.
+
+        Ids decide vector buckets, so keeping them means vectors embedded with
+        the previous vocabulary stay comparable for every term the two share.
+        """
+        top = self.top_terms(size)
+        previous = previous or {}
+        vocab = {term: previous[term] for term in top if previous.get(term, size) < size}
+        free = iter(sorted(set(range(size)) - set(vocab.values())))
+        for term in top:
+            if term not in vocab:
+                vocab[term] = next(free)
+        return vocab
+
+    def idf(self, vocab: Dict[str, int]) -> np.ndarray:
+        """Smoothed IDF weight of every vocabulary id"""
+        weights = np.ones(max(vocab.values(), default=-1) + 1, dtype=np.float32)
+        for term, term_id in vocab.items():
+            position = self.index.get(term)
+            df = int(self.df[position]) if position is not None else 0
+            weights[term_id] = math.log((1 + self.n_docs) / (1 + df)) + 1
+        return weights
+
+    def save(self, file):
+        """Write the counts to a path or binary file, dropping terms no document contains any more"""
+        live = np.flatnonzero(self.cf > 0)
+        blob = '\n'.join(self.terms[term_id] for term_id in live).encode('utf-8', errors='surrogatepass')
+        np.savez(file, terms=np.frombuffer(blob, dtype=np.uint8), df=self.df[live], cf=self.cf[live],
+                 n_docs=np.array(self.n_docs, dtype=np.int64))
+
+    @classmethod
+    def load(cls, path) -> 'TermStats':
+        stats = cls()
+        with np.load(path) as data:
+            blob = data['terms'].tobytes().decode('utf-8', errors='surrogatepass')
+            stats.terms = blob.split('\n') if blob else []
+            stats.df = data['df'].astype(np.int64)
+            stats.cf = data['cf'].astype(np.int64)
+            stats.n_docs = int(data['n_docs'])
+        stats.index = {term: term_id for term_id, term in enumerate(stats.terms)}
+        return stats
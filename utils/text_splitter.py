@@ -0,0 +1,157 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar('T')
+
+DEFAULT_SEPARATORS = ("\n\n", "\n", " ", "")
+
+
+def _split_worker(splitter: 'RecursiveTextSplitter', text: str) -> List[Tuple[int, int]]:
+    """Chunk offsets of one text, computed in a worker process"""
+    return list(splitter.split_offsets(text))
+
+
+class RecursiveTextSplitter:
+    """Recursive character splitter producing the same chunks as langchain's
+    RecursiveCharacterTextSplitter with its defaults (separators kept at the
+    start of the following piece, whitespace stripped, len as the length).
+
+    The text is never copied while splitting: pieces and merged chunks are
+    (start, end) offsets into the source string, and only the final chunks
+    are sliced out, lazily, as they are consumed.
+    """
+    def __init__(self, chunk_size: int = 4000, chunk_overlap: int = 200,
+                 separators: Optional[Sequence[str]] = None):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"Got a larger chunk overlap ({chunk_overlap}) than chunk size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = tuple(separators or DEFAULT_SEPARATORS)
+
+    def split_text(self, text: str) -> List[str]:
+        return list(self.iter_chunks(text))
+
+    def iter_chunks(self, text: str) -> Iterator[str]:
+        for start, end in self.split_offsets(text):
+            yield text[start:end]
+
+    def split_offsets(self, text: str, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, int]]:
+        """Yield the (start, end) offsets of the chunks of text[start:end]"""
+        return self._split(text, start, len(text) if end is None else end, 0)
+
+    def _split(self, text: str, start: int, end: int, level: int) -> Iterator[Tuple[int, int]]:
+        # Split on the first separator that occurs, recursing with the finer ones into oversized pieces
+        separators = self.separators
+        separator, next_level = separators[-1], len(separators)
+        for i in range(level, len(separators)):
+            if separators[i] == "":
+                separator = ""
+                break
+            if text.find(separators[i], start, end) >= 0:
+                separator, next_level = separators[i], i + 1
+                break
+
+        chunk_size, chunk_overlap = self.chunk_size, self.chunk_overlap
+        window = deque()
+        total = 0
+        for piece_start, piece_end in self._pieces(text, start, end, separator):
+            length = piece_end - piece_start
+            if length >= chunk_size:
+                if window:
+                    chunk = self._strip(text, window[0][0], window[-1][1])
+                    if chunk is not None:
+                        yield chunk
+                    window.clear()
+                    total = 0
+                if next_level == len(separators):
+                    # Nothing finer to split on; passed through as is, unstripped
+                    yield piece_start, piece_end
+                else:
+                    yield from self._split(text, piece_start, piece_end, next_level)
+                continue
+
+            # Merge small pieces into chunks, carrying up to chunk_overlap into the next one
+            if window and total + length > chunk_size:
+                chunk = self._strip(text, window[0][0], window[-1][1])
+                if chunk is not None:
+                    yield chunk
+                while total > chunk_overlap or (total + length > chunk_size and total > 0):
+                    first_start, first_end = window.popleft()
+                    total -= first_end - first_start
+            window.append((piece_start, piece_end))
+            total += length
+
+        if window:
+            chunk = self._strip(text, window[0][0], window[-1][1])
+            if chunk is not None:
+                yield chunk
+
+    @staticmethod
+    def _pieces(text: str, start: int, end: int, separator: str) -> Iterator[Tuple[int, int]]:
+        """Offsets of text[start:end] split before each occurrence of separator, or into characters"""
+        if not separator:
+            for position in range(start, end):
+                yield position, position + 1
+            return
+
+        step = len(separator)
+        piece_start = start
+        position = text.find(separator, start, end)
+        while position >= 0:
+            if position > piece_start:
+                yield piece_start, position
+            piece_start = position
+            position = text.find(separator, position + step, end)
+        if end > piece_start:
+            yield piece_start, end
+
+    @staticmethod
+    def _strip(text: str, start: int, end: int) -> Optional[Tuple[int, int]]:
+        """Offsets of text[start:end].strip(), or None if that is empty"""
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return (start, end) if end > start else None
+
+    def map_offsets(self, items: Iterable[T], text: Callable[[T], Optional[str]],
+                    workers: int = 1) -> Iterator[Tuple[T, Optional[Iterable[Tuple[int, int]]]]]:
+        """Yield (item, chunk offsets of text(item)) in input order, None where text(item) is None.
+
+        With more than one worker, long texts are split in worker processes,
+        with a couple per worker in flight; only their offsets come back.
+        Short texts are not worth the round trip and are split lazily here.
+        """
+        if workers <= 1:
+            for item in items:
+                item_text = text(item)
+                yield item, None if item_text is None else self.split_offsets(item_text)
+            return
+
+        executor = None
+        pending = deque()
+        try:
+            for item in items:
+                item_text = text(item)
+                if item_text is None:
+                    pending.append((item, None))
+                elif len(item_text) < 4 * self.chunk_size:
+                    pending.append((item, self.split_offsets(item_text)))
+                else:
+                    if executor is None:
+                        executor = ProcessPoolExecutor(max_workers=workers)
+                    pending.append((item, executor.submit(_split_worker, self, item_text)))
+
+                while pending and (len(pending) >= 2 * workers or not isinstance(pending[0][1], Future)):
+                    yield self._resolve(*pending.popleft())
+
+            while pending:
+                yield self._resolve(*pending.popleft())
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+    @staticmethod
+    def _resolve(item, offsets):
+        return item, offsets.result() if isinstance(offsets, Future) else offsets
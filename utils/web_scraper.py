@@ -1,12 +1,54 @@
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 import pandas as pd
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional, Callable
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import hashlib
+import random
+import threading
 import time
 
+# Responses worth retrying; anything else is returned or raised as is
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class _HostRateLimiter:
+    """Spaces out requests to the same host while leaving other hosts unaffected"""
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._next_slot = {}
+        self._lock = threading.Lock()
+    
+    def wait(self, host: str):
+        """Block until this host's next request slot"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+        
+        if slot > now:
+            time.sleep(slot - now)
+
+
 class WebScraper:
-    def __init__(self):
+    def __init__(self, max_workers: int = 16, host_interval: float = 1.0,
+                 max_retries: int = 3, backoff: float = 0.5, timeout: float = 10,
+                 max_retry_after: float = 30):
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        self.timeout = timeout
+        self.rate_limiter = _HostRateLimiter(host_interval)
+        
+        # One pooled session shared by all workers
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         })
@@ -40,48 +82,113 @@ class WebScraper:
         
         return list(set(urls))  # Remove duplicates
     
+    def _retry_delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        """Exponential backoff with jitter, honouring a numeric Retry-After header up to max_retry_after"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            # A longer wait would park a worker thread; back off as usual instead
+            if retry_after.isdigit() and float(retry_after) <= self.max_retry_after:
+                return float(retry_after)
+        return self.backoff * (2 ** attempt) * (1 + random.random())
+    
+    def fetch(self, url: str) -> requests.Response:
+        """GET a URL politely, retrying transient failures with backoff"""
+        host = urlsplit(url).netloc
+        attempt = 0
+        
+        while True:
+            self.rate_limiter.wait(host)
+            response = None
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    response.raise_for_status()
+                    return response
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+            
+            time.sleep(self._retry_delay(attempt, response))
+            attempt += 1
+    
+    def _html_to_text(self, content: bytes) -> str:
+        """Extract readable text from an HTML page"""
+        soup = BeautifulSoup(content, 'html.parser')
+        
+        # Remove script and style elements
+        for script in soup(["script", "style"]):
+            script.decompose()
+        
+        # Extract text content
+        text = soup.get_text()
+        
+        # Clean up text
+        lines = (line.strip() for line in text.splitlines())
+        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+        return ' '.join(chunk for chunk in chunks if chunk)
+    
     def scrape_website(self, url: str) -> str:
         """Scrape content from a single website"""
         try:
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Remove script and style elements
-            for script in soup(["script", "style"]):
-                script.decompose()
-            
-            # Extract text content
-            text = soup.get_text()
-            
-            # Clean up text
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            text = ' '.join(chunk for chunk in chunks if chunk)
-            
-            return text
+            response = self.fetch(url)
+            return self._html_to_text(response.content)
             
         except Exception as e:
             print(f"Error scraping {url}: {str(e)}")
             return ""
     
-    def process_urls(self, urls: List[str]) -> List[Dict]:
-        """Process multiple URLs and return documents"""
-        documents = []
-        
+    def _interleave_hosts(self, urls: List[str]) -> List[str]:
+        """Order URLs round-robin by host so workers are not all queued behind one host"""
+        by_host = OrderedDict()
         for url in urls:
-            print(f"Scraping: {url}")
-            content = self.scrape_website(url)
-            
-            if content.strip():
-                documents.append({
-                    'content': content,
-                    'source': url,
-                    'type': 'website'
-                })
+            by_host.setdefault(urlsplit(url).netloc, deque()).append(url)
+        
+        ordered = []
+        while by_host:
+            for host in list(by_host):
+                ordered.append(by_host[host].popleft())
+                if not by_host[host]:
+                    del by_host[host]
+        return ordered
+    
+    def iter_documents(self, urls: List[str],
+                       is_unchanged: Optional[Callable[[str, str], bool]] = None) -> Iterator[Dict]:
+        """Scrape URLs concurrently, yielding documents as they finish with bounded look-ahead.
+
+        Pages for which is_unchanged(url, content_hash) is true are skipped.
+        """
+        ordered = self._interleave_hosts(urls)
+        max_pending = 2 * self.max_workers
+        pending = deque()
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for url in ordered:
+                pending.append((url, executor.submit(self.scrape_website, url)))
+                if len(pending) >= max_pending:
+                    yield from self._document(*pending.popleft(), is_unchanged)
             
-            # Be respectful with requests
-            time.sleep(1)
+            while pending:
+                yield from self._document(*pending.popleft(), is_unchanged)
+    
+    def _document(self, url: str, future, is_unchanged) -> Iterator[Dict]:
+        """Wrap a finished scrape as a document, skipping empty and unchanged pages"""
+        content = future.result()
+        if not content.strip():
+            return
         
-        return documents
+        doc_hash = hashlib.sha256(content.encode('utf-8', errors='surrogatepass')).hexdigest()
+        if is_unchanged is not None and is_unchanged(url, doc_hash):
+            print(f"Skipping unchanged page: {url}")
+            return
+        
+        yield {
+            'content': content,
+            'source': url,
+            'type': 'website',
+            'doc_hash': doc_hash
+        }
+    
+    def process_urls(self, urls: List[str]) -> List[Dict]:
+        """Process multiple URLs concurrently and return documents in input order"""
+        scraped = {doc['source']: doc for doc in self.iter_documents(urls)}
+        return [scraped[url] for url in dict.fromkeys(urls) if url in scraped]
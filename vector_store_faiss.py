@@ -1,19 +1,56 @@
 import faiss
 import numpy as np
 import pickle
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import config
 import shutil
 import hashlib
 import re
 import math
-from collections import Counter
+import threading
+from collections import Counter, OrderedDict
+from utils.bm25_index import BM25Index, corpus_idf, term_hashes, tokenize
+from utils.chunk_store import ChunkStore, chunk_hashes
+from utils.index_factory import build_index, is_quantized, rerank, search_parameters, supports_selection
+from utils.metrics import INGEST_STAGE_SECONDS, span
+from utils.rwlock import RWLock
+from utils.segment_store import SegmentStore
+from utils.term_stats import TermStats
 
 class SimpleEmbedding:
+    # Marks document boundaries when a whole batch is tokenized as one string
+    _SEPARATOR = '\x00'
+    
     def __init__(self, dimensions: int = 384):
         self.dimensions = dimensions
         self.vocab = {}
-        self.vocab_size = 0
+    
+    @property
+    def vocab(self) -> Dict[str, int]:
+        return self._vocab
+    
+    @vocab.setter
+    def vocab(self, vocab: Dict[str, int]):
+        self.set_vocabulary(vocab)
+    
+    def set_vocabulary(self, vocab: Dict[str, int], idf: Optional[np.ndarray] = None):
+        """Use a vocabulary, optionally weighting each term by an IDF array indexed by vocabulary id"""
+        self._vocab = vocab
+        self.vocab_size = len(vocab)
+        self.idf = idf
+        # Token -> vocabulary id, with separators marked so a batch can be split by row
+        self._id_lookup = dict(vocab)
+        self._id_lookup[self._SEPARATOR] = -2
+    
+    def document_terms(self, texts: List[str]) -> List[List[str]]:
+        """The words of each text that count towards its embedding and the corpus term statistics"""
+        documents = [[]]
+        for token in self._tokenize_batch(texts):
+            if token == self._SEPARATOR:
+                documents.append([])
+            elif len(token) > 2:
+                documents[-1].append(token)
+        return documents if texts else []
     
     def _preprocess_text(self, text: str) -> List[str]:
         """Simple text preprocessing"""
@@ -22,18 +59,20 @@ class SimpleEmbedding:
         words = [word for word in words if len(word) > 2]
         return words
     
+    def _tokenize_batch(self, texts: List[str]) -> List[str]:
+        """Preprocess a batch in one pass, returning tokens with separators between texts"""
+        separator = f' {self._SEPARATOR} '
+        joined = separator.join(text.replace(self._SEPARATOR, '') for text in texts)
+        joined = re.sub(r'[^a-zA-Z0-9\s\x00]', '', joined.lower())
+        return joined.split()
+    
     def _build_vocabulary(self, texts: List[str]):
         """Build vocabulary from texts"""
-        all_words = []
-        for text in texts:
-            words = self._preprocess_text(text)
-            all_words.extend(words)
-        
-        word_counts = Counter(all_words)
-        most_common = word_counts.most_common(min(5000, len(word_counts)))
+        word_counts = Counter(word for word in self._tokenize_batch(texts)
+                              if len(word) > 2 and word != self._SEPARATOR)
+        most_common = word_counts.most_common(min(config.VOCAB_SIZE, len(word_counts)))
         
         self.vocab = {word: idx for idx, (word, _) in enumerate(most_common)}
-        self.vocab_size = len(self.vocab)
     
     def _text_to_vector(self, text: str) -> np.ndarray:
         """Convert text to vector"""
@@ -48,7 +87,7 @@ class SimpleEmbedding:
                 tf = count / total_words if total_words > 0 else 0
                 vocab_idx = self.vocab[word]
                 vector_idx = vocab_idx % self.dimensions
-                vector[vector_idx] += tf
+                vector[vector_idx] += tf if self.idf is None else tf * self.idf[vocab_idx]
         
         # Normalize vector
         magnitude = np.linalg.norm(vector)
@@ -57,144 +96,1150 @@ class SimpleEmbedding:
         
         return vector
     
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Convert a batch of texts to embeddings with one sparse term-frequency pass"""
+        n_texts = len(texts)
+        tokens = self._tokenize_batch(texts)
+        n_tokens = len(tokens)
+        
+        lookup = self._id_lookup.get
+        ids = np.fromiter((lookup(token, -1) for token in tokens), dtype=np.int64, count=n_tokens)
+        lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=n_tokens)
+        
+        # Row of every token; separators bump the row for the tokens that follow
+        is_separator = ids == -2
+        rows = np.cumsum(is_separator)
+        
+        # Every preprocessed word counts towards the total, in vocabulary or not
+        total_words = np.bincount(rows[(lengths > 2) & ~is_separator], minlength=n_texts)
+        
+        # Sparse (row, bucket, tf) triples, summed into a dense matrix in one go
+        in_vocab = ids >= 0
+        hit_rows = rows[in_vocab]
+        hit_ids = ids[in_vocab]
+        weights = 1.0 / total_words[hit_rows]
+        if self.idf is not None:
+            weights *= self.idf[hit_ids]
+        vectors = np.bincount(hit_rows * self.dimensions + hit_ids % self.dimensions, weights=weights,
+                              minlength=n_texts * self.dimensions)
+        vectors = vectors.reshape(n_texts, self.dimensions).astype(np.float32)
+        
+        # Normalize vectors
+        magnitudes = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, magnitudes, out=vectors, where=magnitudes > 0)
+        
+        return vectors
+    
     def encode(self, texts: List[str]) -> np.ndarray:
         """Convert texts to embeddings"""
         if not self.vocab:
             self._build_vocabulary(texts)
         
-        embeddings = []
-        for text in texts:
-            embedding = self._text_to_vector(text)
-            embeddings.append(embedding)
+        # Bound the dense intermediate for very large inputs
+        batch_size = config.EMBEDDING_BATCH_SIZE
+        if len(texts) <= batch_size:
+            return self._encode_batch(texts)
+        
+        return np.vstack([self._encode_batch(texts[start:start + batch_size])
+                          for start in range(0, len(texts), batch_size)])
+
+class _Segment:
+    """One immutable segment of the index held in memory"""
+    def __init__(self, name: str, index, chunks: ChunkStore, vectors: np.ndarray):
+        self.name = name
+        self.index = index
+        self.chunks = chunks
+        self.vectors = vectors
+        self._selections = OrderedDict()
+    
+    @property
+    def count(self) -> int:
+        return self.index.ntotal
+    
+    @property
+    def sorted_hashes(self) -> np.ndarray:
+        """Chunk content hashes, sorted once for membership tests"""
+        if not hasattr(self, '_sorted_hashes'):
+            self._sorted_hashes = np.sort(self.chunks.hashes)
+        return self._sorted_hashes
+    
+    @property
+    def bm25(self) -> BM25Index:
+        """Keyword index of the segment; built in memory for segments written before it existed"""
+        if not hasattr(self, '_bm25'):
+            self._bm25 = (BM25Index.open(self.chunks.directory)
+                          or BM25Index.from_texts(self.chunks.content(row) for row in range(len(self.chunks))))
+        return self._bm25
+    
+    @property
+    def id_range(self) -> Tuple[int, int]:
+        """Smallest and largest stable chunk id in the segment"""
+        if not hasattr(self, '_id_range'):
+            ids = np.asarray(self.chunks.ids)
+            self._id_range = (int(ids.min()), int(ids.max())) if len(ids) else (0, -1)
+        return self._id_range
+    
+    def selection(self, filter: Optional[Dict], tombstones: '_Tombstones'):
+        """Live rows matching a metadata filter.
+        
+        Returns None when every row matches, False when none can, and otherwise
+        a _RowSelection. Selections are cached per filter and tombstone version,
+        since the same source or type tends to be asked about repeatedly.
+        """
+        deleted = tombstones.rows(self)
+        if not filter and not len(deleted):
+            return None
+        
+        key = tuple((column, frozenset([filter[column]] if isinstance(filter[column], str) else filter[column]))
+                    for column in ('source', 'type') if filter and column in filter)
+        key = (tombstones.name if len(deleted) else None,) + key
+        selection = self._selections.get(key)
+        if selection is None:
+            rows = None
+            for column, values in key[1:]:
+                matching = self.chunks.rows_with(column, values)
+                rows = matching if rows is None else np.intersect1d(rows, matching, assume_unique=True)
+            if len(deleted):
+                rows = np.setdiff1d(np.arange(self.count) if rows is None else rows, deleted, assume_unique=True)
+            if rows is None or len(rows) == self.count:
+                selection = None
+            elif not len(rows):
+                selection = False
+            else:
+                selection = _RowSelection(rows, self.count, filtered=len(key) > 1)
+            self._selections[key] = selection
+            while len(self._selections) > _SELECTION_CACHE_SIZE:
+                self._selections.popitem(last=False)
+        return selection
+
+
+# Filter selections kept per segment
+_SELECTION_CACHE_SIZE = 64
+
+
+class _RowSelection:
+    """Sorted rows of a segment matching a filter, with a FAISS selector over them.
+    
+    filtered is False for a selection that only hides deleted rows.
+    """
+    def __init__(self, rows: np.ndarray, n_rows: int, filtered: bool = True):
+        self.rows = rows
+        self.filtered = filtered
+        mask = np.zeros(n_rows, dtype=bool)
+        mask[rows] = True
+        # FAISS reads the bitmap in place, so it lives as long as the selector
+        self.bitmap = np.packbits(mask, bitorder='little')
+        self.selector = faiss.IDSelectorBitmap(self.bitmap)
+    
+    def __len__(self) -> int:
+        return len(self.rows)
+    
+    def contains(self, rows: np.ndarray) -> np.ndarray:
+        """Boolean mask of which rows (-1 for none) are selected"""
+        safe = np.maximum(rows, 0)
+        return (rows >= 0) & ((self.bitmap[safe >> 3] >> (safe & 7)) & 1).astype(bool)
+    
+    def exact_search(self, vectors: np.ndarray, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (scores, rows) by brute force over the selected rows' stored vectors"""
+        scores = queries @ np.asarray(vectors[self.rows]).T
+        k = min(k, len(self.rows))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+        return np.take_along_axis(scores, top, axis=1), self.rows[top]
+
+
+class _Tombstones:
+    """Stable ids of deleted chunks (sorted), and the rows they hide in each segment"""
+    def __init__(self, name: Optional[str], ids: np.ndarray):
+        self.name = name
+        self.ids = ids
+        self._rows: Dict[str, np.ndarray] = {}
+        self._hashes: Dict[str, np.ndarray] = {}
+    
+    def rows(self, segment: _Segment) -> np.ndarray:
+        """Sorted deleted rows of a segment"""
+        rows = self._rows.get(segment.name)
+        if rows is None:
+            low, high = segment.id_range
+            candidates = self.ids[np.searchsorted(self.ids, low):np.searchsorted(self.ids, high, side='right')]
+            if len(candidates):
+                rows = np.flatnonzero(np.isin(segment.chunks.ids, candidates))
+            else:
+                rows = np.zeros(0, dtype=np.int64)
+            self._rows[segment.name] = rows
+        return rows
+    
+    def extended(self, name: str, deleted: Dict[str, np.ndarray], segments: List[_Segment]) -> '_Tombstones':
+        """These tombstones plus the given rows of segments, known to be stored as name"""
+        ids = [self.ids] + [np.asarray(segment.chunks.ids[deleted[segment.name]])
+                            for segment in segments if segment.name in deleted]
+        tombstones = _Tombstones(name, np.unique(np.concatenate(ids)))
+        # Carry the rows over so the cost of a delete does not grow with the segments it touches
+        for segment in segments:
+            rows = self.rows(segment)
+            if segment.name in deleted:
+                rows = np.union1d(rows, deleted[segment.name])
+            tombstones._rows[segment.name] = rows
+        return tombstones
+    
+    def sorted_hashes(self, segment: _Segment) -> np.ndarray:
+        """Sorted content hashes of a segment's live chunks"""
+        deleted = self.rows(segment)
+        if not len(deleted):
+            return segment.sorted_hashes
+        hashes = self._hashes.get(segment.name)
+        if hashes is None:
+            hashes = self._hashes[segment.name] = np.sort(np.delete(np.asarray(segment.chunks.hashes), deleted))
+        return hashes
+    
+    def live_count(self, segment: _Segment) -> int:
+        return segment.count - len(self.rows(segment))
+    
+    def live_mask(self, segment: _Segment) -> Optional[np.ndarray]:
+        """Boolean mask of a segment's live rows, or None if none are deleted"""
+        deleted = self.rows(segment)
+        if not len(deleted):
+            return None
+        mask = np.ones(segment.count, dtype=bool)
+        mask[deleted] = False
+        return mask
+
+
+class SearchResults:
+    """Top-k hits for a batch of queries, decoded into dicts only when accessed.
+    
+    similarities, segment_ids and rows are (n_queries, k) arrays; slots past the
+    number of hits a query got have row -1 and similarity -inf.
+    """
+    def __init__(self, similarities: np.ndarray, segment_ids: np.ndarray, rows: np.ndarray,
+                 segments: List[_Segment]):
+        self.similarities = similarities
+        self.segment_ids = segment_ids
+        self.rows = rows
+        self.segments = segments
+    
+    @classmethod
+    def empty(cls, n_queries: int) -> 'SearchResults':
+        return cls(np.full((n_queries, 0), -np.inf, dtype=np.float32), np.zeros((n_queries, 0), dtype=np.int32),
+                   np.full((n_queries, 0), -1, dtype=np.int64), [])
+    
+    def __len__(self) -> int:
+        return len(self.rows)
+    
+    def __getitem__(self, query: int) -> List[Dict]:
+        """Hits for one query in the same format as FAISSVectorStore.search"""
+        documents = []
+        for score, segment_id, row in zip(self.similarities[query], self.segment_ids[query], self.rows[query]):
+            if row < 0:
+                break
+            chunks = self.segments[segment_id].chunks
+            score = float(score)
+            documents.append({
+                'content': chunks.content(row),
+                'metadata': {
+                    'source': chunks.source(row),
+                    'type': chunks.type(row),
+                    'chunk_id': int(chunks.chunk_ids[row])
+                },
+                'distance': 1.0 - score,  # Convert similarity to distance
+                'similarity': score
+            })
+        return documents
+    
+    def __iter__(self):
+        for query in range(len(self)):
+            yield self[query]
+    
+    def vectors(self, query: int) -> np.ndarray:
+        """Stored vectors of one query's hits, in the order of self[query]"""
+        hits = [(segment_id, row) for segment_id, row in zip(self.segment_ids[query], self.rows[query]) if row >= 0]
+        if not hits:
+            return np.zeros((0, config.EMBEDDING_DIM), dtype=np.float32)
+        return np.stack([self.segments[segment_id].vectors[row] for segment_id, row in hits])
+    
+    def hit_counts(self) -> np.ndarray:
+        """Number of hits returned for each query"""
+        return (self.rows >= 0).sum(axis=1)
+
+
+class _ResidentIndex:
+    """Segments and vocabulary loaded once and shared by every store in the process"""
+    def __init__(self, segments: List[_Segment], vocab: Dict, idf: Optional[np.ndarray],
+                 vocab_name: Optional[str], tombstones: _Tombstones, generation: int, signature: Optional[Tuple]):
+        self.segments = segments
+        self.vocab = vocab
+        self.idf = idf
+        self.vocab_name = vocab_name
+        self.tombstones = tombstones
+        self.generation = generation
+        self.signature = signature
+        self.count = sum(tombstones.live_count(segment) for segment in segments)
         
-        return np.array(embeddings)
+        # Content hash of the ingested version of every source that still has live chunks
+        self.source_hashes = {}
+        for segment in segments:
+            chunks = segment.chunks
+            live = chunks.group_sizes('source')
+            deleted = tombstones.rows(segment)
+            if len(deleted):
+                live = live - np.bincount(chunks.source_codes[deleted], minlength=len(live))
+            for source, doc_hash, n_live in zip(chunks.source_table, chunks.source_hashes, live):
+                if doc_hash and n_live:
+                    self.source_hashes[source] = doc_hash
+
+
+# The resident snapshot is never mutated in place; writers build a new one and
+# swap the reference, so readers always see a consistent set of segments.
+_resident: Optional[_ResidentIndex] = None
+_resident_lock = threading.Lock()
+_maintenance_thread: Optional[threading.Thread] = None
+# Set when maintenance is asked for while the thread runs (under _resident_lock)
+_maintenance_rerun = False
+
 
 class FAISSVectorStore:
+    """Segmented FAISS store; one instance can be shared by any number of threads.
+    
+    Searches hold the read side of self.lock and run in parallel. Swapping in
+    a new generation or rebuilding the vocabulary takes the write side, which
+    only waits for in-flight searches, since new segments are built before the
+    swap. Lock order is the store's writer lock, then self.lock, then the
+    resident index lock.
+    """
     def __init__(self):
         self.embedding_model = SimpleEmbedding(config.EMBEDDING_DIM)
-        self.index = None
-        self.metadata = []
+        self.store = SegmentStore(config.FAISS_DB_DIR)
+        self.lock = RWLock()
+        self.segments = []
         self.is_trained = False
+        self.generation = 0
+        self._vocab_name = None
+        self._source_hashes = {}
+        self.tombstones = _Tombstones(None, np.zeros(0, dtype=np.int64))
+        self._bound: Optional[_ResidentIndex] = None
+        # Term statistics of the last generation this store wrote, saving a reload on the next write
+        self._term_stats_cache: Optional[Tuple[str, TermStats]] = None
         
-    def _initialize_index(self):
-        """Initialize FAISS index"""
-        # Use IndexFlatIP for cosine similarity
-        self.index = faiss.IndexFlatIP(config.EMBEDDING_DIM)
-        
-    def _save_index(self):
-        """Save FAISS index and metadata to disk"""
-        if self.index is not None:
-            faiss.write_index(self.index, str(config.FAISS_INDEX_FILE))
-        
-        with open(config.METADATA_FILE, 'wb') as f:
-            pickle.dump({
-                'metadata': self.metadata,
-                'vocab': self.embedding_model.vocab,
-                'is_trained': self.is_trained
-            }, f)
+    def _initialize_index(self, vectors: List[np.ndarray]):
+        """Build a FAISS index of the configured type over normalized vectors"""
+        # Inner product on normalized vectors gives cosine similarity
+        return build_index(vectors)
     
-    def _load_index(self) -> bool:
-        """Load FAISS index and metadata from disk"""
+    def _assemble(self, manifest: Dict, known: Dict[str, _Segment]) -> List[_Segment]:
+        """Return the manifest's segments, reading only those not already in memory"""
+        segments = []
+        for entry in manifest['segments']:
+            segment = known.get(entry['name'])
+            if segment is None:
+                index, chunks = self.store.read_segment(entry['name'])
+                segment = _Segment(entry['name'], index, chunks, self.store.open_vectors(entry['name']))
+            segments.append(segment)
+        return segments
+    
+    def _read_index(self, signature: Tuple, previous: Optional[_ResidentIndex]) -> Optional[_ResidentIndex]:
+        """Read the manifest and any segments that changed since the previous snapshot"""
         try:
-            if config.FAISS_INDEX_FILE.exists() and config.METADATA_FILE.exists():
-                self.index = faiss.read_index(str(config.FAISS_INDEX_FILE))
-                
-                with open(config.METADATA_FILE, 'rb') as f:
-                    data = pickle.load(f)
-                    self.metadata = data['metadata']
-                    self.embedding_model.vocab = data['vocab']
-                    self.is_trained = data['is_trained']
-                
-                return True
+            manifest = self.store.read_manifest()
+            if manifest is None:
+                return None
+            
+            known = {segment.name: segment for segment in previous.segments} if previous else {}
+            segments = self._assemble(manifest, known)
+            
+            if previous is not None and previous.vocab_name == manifest['vocab']:
+                vocab, idf = previous.vocab, previous.idf
+            else:
+                vocab, idf = self.store.read_vocab(manifest['vocab'])
+            tombstones = self._read_tombstones(manifest, previous)
+            
+            return _ResidentIndex(segments, vocab, idf, manifest['vocab'], tombstones,
+                                  manifest['generation'], signature)
         except Exception as e:
+            # Typically a segment compacted away under us; the next call retries
             print(f"Error loading index: {e}")
         
-        return False
+        return None
     
-    def add_documents(self, documents: List[Dict]):
-        """Add documents to FAISS vector store"""
-        if not self._load_index():
-            self._initialize_index()
+    def _read_tombstones(self, manifest: Dict, previous: Optional[_ResidentIndex]) -> _Tombstones:
+        """The manifest's tombstones, reusing the previous snapshot's if they did not change"""
+        name = manifest.get('tombstones')
+        if previous is not None and previous.tombstones.name == name:
+            return previous.tombstones
+        return _Tombstones(name, self.store.read_tombstones(name))
+    
+    def _publish(self, manifest: Dict, new_segments: Dict[str, _Segment],
+                 vocabulary: Optional[Tuple[Dict, Optional[np.ndarray]]] = None,
+                 tombstones: Optional[_Tombstones] = None):
+        """Swap in the generation just committed to the manifest, with a new vocabulary or tombstones if written"""
+        global _resident
+        vocab, idf = vocabulary or (self.embedding_model.vocab, self.embedding_model.idf)
+        with _resident_lock:
+            known = {segment.name: segment for segment in _resident.segments} if _resident else {}
+            known.update(new_segments)
+            if tombstones is None:
+                tombstones = self._read_tombstones(manifest, _resident)
+            _resident = _ResidentIndex(self._assemble(manifest, known), vocab, idf, manifest['vocab'],
+                                       tombstones, manifest['generation'], self.store.signature())
+        self._rebind()
+    
+    def _rebind(self):
+        """Switch this store to the current resident snapshot once in-flight searches finish"""
+        with self.lock.write():
+            resident = _resident
+            if resident is not None and resident is not self._bound:
+                self._bind(resident)
+    
+    def _bind(self, resident: _ResidentIndex):
+        """Point this store at a resident snapshot (call with the write lock held)"""
+        self._bound = resident
+        self.segments = resident.segments
+        # Keep a vocabulary built locally for embeddings that are not committed yet,
+        # unless the store has one or the one it came from was deleted
+        if resident.vocab_name is not None or self._vocab_name is not None:
+            if self.embedding_model.vocab is not resident.vocab or self.embedding_model.idf is not resident.idf:
+                self.embedding_model.set_vocabulary(resident.vocab, resident.idf)
+        self._vocab_name = resident.vocab_name
+        self.tombstones = resident.tombstones
+        self._source_hashes = resident.source_hashes
+        self.is_trained = resident.count > 0
+        self.generation = resident.generation
+    
+    def _migrate_legacy(self) -> bool:
+        """Convert a single-file index from earlier versions into the first segment"""
+        if not (config.FAISS_INDEX_FILE.exists() and config.METADATA_FILE.exists()):
+            return False
+        
+        with self.store.writer_lock():
+            if self.store.read_manifest() is not None:
+                return True
+            
+            index = faiss.read_index(str(config.FAISS_INDEX_FILE))
+            with open(config.METADATA_FILE, 'rb') as f:
+                data = pickle.load(f)
+            
+            manifest = self.store.new_manifest()
+            manifest['generation'] = data.get('generation', 0) + 1
+            manifest['vocab'] = self.store.write_vocab(data['vocab'])
+            manifest['vocab_docs'] = len(data['metadata'])
+            vectors = index.reconstruct_n(0, index.ntotal)
+            ids = np.arange(len(data['metadata']), dtype=np.int64)
+            segment = self._write_segment([vectors], _chunk_writer(data['metadata'], ids))
+            manifest['segments'].append({'name': segment.name, 'count': segment.count})
+            manifest['next_id'] = len(ids)
+            self.store.write_manifest(manifest)
+        
+        return True
+    
+    def _load_index(self) -> bool:
+        """Bind to the resident index, reloading from disk only when the manifest changed"""
+        global _resident
+        signature = self.store.signature()
+        if signature is None:
+            try:
+                if not self._migrate_legacy():
+                    return False
+            except Exception as e:
+                print(f"Error migrating index: {e}")
+                return False
+            signature = self.store.signature()
         
-        # Prepare texts and metadata
-        texts = [doc['content'] for doc in documents]
+        resident = _resident
+        if resident is None or resident.signature != signature:
+            with _resident_lock:
+                resident = _resident
+                if resident is None or resident.signature != signature:
+                    with span('index_reload'):
+                        loaded = self._read_index(signature, resident)
+                    if loaded is not None:
+                        _resident = resident = loaded
         
-        # Generate embeddings
-        embeddings = self.embedding_model.encode(texts)
+        if resident is None:
+            return False
+        
+        if resident is not self._bound:
+            self._rebind()
+        return True
+    
+    def has_vocabulary(self) -> bool:
+        """Whether embeddings can be computed without first building a vocabulary"""
+        self._load_index()
+        return bool(self.embedding_model.vocab)
+    
+    def indexed_terms(self, terms: List[str]) -> List[str]:
+        """The keyword terms (as from tokenize) that occur in at least one stored chunk"""
+        if not terms or not self._load_index():
+            return []
+        hashes = term_hashes(terms)
+        with self.lock.read():
+            df = sum((segment.bm25.document_frequencies(hashes) for segment in self.segments),
+                     np.zeros(len(hashes), dtype=np.int64))
+        return [term for term, count in zip(terms, df) if count]
+    
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts with the store's vocabulary, building one from them if the store has none"""
+        return self.embed_with_vocabulary(texts)[0]
+    
+    def embed_with_vocabulary(self, texts: List[str]) -> Tuple[np.ndarray, Optional[str]]:
+        """Embed texts like embed(), also returning the name of the vocabulary used (None if not committed yet)"""
+        self._load_index()
+        
+        # Generate embeddings; building a vocabulary changes the model, so it excludes searches
+        with self.lock.read():
+            vocab_name = self._vocab_name
+            embeddings = self.embedding_model.encode(texts) if self.embedding_model.vocab else None
+        if embeddings is None:
+            with self.lock.write():
+                vocab_name = self._vocab_name
+                embeddings = self.embedding_model.encode(texts)
         
         # Normalize embeddings for cosine similarity
         faiss.normalize_L2(embeddings)
+        return embeddings, vocab_name
+    
+    def _write_segment(self, blocks: List[np.ndarray], write_chunks) -> _Segment:
+        """Build an index over the vectors and write it as a new, not yet committed, segment"""
+        index = self._initialize_index(blocks)
+        name = self.store.write_segment(index, blocks, write_chunks)
+        return _Segment(name, index, self.store.open_chunks(name), self.store.open_vectors(name))
+    
+    def is_unchanged(self, source: str, doc_hash: str) -> bool:
+        """Whether source is already stored with this content hash and can be skipped"""
+        self._load_index()
+        with self.lock.read():
+            return self._source_hashes.get(source) == doc_hash
+    
+    def _tombstone_sources(self, sources: set) -> Tuple[Dict[str, np.ndarray], List[str], np.ndarray]:
+        """Find the live chunks of sources, reading only their rows.
+
+        Returns their rows per segment name, their text and their content hashes.
+        """
+        deleted, texts, hashes = {}, [], []
+        for segment in self.segments:
+            rows = segment.chunks.rows_with('source', sources)
+            if len(rows):
+                rows = np.setdiff1d(rows, self.tombstones.rows(segment), assume_unique=True)
+            if not len(rows):
+                continue
+            deleted[segment.name] = rows
+            texts.extend(segment.chunks.content(row) for row in rows)
+            hashes.append(np.asarray(segment.chunks.hashes[rows]))
+        return deleted, texts, np.concatenate(hashes) if hashes else np.zeros(0, dtype=np.uint64)
+    
+    def _stored_mask(self, hashes: np.ndarray) -> np.ndarray:
+        """Which chunk hashes are already present among the live chunks"""
+        found = np.zeros(len(hashes), dtype=bool)
+        for segment in self.segments:
+            stored = self.tombstones.sorted_hashes(segment)
+            if len(stored):
+                positions = np.minimum(np.searchsorted(stored, hashes), len(stored) - 1)
+                found |= stored[positions] == hashes
+        return found
+    
+    def _term_stats(self, manifest: Dict) -> TermStats:
+        """Term statistics of the committed corpus, counted from the stored chunk text if it predates them"""
+        name = manifest.get('term_stats')
+        cached, self._term_stats_cache = self._term_stats_cache, None
+        if name and cached is not None and cached[0] == name:
+            return cached[1]
+        if name:
+            return self.store.read_term_stats(name)
         
-        # Add to index
-        self.index.add(embeddings)
+        stats = TermStats()
+        for segment in self.segments:
+            for start in range(0, segment.count, config.EMBEDDING_BATCH_SIZE):
+                rows = range(start, min(start + config.EMBEDDING_BATCH_SIZE, segment.count))
+                stats.update(self.embedding_model.document_terms([segment.chunks.content(row) for row in rows]))
+        return stats
+    
+    def _needs_new_vocabulary(self, manifest: Dict, stats: TermStats) -> bool:
+        """Whether the corpus has drifted from the vocabulary, or its IDF weights are due a refresh"""
+        model = self.embedding_model
+        if config.EMBEDDING_IDF != (model.idf is not None):
+            return True
+        if config.EMBEDDING_IDF and stats.n_docs >= config.VOCAB_REBUILD_GROWTH * max(manifest.get('vocab_docs', 0), 1):
+            return True
+        return stats.drift(model.vocab, config.VOCAB_SIZE) > config.VOCAB_REBUILD_DRIFT
+    
+    def _write_vocabulary(self, manifest: Dict, stats: TermStats) -> Optional[Tuple[Dict, Optional[np.ndarray]]]:
+        """Write a vocabulary cut from the term statistics into the manifest, returning it unless nothing changed.
+
+        Segments embedded with the previous vocabulary are re-embedded in the
+        background; until then, terms the two vocabularies share keep their
+        buckets, so those segments stay searchable.
+        """
+        model = self.embedding_model
+        vocab = stats.vocabulary(config.VOCAB_SIZE, model.vocab)
+        idf = stats.idf(vocab) if config.EMBEDDING_IDF else None
+        if idf is None and model.idf is None and vocab == model.vocab:
+            return None
         
-        # Store metadata
-        for i, doc in enumerate(documents):
-            self.metadata.append({
-                'content': doc['content'],
-                'source': doc['source'],
-                'type': doc['type'],
-                'chunk_id': doc.get('chunk_id', 0)
-            })
+        for entry in manifest['segments']:
+            entry.setdefault('vocab', manifest['vocab'])
+        manifest['vocab'] = self.store.write_vocab(vocab, idf)
+        manifest['vocab_docs'] = stats.n_docs
+        return vocab, idf
+    
+    def _delete_rows(self, manifest: Dict, deleted: Dict[str, np.ndarray]) -> _Tombstones:
+        """Write tombstones for rows of live segments into the manifest and return them"""
+        ids = [np.asarray(segment.chunks.ids[deleted[segment.name]])
+               for segment in self.segments if segment.name in deleted]
+        name = self.store.write_tombstones(np.unique(np.concatenate([self.tombstones.ids] + ids)))
+        manifest['tombstones'] = name
+        return self.tombstones.extended(name, deleted, self.segments)
+    
+    def _commit(self, manifest: Dict, stats: TermStats, new_segments: Dict[str, _Segment],
+                vocabulary: Optional[Tuple[Dict, Optional[np.ndarray]]] = None,
+                tombstones: Optional[_Tombstones] = None):
+        """Commit a new generation with updated term statistics and publish it (writer lock held)"""
+        previous_stats = manifest.get('term_stats')
+        manifest['term_stats'] = self.store.write_term_stats(stats)
+        manifest['generation'] += 1
+        with INGEST_STAGE_SECONDS.labels('commit').time():
+            self.store.write_manifest(manifest)
+            self._publish(manifest, new_segments, vocabulary, tombstones)
+        self._term_stats_cache = (manifest['term_stats'], stats)
+        # Only writers read term statistics, so the old file can go at once
+        self.store.remove_files([previous_stats])
+    
+    def add_documents(self, documents: List[Dict], embeddings: Optional[np.ndarray] = None,
+                      vocab_name: Optional[str] = None) -> int:
+        """Add documents to FAISS vector store as a new segment, embedding them unless given embeddings from embed().
+
+        Chunks carrying a 'doc_hash' replace any earlier version of their source.
+        Chunks whose text is already stored are dropped. Given embeddings were
+        computed with the vocabulary vocab_name (the current one if None), as
+        returned by embed_with_vocabulary(). Returns the number of chunks added.
+        """
+        return self._write_documents(documents, embeddings, vocab_name, set())
+    
+    def replace_source(self, source: str, documents: List[Dict], embeddings: Optional[np.ndarray] = None,
+                       vocab_name: Optional[str] = None) -> int:
+        """Replace every chunk of source with documents (its new chunks) in one generation.
+
+        Like add_documents otherwise; returns the number of chunks added.
+        """
+        return self._write_documents(documents, embeddings, vocab_name, {source})
+    
+    def delete_source(self, source: str) -> int:
+        """Delete every chunk of source, returning how many were deleted.
+
+        The chunks are tombstoned rather than rewritten, so this costs time in
+        proportion to the source; compaction reclaims the space later.
+        """
+        with self.store.writer_lock():
+            self._load_index()
+            manifest = self.store.read_manifest()
+            if manifest is None:
+                return 0
+            
+            deleted, texts, _ = self._tombstone_sources({source})
+            if not deleted:
+                return 0
+            
+            stats = self._term_stats(manifest)
+            stats.update(self.embedding_model.document_terms(texts), sign=-1)
+            self._commit(manifest, stats, {}, tombstones=self._delete_rows(manifest, deleted))
+        
+        self._schedule_maintenance(_stale_entries(manifest))
+        return len(texts)
+    
+    def _write_documents(self, documents: List[Dict], embeddings: Optional[np.ndarray],
+                         vocab_name: Optional[str], replace: set) -> int:
+        """add_documents, also replacing the sources in replace"""
+        if not documents and not replace:
+            return 0
+        
+        with self.store.writer_lock():
+            if embeddings is None and documents:
+                embeddings, vocab_name = self.embed_with_vocabulary([doc['content'] for doc in documents])
+            else:
+                self._load_index()
+            manifest = self.store.read_manifest() or self.store.new_manifest()
+            new_vocab = manifest['vocab'] is None
+            
+            # Sources ingested before with different content are replaced
+            changed = replace | {doc['source'] for doc in documents if doc.get('doc_hash')
+                                 and self._source_hashes.get(doc['source']) not in (None, doc['doc_hash'])}
+            stats = self._term_stats(manifest)
+            deleted, dropped, dropped_hashes = self._tombstone_sources(changed) if changed else ({}, [], None)
+            
+            # Drop chunks that are already stored or repeated within this batch; the
+            # chunks being replaced do not count as stored
+            hashes = chunk_hashes([doc['content'] for doc in documents])
+            keep = np.zeros(len(documents), dtype=bool)
+            keep[np.unique(hashes, return_index=True)[1]] = True
+            stored = self._stored_mask(hashes)
+            if deleted:
+                stored &= ~np.isin(hashes, dropped_hashes)
+            keep &= ~stored
+            
+            if not keep.any() and not deleted:
+                self._term_stats_cache = (manifest.get('term_stats'), stats)
+                return 0
+            
+            new_segments = {}
+            stats.update(self.embedding_model.document_terms(dropped), sign=-1)
+            if keep.any():
+                # Write the segment with its metadata, then commit it by replacing the manifest
+                kept = [doc for doc, flag in zip(documents, keep) if flag]
+                next_id = manifest.get('next_id', 0)
+                ids = np.arange(next_id, next_id + len(kept), dtype=np.int64)
+                manifest['next_id'] = next_id + len(kept)
+                with INGEST_STAGE_SECONDS.labels('write_segment').time():
+                    segment = self._write_segment([embeddings[keep]], _chunk_writer(kept, ids, hashes[keep]))
+                new_segments[segment.name] = segment
+                stats.update(self.embedding_model.document_terms([doc['content'] for doc in kept]))
+                if new_vocab:
+                    manifest['vocab'] = self.store.write_vocab(self.embedding_model.vocab)
+                    manifest['vocab_docs'] = stats.n_docs
+                manifest['segments'].append({'name': segment.name, 'count': segment.count,
+                                             'vocab': manifest['vocab'] if vocab_name is None else vocab_name})
+            
+            vocabulary = self._write_vocabulary(manifest, stats) if self._needs_new_vocabulary(manifest, stats) else None
+            tombstones = self._delete_rows(manifest, deleted) if deleted else None
+            self._commit(manifest, stats, new_segments, vocabulary, tombstones)
         
-        self.is_trained = True
-        self._save_index()
+        self._schedule_maintenance(_stale_entries(manifest))
+        return int(keep.sum())
+    
+    def compact(self, full: bool = False) -> bool:
+        """Merge the smallest segments (or all of them) into one, dropping deleted chunks; returns True if anything changed.
+
+        Without too many segments, those with more than COMPACTION_DELETED_RATIO
+        of their chunks deleted are rewritten, on their own if need be, to
+        reclaim the space. Tombstones of the dropped chunks are pruned. If the
+        chosen segments are rewritten or deleted elsewhere while they are being
+        merged, the choice is made again from the new generation.
+        """
+        while True:
+            compacted = self._compact_once(full)
+            if compacted is not None:
+                return compacted
     
-    def search(self, query: str, n_results: int = 5) -> List[Dict]:
+    def _compact_once(self, full: bool) -> Optional[bool]:
+        """One compaction attempt: whether anything changed, or None if the chosen segments changed underneath it"""
+        if not self._load_index():
+            return False
+        
+        resident = self._bound
+        segments, tombstones = resident.segments, resident.tombstones
+        if full:
+            chosen = list(segments)
+        elif len(segments) > config.COMPACTION_MAX_SEGMENTS:
+            chosen = sorted(segments, key=tombstones.live_count)[:config.COMPACTION_MERGE_FACTOR]
+        else:
+            chosen = _reclaimable(segments, tombstones)[:config.COMPACTION_MERGE_FACTOR]
+        
+        if not chosen or (len(chosen) == 1 and not len(tombstones.rows(chosen[0]))):
+            return False
+        
+        # Merge in manifest order, outside the writer lock so ingestion is not blocked
+        chosen_names = {segment.name for segment in chosen}
+        chosen = [segment for segment in segments if segment.name in chosen_names]
+        surviving = [(segment, tombstones.live_mask(segment)) for segment in chosen if tombstones.live_count(segment)]
+        merged = None
+        if surviving:
+            # The merged segment may warrant a different index type, so rebuild from the stored vectors
+            blocks = [segment.vectors if keep is None else np.asarray(segment.vectors[keep])
+                      for segment, keep in surviving]
+            with INGEST_STAGE_SECONDS.labels('compaction').time():
+                merged = self._write_segment(blocks, _merged_chunk_writer([segment for segment, _ in surviving],
+                                                                          [keep for _, keep in surviving]))
+        dropped = np.concatenate([np.asarray(segment.chunks.ids[tombstones.rows(segment)]) for segment in chosen])
+        
+        with self.store.writer_lock():
+            manifest = self.store.read_manifest()
+            live = [entry['name'] for entry in manifest['segments']] if manifest else []
+            if not chosen_names.issubset(live):
+                # Deleted or compacted elsewhere in the meantime
+                if merged is not None:
+                    self.store.remove_segments([merged.name])
+                return None if manifest else False
+            
+            position = min(live.index(segment_name) for segment_name in chosen_names)
+            # A merge of segments embedded with different vocabularies is re-embedded as a whole
+            vocabs = {entry.get('vocab', manifest['vocab']) for entry in manifest['segments']
+                      if entry['name'] in chosen_names}
+            entries = [entry for entry in manifest['segments'] if entry['name'] not in chosen_names]
+            if merged is not None:
+                entries.insert(position, {'name': merged.name, 'count': merged.count,
+                                          'vocab': vocabs.pop() if len(vocabs) == 1 else None})
+            manifest['segments'] = entries
+            if len(dropped):
+                # Chunks deleted since the merge started stay tombstoned under their ids in the merged segment
+                remaining = np.setdiff1d(self.store.read_tombstones(manifest.get('tombstones')), dropped)
+                manifest['tombstones'] = self.store.write_tombstones(remaining) if len(remaining) else None
+            manifest['generation'] += 1
+            self.store.write_manifest(manifest)
+            
+            self._publish(manifest, {merged.name: merged} if merged is not None else {})
+            self.store.remove_segments(list(chosen_names))
+            self.store.remove_orphans(manifest)
+        
+        return True
+    
+    def reembed(self) -> bool:
+        """Re-embed one segment left over from an earlier vocabulary; returns True if there may be more to do"""
+        if not self._load_index():
+            return False
+        
+        manifest = self.store.read_manifest()
+        if manifest is None:
+            return False
+        with self.lock.read():
+            current = {segment.name: segment for segment in self.segments}
+            tombstones = self.tombstones
+            vocab_name = self._vocab_name
+            # A private model, so encoding does not hold up writers waiting on this store
+            model = SimpleEmbedding(config.EMBEDDING_DIM)
+            model.set_vocabulary(self.embedding_model.vocab, self.embedding_model.idf)
+        # Segments with every chunk deleted are left for compaction to drop
+        stale = [name for name in _stale_entries(manifest) if name in current and tombstones.live_count(current[name])]
+        if not stale or manifest['vocab'] != vocab_name:
+            return False
+        
+        # Encode the live chunks from their stored text, outside the writer lock so ingestion is not blocked
+        segment = current[stale[0]]
+        keep = tombstones.live_mask(segment)
+        live_rows = np.arange(segment.count) if keep is None else np.flatnonzero(keep)
+        with INGEST_STAGE_SECONDS.labels('reembed').time():
+            blocks = []
+            for start in range(0, len(live_rows), config.EMBEDDING_BATCH_SIZE):
+                rows = live_rows[start:start + config.EMBEDDING_BATCH_SIZE]
+                block = model.encode([segment.chunks.content(row) for row in rows])
+                faiss.normalize_L2(block)
+                blocks.append(block)
+            reembedded = self._write_segment(blocks, _merged_chunk_writer([segment], [keep]))
+        dropped = np.asarray(segment.chunks.ids[tombstones.rows(segment)])
+        
+        with self.store.writer_lock():
+            manifest = self.store.read_manifest()
+            live = [entry['name'] for entry in manifest['segments']] if manifest else []
+            if segment.name not in live or manifest['vocab'] != vocab_name:
+                # Rewritten, deleted or the vocabulary changed again in the meantime
+                self.store.remove_segments([reembedded.name])
+                return manifest is not None
+            
+            manifest['segments'][live.index(segment.name)] = {'name': reembedded.name, 'count': reembedded.count,
+                                                               'vocab': vocab_name}
+            if len(dropped):
+                # As in compact, chunks deleted since the re-embedding started stay tombstoned
+                remaining = np.setdiff1d(self.store.read_tombstones(manifest.get('tombstones')), dropped)
+                manifest['tombstones'] = self.store.write_tombstones(remaining) if len(remaining) else None
+            manifest['generation'] += 1
+            self.store.write_manifest(manifest)
+            
+            self._publish(manifest, {reembedded.name: reembedded})
+            self.store.remove_segments([segment.name])
+            if len(dropped):
+                self.store.remove_orphans(manifest)
+        
+        return True
+    
+    def _schedule_maintenance(self, stale: List[str]):
+        """Start background compaction and re-embedding if there are too many or stale segments"""
+        global _maintenance_thread, _maintenance_rerun
+        if (len(self.segments) <= config.COMPACTION_MAX_SEGMENTS and not stale
+                and not _reclaimable(self.segments, self.tombstones)):
+            return
+        
+        with _resident_lock:
+            if _maintenance_thread is not None:
+                # The running pass may have looked already; have it look again before it exits
+                _maintenance_rerun = True
+                return
+            _maintenance_thread = threading.Thread(target=_maintain_in_background,
+                                                   name="faiss-maintenance", daemon=True)
+            _maintenance_thread.start()
+    
+    def search(self, query: str, n_results: int = 5, filter: Optional[Dict] = None) -> List[Dict]:
         """Search for relevant documents"""
-        if not self._load_index() or self.index is None:
-            return []
+        return self.search_batch([query], n_results, filter)[0]
+    
+    def _search_segment(self, segment: _Segment, queries: np.ndarray, k: int,
+                        selection) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k scores and rows of one segment, restricted to a filter's selection if given"""
+        # Rows matching a narrow metadata filter are cheaper to score directly than to pick out of the
+        # index; a selection that only hides deleted rows is left to the index however small the segment
+        narrow = selection is not None and selection.filtered and (
+            len(selection) <= max(k, config.SEARCH_FILTER_EXACT_ROWS) or not supports_selection(segment.index))
+        if narrow:
+            return selection.exact_search(segment.vectors, queries, k)
         
-        # Generate query embedding
-        query_embedding = self.embedding_model.encode([query])
-        faiss.normalize_L2(query_embedding)
+        # Quantized indexes rank by compressed codes; over-fetch and re-score with the stored vectors
+        fetch = k * config.RERANK_FACTOR if config.RERANK_FACTOR > 1 and is_quantized(segment.index) else k
+        if selection is None:
+            scores, rows = segment.index.search(queries, min(fetch, segment.count))
+        elif supports_selection(segment.index):
+            scores, rows = segment.index.search(queries, fetch,
+                                                params=search_parameters(segment.index, selection.selector))
+        else:
+            # No selector for this index: search past the deleted rows and drop them
+            scores, rows = segment.index.search(queries, min(fetch + segment.count - len(selection), segment.count))
+            hidden = ~selection.contains(rows)
+            scores[hidden], rows[hidden] = -np.inf, -1
+            top = np.argsort(-scores, axis=1, kind='stable')[:, :fetch]
+            scores, rows = np.take_along_axis(scores, top, axis=1), np.take_along_axis(rows, top, axis=1)
+        if fetch > k:
+            scores, rows = rerank(segment.vectors, queries, rows, k)
         
-        # Search
-        scores, indices = self.index.search(query_embedding, min(n_results, len(self.metadata)))
+        if selection is not None:
+            # Approximate indexes can come up short when few probed neighbours match; those queries go exact
+            short = (rows >= 0).sum(axis=1) < k
+            if short.any():
+                scores[short], rows[short] = selection.exact_search(segment.vectors, queries[short], k)
+        return scores, rows
+    
+    def _vector_search(self, query_embeddings: np.ndarray, k: int, segments: List[_Segment],
+                       selections: List) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Overall top-k (similarities, segment ids, rows) of each query across segments"""
+        n_queries = len(query_embeddings)
+        all_scores, all_segments, all_rows = [], [], []
+        for segment_id, (segment, selection) in enumerate(zip(segments, selections)):
+            if segment.count == 0 or selection is False:
+                continue
+            scores, rows = self._search_segment(segment, query_embeddings, k, selection)
+            all_scores.append(scores)
+            all_rows.append(rows)
+            all_segments.append(np.full(rows.shape, segment_id, dtype=np.int32))
         
-        # Format results
-        documents = []
-        for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-            if idx != -1 and idx < len(self.metadata):  # Valid index
-                documents.append({
-                    'content': self.metadata[idx]['content'],
-                    'metadata': {
-                        'source': self.metadata[idx]['source'],
-                        'type': self.metadata[idx]['type'],
-                        'chunk_id': self.metadata[idx]['chunk_id']
-                    },
-                    'distance': 1.0 - score,  # Convert similarity to distance
-                    'similarity': score
-                })
+        if not all_scores:
+            return (np.full((n_queries, 0), -np.inf, dtype=np.float32),
+                    np.zeros((n_queries, 0), dtype=np.int32), np.full((n_queries, 0), -1, dtype=np.int64))
         
-        return documents
+        scores = np.hstack(all_scores)
+        rows = np.hstack(all_rows).astype(np.int64)
+        segment_ids = np.hstack(all_segments)
+        scores[rows < 0] = -np.inf
+        
+        # Keep the overall best k per query
+        k = min(k, scores.shape[1])
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(k), scores.shape).copy()
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.take_along_axis(top, np.argsort(-top_scores, axis=1, kind='stable'), axis=1)
+        
+        scores = np.take_along_axis(scores, order, axis=1)
+        rows = np.take_along_axis(rows, order, axis=1)
+        rows[np.isneginf(scores)] = -1
+        return scores, np.take_along_axis(segment_ids, order, axis=1), rows
+    
+    def _keyword_search(self, query: str, k: int, segments: List[_Segment],
+                        selections: List) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k BM25 (segment ids, rows) for one query, best first"""
+        hashes = term_hashes(set(tokenize(query)))
+        if not len(hashes):
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+        
+        # Document frequencies and lengths are taken over the whole corpus
+        indexes = [segment.bm25 for segment in segments]
+        idf, avgdl = corpus_idf(indexes, hashes)
+        
+        all_scores, all_segments, all_rows = [], [], []
+        for segment_id, (index, selection) in enumerate(zip(indexes, selections)):
+            if selection is False:
+                continue
+            rows, scores = index.score(hashes, idf, avgdl, config.BM25_K1, config.BM25_B)
+            if selection is not None:
+                keep = selection.contains(rows)
+                rows, scores = rows[keep], scores[keep]
+            all_scores.append(scores)
+            all_rows.append(rows)
+            all_segments.append(np.full(len(rows), segment_id, dtype=np.int32))
+        
+        if not all_scores:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+        
+        scores = np.concatenate(all_scores)
+        top = np.argsort(-scores, kind='stable')[:k]
+        return np.concatenate(all_segments)[top], np.concatenate(all_rows)[top].astype(np.int64)
+    
+    def search_batch(self, queries: List[str], k: int = 5, filter: Optional[Dict] = None) -> SearchResults:
+        """Search for many queries at once with one embedding pass and one FAISS call per segment.
+        
+        With HYBRID_SEARCH, each retriever contributes HYBRID_CANDIDATES * k hits and
+        the vector and BM25 rankings are combined by reciprocal rank fusion; results
+        are in fused order and 'similarity' stays the cosine similarity.
+        
+        filter optionally restricts hits by metadata, e.g. {'source': [...], 'type': 'pdf'};
+        each value is a string or a collection of accepted strings. Only matching rows are
+        searched, so a filtered query returns k hits whenever at least k chunks match.
+        """
+        if not queries or k <= 0 or not self._load_index():
+            return SearchResults.empty(len(queries))
+        
+        # Searches share the read lock; a generation swap waits for them to finish
+        with self.lock.read():
+            if not self.is_trained:
+                return SearchResults.empty(len(queries))
+            return self._search_batch(queries, k, filter)
+    
+    def _search_batch(self, queries: List[str], k: int, filter: Optional[Dict]) -> SearchResults:
+        """search_batch with the read lock held"""
+        n_queries = len(queries)
+        
+        # Generate query embeddings
+        with span('embed_query'):
+            query_embeddings = self.embedding_model.encode(list(queries))
+            faiss.normalize_L2(query_embeddings)
+        
+        segments = self.segments
+        selections = [segment.selection(filter, self.tombstones) for segment in segments]
+        if not config.HYBRID_SEARCH:
+            with span('vector_search'):
+                return SearchResults(*self._vector_search(query_embeddings, k, segments, selections), segments)
+        
+        n_candidates = k * config.HYBRID_CANDIDATES
+        with span('vector_search'):
+            vector_scores, vector_segments, vector_rows = self._vector_search(query_embeddings, n_candidates,
+                                                                              segments, selections)
+        
+        similarities = np.full((n_queries, k), -np.inf, dtype=np.float32)
+        segment_ids = np.zeros((n_queries, k), dtype=np.int32)
+        rows = np.full((n_queries, k), -1, dtype=np.int64)
+        for query_id, query in enumerate(queries):
+            with span('keyword_search'):
+                keyword_segments, keyword_rows = self._keyword_search(query, n_candidates, segments, selections)
+            
+            # Reciprocal rank fusion: each list adds 1 / (RRF_K + rank) to a hit's score
+            fused, known, unranked = {}, {}, []
+            for rank, (segment_id, row, score) in enumerate(zip(vector_segments[query_id],
+                                                                vector_rows[query_id], vector_scores[query_id])):
+                if row < 0:
+                    break
+                hit = (int(segment_id), int(row))
+                known[hit] = score
+                if score <= 0:
+                    # Vectors sharing no words with the query are ranked arbitrarily, so they do not vote
+                    unranked.append(hit)
+                else:
+                    fused[hit] = 1.0 / (config.RRF_K + rank + 1)
+            for rank, hit in enumerate(zip(keyword_segments.tolist(), keyword_rows.tolist())):
+                fused[hit] = fused.get(hit, 0.0) + 1.0 / (config.RRF_K + rank + 1)
+            
+            ranked = sorted(fused, key=fused.get, reverse=True)[:k]
+            if len(ranked) < k:
+                # Search returns k hits whenever k chunks match, as without HYBRID_SEARCH
+                ranked.extend([hit for hit in unranked if hit not in fused][:k - len(ranked)])
+            for slot, hit in enumerate(ranked):
+                segment_id, row = hit
+                if hit not in known:
+                    # Keyword-only hit: score it against its stored vector
+                    known[hit] = float(np.dot(segments[segment_id].vectors[row], query_embeddings[query_id]))
+                similarities[query_id, slot] = known[hit]
+                segment_ids[query_id, slot] = segment_id
+                rows[query_id, slot] = row
+        
+        return SearchResults(similarities, segment_ids, rows, segments)
     
     def get_collection_info(self) -> Dict:
         """Get information about the vector store"""
-        if self._load_index() and self.index is not None:
-            return {
-                'count': self.index.ntotal,
-                'exists': True,
-                'dimension': config.EMBEDDING_DIM
-            }
+        if self._load_index():
+            with self.lock.read():
+                if self.is_trained:
+                    return {
+                        'count': self._bound.count,
+                        'deleted': sum(segment.count for segment in self.segments) - self._bound.count,
+                        'exists': True,
+                        'dimension': config.EMBEDDING_DIM,
+                        'generation': self.generation,
+                        'segments': len(self.segments),
+                        'index_types': sorted({type(segment.index).__name__ for segment in self.segments})
+                    }
         return {'count': 0, 'exists': False, 'dimension': config.EMBEDDING_DIM}
     
     def delete_collection(self) -> bool:
         """Delete the entire vector store"""
+        global _resident
         try:
-            # Remove files
-            if config.FAISS_INDEX_FILE.exists():
-                config.FAISS_INDEX_FILE.unlink()
-            if config.METADATA_FILE.exists():
-                config.METADATA_FILE.unlink()
-            
-            # Reset state
-            self.index = None
-            self.metadata = []
-            self.is_trained = False
-            self.embedding_model = SimpleEmbedding(config.EMBEDDING_DIM)
+            # Searches on this store finish before any file goes away
+            with self.store.writer_lock(), self.lock.write():
+                # Commit an empty generation first so a crash cannot resurrect old data
+                manifest = self.store.read_manifest() or self.store.new_manifest()
+                self.store.clear(manifest)
+                
+                # Remove files from earlier single-file versions
+                if config.FAISS_INDEX_FILE.exists():
+                    config.FAISS_INDEX_FILE.unlink()
+                if config.METADATA_FILE.exists():
+                    config.METADATA_FILE.unlink()
+                
+                # Reset state
+                with _resident_lock:
+                    _resident = None
+                
+                self.segments = []
+                self.is_trained = False
+                self.embedding_model = SimpleEmbedding(config.EMBEDDING_DIM)
+                self._vocab_name = None
+                self._source_hashes = {}
+                self.tombstones = _Tombstones(None, np.zeros(0, dtype=np.int64))
+                self._bound = None
             
             return True
         except Exception as e:
             print(f"Error deleting collection: {e}")
             return False
+
+
+def _chunk_writer(documents: List[Dict], ids: np.ndarray, hashes: Optional[np.ndarray] = None):
+    """Segment writer for a chunk store and keyword index of new chunks with the given stable ids"""
+    def write(directory):
+        ChunkStore.write(directory, documents, ids, hashes)
+        BM25Index.write(directory, (doc['content'] for doc in documents))
+    return write
+
+
+def _merged_chunk_writer(segments: List[_Segment], keep: Optional[List[Optional[np.ndarray]]] = None):
+    """Segment writer concatenating the chunk stores and keyword indexes of existing segments"""
+    def write(directory):
+        ChunkStore.write_merged(directory, [segment.chunks for segment in segments], keep)
+        BM25Index.write_merged(directory, [segment.bm25 for segment in segments], keep)
+    return write
+
+
+def _reclaimable(segments: List[_Segment], tombstones: _Tombstones) -> List[_Segment]:
+    """Segments with enough of their chunks deleted to be worth rewriting"""
+    return [segment for segment in segments
+            if len(tombstones.rows(segment)) > config.COMPACTION_DELETED_RATIO * segment.count]
+
+
+def _stale_entries(manifest: Dict) -> List[str]:
+    """Names of the manifest's segments embedded with a vocabulary other than its current one"""
+    return [entry['name'] for entry in manifest['segments']
+            if entry.get('vocab', manifest['vocab']) != manifest['vocab']]
+
+
+def _maintain_in_background():
+    """Compact and re-embed stale segments until neither has work left, compacting first after every step.
+
+    Writes that schedule maintenance while this runs set _maintenance_rerun,
+    so the work they leave is checked for before the thread exits.
+    """
+    global _maintenance_thread, _maintenance_rerun
+    try:
+        store = FAISSVectorStore()
+        while True:
+            while store.compact() or store.reembed():
+                pass
+            with _resident_lock:
+                if not _maintenance_rerun:
+                    _maintenance_thread = None
+                    return
+                _maintenance_rerun = False
+    except Exception as e:
+        print(f"Error maintaining index: {e}")
+        with _resident_lock:
+            _maintenance_thread = None
+
+
+def wait_for_maintenance(timeout: Optional[float] = None) -> bool:
+    """Wait for background compaction and re-embedding to finish; returns False if it is still running"""
+    with _resident_lock:
+        thread = _maintenance_thread
+    if thread is not None:
+        thread.join(timeout)
+        return not thread.is_alive()
+    return True